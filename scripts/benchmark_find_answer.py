@@ -0,0 +1,83 @@
+"""Benchmark of `find_answer` against the previous regex implementation
+
+Uses the real `complete_response` texts of results/exp*.json, plus
+long synthetic reasoning-style texts where the old greedy regex
+backtracks. Run from the repository root:
+
+    python -m scripts.benchmark_find_answer
+"""
+import glob
+import re
+from time import perf_counter
+
+from utils.eval_utils import find_answer
+from utils.results_utils import load_results
+
+
+def find_answer_regex(input_string: str) -> str:
+    """Previous regex implementation of `find_answer`, kept as reference"""
+    pattern = r".*(?:\\boxed\{|\\x08oxed\{)(.*)\}"
+    input_string = input_string.replace(' ', '').replace('\n', '')
+    matches = list(re.finditer(pattern, input_string))
+    if not matches:
+        return ""
+    ans = matches[-1].group(1)
+    return (
+        ans.replace('\\', '').replace('{', '').replace('}', '')
+        .replace('text', '').replace('left', '').replace('right', '')
+    )
+
+
+def load_responses(pattern: str = "results/exp*.json") -> list[str]:
+    return [
+        step["complete_response"]
+        for path in sorted(glob.glob(pattern))
+        for history in load_results(path).values()
+        for step in history
+    ]
+
+
+def synthetic_responses(n: int = 20, n_lines: int = 200) -> list[str]:
+    """Long reasoning-like outputs with many braces; half have no
+    boxed answer at all, which is the worst case for the regex"""
+    line = "We compute \\frac{a}{b} using {the} table values {x}.\n"
+    responses = []
+    for ix in range(n):
+        body = line * n_lines
+        if ix % 2 == 0:
+            body += "\\boxed{divide(subtract(5, 2), 2)}"
+        responses.append(body)
+    return responses
+
+
+def time_function(function, texts: list[str]) -> float:
+    start = perf_counter()
+    for text in texts:
+        function(text)
+    return perf_counter() - start
+
+
+def run_benchmark():
+    for name, texts in [
+        ("results/exp*.json", load_responses()),
+        ("synthetic long", synthetic_responses()),
+    ]:
+        megabytes = sum(len(text) for text in texts) / 1e6
+        # Disagreements are expected where the regex captured text after
+        # the boxed answer up to the last "}" of the response
+        agreement = sum(
+            find_answer(text) == find_answer_regex(text) for text in texts
+        ) / len(texts)
+        old_time = time_function(find_answer_regex, texts)
+        new_time = time_function(find_answer, texts)
+        print(
+            f"{name}: {len(texts)} texts, {megabytes:.2f} MB\n"
+            f"    regex:       {megabytes / old_time:8.2f} MB/s\n"
+            f"    single-pass: {megabytes / new_time:8.2f} MB/s "
+            f"({old_time / new_time:.1f}x)\n"
+            f"    agreement:   {agreement:.1%}"
+        )
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,263 @@
+"""Micro-benchmarks of the pure-Python hot paths of data_utils/eval_utils
+
+Inputs are the committed results/exp*.json responses and synthetic
+(seeded) large tables and texts, so every run measures the same work.
+Each case is timed as the best of `--repeat` runs; times are divided by
+a fixed pure-Python calibration loop, which makes a baseline saved on
+one machine usable on another. Cases over the tolerance are timed a
+second time before they count as regressions.
+
+    python -m scripts.benchmark_hot_paths --save-baseline
+    python -m scripts.benchmark_hot_paths   # exits 1 on a regression
+
+The baseline is stored in scripts/benchmark_hot_paths_baseline.json.
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import sys
+import timeit
+
+import pandas as pd
+
+from utils.data_utils import get_context, table_to_sentences, text_cleaner
+from utils.eval_utils import (
+    cleanup_answer, compare_answers, evaluate_experiment, evaluate_maths,
+    find_answer)
+from utils.expression_utils import compile_expression
+from utils.results_utils import load_results
+
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(__file__), "benchmark_hot_paths_baseline.json")
+
+
+def synthetic_table(
+    n_rows: int, n_cols: int, rng: random.Random,
+) -> list[list[str]]:
+    """Table in the ConvFinQA layout (header row, then value rows)"""
+    header = [""] + [f"{2000 + ix}" for ix in range(n_cols - 1)]
+    rows = [
+        [f"line item {row}"] + [
+            f"${rng.randint(1, 10**6):,}" for _ in range(n_cols - 1)]
+        for row in range(n_rows)
+    ]
+    return [header] + rows
+
+
+def synthetic_text(n_sentences: int, rng: random.Random) -> list[str]:
+    """Pre/post text sentences, with the dataset's ' .' endings"""
+    words = ["revenue", "increased", "the", "segment", "net", "of",
+             "million", "compared", "to", "prior", "year", ",", ";"]
+    return [
+        " ".join(rng.choice(words) for _ in range(rng.randint(8, 40))) + " ."
+        for _ in range(n_sentences)
+    ]
+
+
+def load_inputs(seed: int = 0) -> dict:
+    """Benchmark inputs: real responses and synthetic tables/texts"""
+    rng = random.Random(seed)
+    steps = [
+        step
+        for path in sorted(glob.glob("results/exp*.json"))
+        for history in load_results(path).values()
+        for step in history
+    ]
+    responses = [str(step.get("complete_response")) for step in steps]
+    predictions = [find_answer(response) for response in responses]
+
+    evaluated, ground_truths = [], []
+    for prediction, step in zip(predictions, steps):
+        try:
+            value = evaluate_maths(prediction)
+            float(value)
+            float(cleanup_answer(step.get("annotator_answer")))
+        except Exception:
+            continue
+        evaluated.append(value)
+        ground_truths.append(step.get("annotator_answer"))
+
+    tables = [synthetic_table(200, 12, rng) for _ in range(20)]
+    entries = [
+        pd.Series({
+            "pre_text": synthetic_text(60, rng),
+            "post_text": synthetic_text(60, rng),
+            "table": synthetic_table(40, 8, rng),
+        })
+        for _ in range(50)
+    ]
+    return {
+        "responses": responses,
+        "predictions": predictions,
+        "comparisons": list(zip(evaluated, ground_truths)),
+        "tables": tables,
+        "texts": [synthetic_text(500, rng) for _ in range(20)],
+        "entries": entries,
+        "experiment": load_results("results/exp8.json")
+        if os.path.exists("results/exp8.json") else {},
+    }
+
+
+def _evaluate_maths_cold(predictions: list[str]):
+    # Clears the parse cache so that every run does the full work
+    compile_expression.cache_clear()
+    for prediction in predictions:
+        try:
+            evaluate_maths(prediction)
+        except Exception:
+            pass
+
+
+def _evaluate_experiment_quiet(experiment: dict):
+    compile_expression.cache_clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        evaluate_experiment(experiment)
+
+
+def benchmark_cases(inputs: dict) -> dict:
+    """Case name -> (function of no arguments, number of items)"""
+    return {
+        "table_to_sentences": (
+            lambda: [table_to_sentences(t) for t in inputs["tables"]],
+            len(inputs["tables"])),
+        "text_cleaner": (
+            lambda: [text_cleaner(t) for t in inputs["texts"]],
+            len(inputs["texts"])),
+        "get_context": (
+            lambda: [get_context(e) for e in inputs["entries"]],
+            len(inputs["entries"])),
+        "find_answer": (
+            lambda: [find_answer(r) for r in inputs["responses"]],
+            len(inputs["responses"])),
+        "cleanup_answer": (
+            lambda: [cleanup_answer(p) for p in inputs["predictions"]],
+            len(inputs["predictions"])),
+        "evaluate_maths": (
+            lambda: _evaluate_maths_cold(inputs["predictions"]),
+            len(inputs["predictions"])),
+        "compare_answers": (
+            lambda: [compare_answers(p, g) for p, g in inputs["comparisons"]],
+            len(inputs["comparisons"])),
+        "evaluate_experiment": (
+            lambda: _evaluate_experiment_quiet(inputs["experiment"]),
+            max(sum(len(h) for h in inputs["experiment"].values()), 1)),
+    }
+
+
+def _calibration():
+    total = 0
+    for ix in range(200_000):
+        total += ix % 7
+    return total
+
+
+def time_function(function, repeat: int) -> float:
+    """Best time of one call, in seconds"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run_benchmark(repeat: int = 5, cases: list[str] | None = None) -> dict:
+    """Times every case
+
+    Args:
+        repeat (int): runs per case, the best one is kept. Defaults to 5.
+        cases (list[str] | None): subset of the cases. Defaults to None.
+
+    Returns:
+        dict: calibration time and, per case, seconds per call,
+            microseconds per item and time relative to the calibration
+    """
+    inputs = load_inputs()
+    timings = {}
+    for name, (function, n_items) in benchmark_cases(inputs).items():
+        if cases and name not in cases:
+            continue
+        timings[name] = (time_function(function, repeat), n_items)
+    # Calibrated after the cases too, once the machine is warm
+    calibration = min(
+        time_function(_calibration, repeat) for _ in range(2))
+
+    return {
+        "calibration": calibration,
+        "cases": {
+            name: {
+                "seconds": seconds,
+                "us_per_item": 1e6 * seconds / n_items,
+                "relative": seconds / calibration,
+            }
+            for name, (seconds, n_items) in timings.items()
+        },
+    }
+
+
+def check_regressions(
+    report: dict, baseline: dict, tolerance: float = 1.5,
+) -> pd.DataFrame:
+    """Compares a report with a baseline
+
+    Args:
+        report (dict): output of `run_benchmark`
+        baseline (dict): a previously saved report
+        tolerance (float): allowed slowdown of the calibrated time
+            before a case counts as a regression. Defaults to 1.5.
+
+    Returns:
+        pd.DataFrame: one row per case present in both, with the
+            calibrated speed ratio (>1 is slower) and a regression flag
+    """
+    rows = {
+        name: {
+            "us_per_item": case["us_per_item"],
+            "baseline_us_per_item": baseline["cases"][name]["us_per_item"],
+            "ratio": case["relative"] / baseline["cases"][name]["relative"],
+        }
+        for name, case in report["cases"].items()
+        if name in baseline["cases"]
+    }
+    comparison = pd.DataFrame.from_dict(rows, orient="index")
+    comparison["regression"] = comparison["ratio"] > tolerance
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cases", nargs="+", default=None)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    args = parser.parse_args()
+
+    report = run_benchmark(args.repeat, args.cases)
+    print(pd.DataFrame(report["cases"]).T.to_string(
+        float_format="{:.4g}".format))
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        comparison = check_regressions(report, baseline, args.tolerance)
+        if comparison["regression"].any():
+            # Timings are noisy: regressions must show up twice
+            retimed = run_benchmark(
+                args.repeat, list(comparison.index[comparison["regression"]]))
+            retimed_comparison = check_regressions(
+                retimed, baseline, args.tolerance)
+            comparison.loc[retimed_comparison.index] = retimed_comparison
+        print(comparison.to_string(float_format="{:.3f}".format))
+        if comparison["regression"].any():
+            print("Regression in: "
+                  + ", ".join(comparison.index[comparison["regression"]]))
+            sys.exit(1)
+    else:
+        print(f"No baseline at {args.baseline}, run with --save-baseline")
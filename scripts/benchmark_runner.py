@@ -0,0 +1,178 @@
+"""Load test of the experiment runner against the local mock backend
+
+Runs `run_experiment` (async) and `converse_llm` (sync) over synthetic
+conversations with a `utils.mock_utils` client, so that the client side
+of the pipeline (prompt building, retries, rate limiting, parsing,
+instrumentation) is measured without calling the real API.
+Reports conversations/s, p95 step latency and the client CPU time per
+request at each concurrency level. Run from the repository root:
+
+    python -m scripts.benchmark_runner --concurrency 1 8 32 --error-rate 0.05
+    python -m scripts.benchmark_runner --latency-sigma 1 --hedge-quantile 0.9
+"""
+import argparse
+import asyncio
+from time import monotonic, process_time
+
+import pandas as pd
+
+from utils.mock_utils import MockBackendConfig, mock_async_client, mock_client
+from utils.model_utils import RunConfig, converse_llm, run_experiment
+from utils.results_utils import results_to_frame
+
+
+def synthetic_entries(
+    n_entries: int = 200, n_steps: int = 3, context_chars: int = 4000,
+) -> list[dict]:
+    """Processed-like entries with a context of realistic size
+
+    Contexts are distinct so that no two entries share a prompt prefix
+
+    Args:
+        n_entries (int): number of entries. Defaults to 200.
+        n_steps (int): questions per conversation. Defaults to 3.
+        context_chars (int): characters of each context.
+            Defaults to 4000.
+
+    Returns:
+        list[dict]: entries usable by `async_converse_llm`
+    """
+    filler = "the net revenue of the segment increased over the year . "
+    return [
+        {
+            "full_context": (
+                f"Context:\n\nfiling {ix} " + filler * (
+                    context_chars // len(filler) + 1))[:context_chars],
+            "step_by_step_questions": [
+                f"what was the value in year {step} of filing {ix}?"
+                for step in range(n_steps)],
+            "step_by_step_answers": ["25587"] * n_steps,
+        }
+        for ix in range(n_entries)
+    ]
+
+
+def _summary(histories, wall_time: float, cpu_time: float,
+             n_requests: int) -> dict:
+    steps = results_to_frame(list(histories))
+    latency = steps["latency"].astype(float)
+    return {
+        "conversations_per_sec": len(histories) / wall_time,
+        "requests_per_sec": n_requests / wall_time,
+        "p50_latency": latency.quantile(0.50),
+        "p95_latency": latency.quantile(0.95),
+        "cpu_ms_per_request": 1000 * cpu_time / max(n_requests, 1),
+        "failed_steps": int(steps["error"].notna().sum()),
+        "hedged_steps": int(steps["hedged"].fillna(False).sum()),
+        "wall_time": wall_time,
+    }
+
+
+def benchmark_async(
+    entries: list[dict], concurrency: int, backend: MockBackendConfig,
+    stream: bool = False, run_settings: dict | None = None,
+) -> dict:
+    """One `run_experiment` at a given concurrency
+
+    Args:
+        entries (list[dict]): output of `synthetic_entries`
+        concurrency (int): max conversations in flight
+        backend (MockBackendConfig): mock backend behaviour
+        stream (bool): stream the completions. Defaults to False.
+        run_settings (dict | None): other RunConfig settings, e.g.
+            hedging. Defaults to None.
+
+    Returns:
+        dict: throughput, latency and CPU overhead figures
+    """
+    client = mock_async_client(backend)
+    run_config = RunConfig(
+        model_name="mock", max_concurrency=concurrency,
+        progress_every=len(entries) + 1, group_by_prefix=False,
+        stream=stream, **(run_settings or {}))
+
+    start_wall, start_cpu = monotonic(), process_time()
+    histories = asyncio.run(run_experiment(entries, run_config, client))
+    return _summary(
+        histories, monotonic() - start_wall, process_time() - start_cpu,
+        client.mock_transport.requests)
+
+
+def benchmark_sync(entries: list[dict], backend: MockBackendConfig) -> dict:
+    """Sequential `converse_llm` over the entries (concurrency 1)"""
+    client = mock_client(backend)
+    start_wall, start_cpu = monotonic(), process_time()
+    histories = [
+        converse_llm(entry, client, "mock") for entry in entries]
+    return _summary(
+        histories, monotonic() - start_wall, process_time() - start_cpu,
+        client.mock_transport.requests)
+
+
+def run_benchmark(
+    concurrency_levels: list[int], n_entries: int, n_steps: int,
+    backend: MockBackendConfig, stream: bool = False,
+    include_sync: bool = True, run_settings: dict | None = None,
+) -> pd.DataFrame:
+    """Benchmark table, one row per runner and concurrency level"""
+    entries = synthetic_entries(n_entries, n_steps)
+    rows = {}
+    if include_sync:
+        # The sync path is sequential: a smaller sample keeps it short
+        rows[("converse_llm", 1)] = benchmark_sync(
+            entries[:max(n_entries // 10, 1)], backend)
+    for concurrency in concurrency_levels:
+        rows[("run_experiment", concurrency)] = benchmark_async(
+            entries, concurrency, backend, stream=stream,
+            run_settings=run_settings)
+
+    report = pd.DataFrame.from_dict(rows, orient="index")
+    report.index.names = ["runner", "concurrency"]
+    with pd.option_context("display.float_format", "{:.3f}".format,
+                           "display.max_columns", None,
+                           "display.width", 160):
+        print(report)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+",
+                        default=[1, 4, 16, 64])
+    parser.add_argument("--entries", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="median latency of the mock backend (s)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--no-sync", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hedge-after", type=float, default=None,
+                        help="hedge attempts slower than this (s)")
+    parser.add_argument("--hedge-quantile", type=float, default=None,
+                        help="hedge attempts slower than this latency "
+                             "quantile, e.g. 0.95")
+    parser.add_argument("--max-hedge-ratio", type=float, default=0.1)
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="fail calls (retries included) slower "
+                             "than this (s)")
+    args = parser.parse_args()
+
+    run_benchmark(
+        args.concurrency, args.entries, args.steps,
+        MockBackendConfig(
+            latency_median=args.latency, latency_sigma=args.latency_sigma,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            retry_after=args.retry_after, seed=args.seed),
+        stream=args.stream, include_sync=not args.no_sync,
+        run_settings={
+            "hedge_after": args.hedge_after,
+            "hedge_quantile": args.hedge_quantile,
+            "max_hedge_ratio": args.max_hedge_ratio,
+            "call_deadline": args.deadline,
+        },
+    )
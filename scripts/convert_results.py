@@ -0,0 +1,36 @@
+"""Converts results files between the .json, .jsonl and .parquet formats
+
+Each input is written next to it (or to `--output-dir`) with the
+extension given by `--to`. Run from the repository root:
+
+    python -m scripts.convert_results results/exp*.json --to parquet
+"""
+import argparse
+import os
+
+from utils.results_utils import convert_results
+
+
+def main(paths: list[str], to: str, output_dir: str | None = None):
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        destination = os.path.join(
+            output_dir or os.path.dirname(path), f"{stem}.{to}")
+        if os.path.abspath(destination) == os.path.abspath(path):
+            print(f"Skipping {path}, already in the {to} format")
+            continue
+        convert_results(path, destination)
+        print(f"{path} ({os.path.getsize(path) / 1024:.0f} KB) -> "
+              f"{destination} ({os.path.getsize(destination) / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="results files to convert")
+    parser.add_argument("--to", choices=["json", "jsonl", "parquet"],
+                        default="parquet")
+    parser.add_argument("--output-dir", default=None)
+    args = parser.parse_args()
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    main(args.paths, args.to, args.output_dir)
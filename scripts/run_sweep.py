@@ -0,0 +1,131 @@
+"""Runs a sweep of experiments described by a JSON config
+
+The config gives the data sample, throughput limits and either a
+`grid` (expanded with `utils.sweep_utils.expand_grid`) or explicit
+`experiments` (name -> settings), on top of the `base` settings.
+`sys_prompt` values may name a prompt of `utils.prompts`; `http` holds
+the client settings (`utils.model_utils.HttpSettings`).
+The runs share one retry policy: its settings (`max_attempts`,
+`call_deadline`, ..., see `utils.sweep_utils.SWEEP_RETRY_FIELDS`) go
+in `base` and may not vary between the experiments.
+`sample_size` entries are drawn with `DataFrame.sample`, or, with
+`"sampling": "notebook"`, with replacement as scripts/model_run.ipynb
+draws them (so that its sample is reproduced for the same seed).
+See scripts/sweep_notebook.json, which reruns exp1-exp10 of
+scripts/model_run.ipynb as a single sweep. Run from the repository root:
+
+    DEEPSEEK_API=... python -m scripts.run_sweep scripts/sweep_notebook.json
+"""
+import argparse
+import asyncio
+import json
+
+import numpy as np
+
+from utils import prompts
+from utils.cache_utils import ResponseCache
+from utils.data_utils import load_processed_data
+from utils.model_utils import HttpSettings, make_async_client
+from utils.sweep_utils import expand_grid, make_run_config, run_sweep
+
+
+def _prompt(name: str) -> str:
+    """Prompt of `utils.prompts` called `name` ("" for no prompt)"""
+    if not name:
+        return ""
+    if not name.isidentifier() or not hasattr(prompts, name):
+        raise ValueError(f"Unknown prompt {name!r} in utils.prompts")
+    return getattr(prompts, name)
+
+
+def _resolve_prompts(settings: dict) -> dict:
+    """Replaces prompt names (e.g. "SYSTEM_PROMPT_V3") by the prompts"""
+    resolved = dict(settings)
+    sys_prompt = resolved.get("sys_prompt")
+    if isinstance(sys_prompt, list):
+        resolved["sys_prompt"] = {name: _prompt(name) for name in sys_prompt}
+    elif isinstance(sys_prompt, str):
+        resolved["sys_prompt"] = _prompt(sys_prompt)
+    return resolved
+
+
+def sample_entries(
+    processed, size: int, seed: int | None = None, sampling: str = "sample",
+):
+    """Sample of the processed entries a sweep runs on
+
+    Args:
+        processed (pd.Series): processed entries
+        size (int): number of entries
+        seed (int | None): random seed. Defaults to None.
+        sampling (str): "sample" (`Series.sample`, without
+            replacement) or "notebook" (the draw of
+            scripts/model_run.ipynb: `np.random.choice` with
+            replacement after one `np.random.random()`, indexed by
+            position in the sample). Defaults to "sample".
+
+    Returns:
+        pd.Series: sampled entries
+    """
+    if sampling == "sample":
+        return processed.sample(size, random_state=seed)
+    if sampling == "notebook":
+        rng = np.random.RandomState(seed)
+        rng.random_sample()
+        positions = rng.choice(len(processed), size)
+        return processed.iloc[positions].reset_index(drop=True)
+    raise ValueError(f"Unknown sampling {sampling!r}")
+
+
+def load_sweep_config(path: str) -> tuple[dict, dict]:
+    """Reads a sweep config file
+
+    Args:
+        path (str): path to the JSON config
+
+    Returns:
+        tuple[dict, dict]: the raw config, and experiment name ->
+            RunConfig
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    base = make_run_config(_resolve_prompts(config.get("base", {})))
+    if "grid" in config:
+        configs = expand_grid(_resolve_prompts(config["grid"]), base=base)
+    else:
+        configs = {
+            name: make_run_config(_resolve_prompts(settings), base=base)
+            for name, settings in config["experiments"].items()
+        }
+    return config, configs
+
+
+def main(path: str):
+    config, configs = load_sweep_config(path)
+
+    processed = load_processed_data(config.get("data", "data/train.json"))
+    if config.get("sample_size"):
+        processed = sample_entries(
+            processed, config["sample_size"], seed=config.get("seed"),
+            sampling=config.get("sampling", "sample"))
+
+    client = make_async_client(HttpSettings(**config.get("http", {})))
+    cache = ResponseCache() if config.get("use_cache", True) else None
+
+    print(f"Running {len(configs)} experiments on {len(processed)} entries: "
+          f"{', '.join(configs)}")
+    asyncio.run(run_sweep(
+        processed, configs, client,
+        results_dir=config.get("results_dir", "results"),
+        cache=cache,
+        requests_per_minute=config.get("requests_per_minute"),
+        tokens_per_minute=config.get("tokens_per_minute"),
+        deduplicate=config.get("deduplicate", True),
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("config", help="path to the sweep JSON config")
+    main(parser.parse_args().config)
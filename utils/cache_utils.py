@@ -0,0 +1,401 @@
+import hashlib
+import json
+import os
+import sqlite3
+from time import time
+
+from openai.types.chat import ChatCompletion
+
+
+def completion_cache_key(
+    model_name: str, messages: list, temperature: float,
+    max_token: int, response_format: dict | None,
+    extra: dict | None = None,
+) -> str:
+    """Content-addressed key of a chat completion request
+
+    Args:
+        model_name (str): model name
+        messages (list): input prompt
+        temperature (float): sampling temperature
+        max_token (int): max output tokens
+        response_format (dict | None): requested response format
+        extra (dict | None): any other setting that changes the
+            response (e.g. streaming with early stop). Defaults to None.
+
+    Returns:
+        str: sha256 hex digest of the canonical request
+    """
+    request = {
+        "model_name": model_name,
+        "messages": messages,
+        "temperature": temperature,
+        "max_token": max_token,
+        "response_format": response_format,
+    }
+    if extra:
+        request["extra"] = extra
+    payload = json.dumps(
+        request,
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """On-disk (SQLite) cache of chat completion responses
+
+    Responses are stored as their JSON dump and returned as
+    `ChatCompletion` objects, so callers can use them exactly like
+    a fresh API response.
+
+    Eviction is done on write: entries older than `max_age` seconds are
+    dropped and, once the cache grows beyond `max_entries` or
+    `max_bytes`, the least recently used entries are removed until it
+    is back under `evict_to` of the limits. The entry and byte totals
+    are kept in a `totals` row updated with every write, and the access
+    times of hits are written in batches, so reads and writes stay
+    cheap however large the cache is (they run on the event loop).
+
+    Several processes may share the file: the totals, and so the
+    limits, cover every writer. The hit, miss and eviction counters of
+    `stats` are those of this instance.
+    """
+
+    ACCESS_FLUSH_SIZE = 256  # buffered access times before writing
+
+    def __init__(
+        self,
+        path: str = "results/.response_cache.sqlite",
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        max_age: float | None = None,
+        evict_to: float = 0.9,
+    ):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_to = evict_to
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._accessed = {}  # key -> last access not yet written
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access "
+            "ON responses (last_access, key)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_created "
+            "ON responses (created)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS totals (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                entries INTEGER NOT NULL,
+                bytes INTEGER NOT NULL
+            )
+            """
+        )
+        # Files written before the totals were kept are counted once
+        self._conn.execute(
+            """
+            INSERT OR IGNORE INTO totals
+            SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM responses
+            """
+        )
+        self._conn.commit()
+
+    def _totals(self) -> tuple[int, int]:
+        """Entries and bytes of the cache, for every writer"""
+        return self._conn.execute(
+            "SELECT entries, bytes FROM totals").fetchone()
+
+    def _add_to_totals(self, entries: int, size: int):
+        self._conn.execute(
+            "UPDATE totals SET entries = entries + ?, bytes = bytes + ?",
+            (entries, size))
+
+    def _flush_accesses(self):
+        """Writes the buffered access times of the hits"""
+        if self._accessed:
+            self._conn.executemany(
+                "UPDATE responses SET last_access = ? WHERE key = ?",
+                [(now, key) for key, now in self._accessed.items()])
+            self._accessed.clear()
+
+    def get(self, key: str) -> ChatCompletion | None:
+        """Looks up a response, counting the hit/miss
+
+        Args:
+            key (str): output of `completion_cache_key`
+
+        Returns:
+            ChatCompletion | None: cached response, None if absent/expired
+        """
+        row = self._conn.execute(
+            "SELECT response, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+
+        now = time()
+        if row is None or (
+            self.max_age is not None and now - row[1] > self.max_age
+        ):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._accessed[key] = now
+        if len(self._accessed) >= self.ACCESS_FLUSH_SIZE:
+            self._flush_accesses()
+            self._conn.commit()
+        return ChatCompletion.model_validate_json(row[0])
+
+    def set(self, key: str, response: ChatCompletion):
+        """Stores a response and applies the eviction policy
+
+        Args:
+            key (str): output of `completion_cache_key`
+            response (ChatCompletion): API response
+        """
+        if not isinstance(response, ChatCompletion):
+            raise TypeError(
+                f"Only ChatCompletion responses can be cached, "
+                f"not {type(response).__name__}")
+        dumped = response.model_dump_json()
+        now = time()
+        # The totals are updated first, which takes the write lock
+        # before the replaced entry (if any) is read
+        self._conn.execute(
+            """
+            UPDATE totals SET
+                entries = entries + NOT EXISTS (
+                    SELECT 1 FROM responses WHERE key = :key),
+                bytes = bytes + :size - COALESCE(
+                    (SELECT size FROM responses WHERE key = :key), 0)
+            """,
+            {"key": key, "size": len(dumped)},
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+            (key, dumped, len(dumped), now, now),
+        )
+        self._accessed.pop(key, None)
+
+        n_entries, n_bytes = self._totals()
+        if (
+            (self.max_entries is not None and n_entries > self.max_entries)
+            or (self.max_bytes is not None and n_bytes > self.max_bytes)
+        ):
+            self.evict()
+        elif self.max_age is not None:
+            self._expire()
+        self._conn.commit()
+
+    def _expire(self):
+        """Drops the entries older than max_age (through the index)"""
+        cutoff = time() - self.max_age
+        n_expired, size = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses "
+            "WHERE created < ?", (cutoff,)).fetchone()
+        if n_expired:
+            self._conn.execute(
+                "DELETE FROM responses WHERE created < ?", (cutoff,))
+            self._add_to_totals(-n_expired, -size)
+            self.evictions += n_expired
+
+    def evict(self):
+        """Drops expired entries, then least recently used ones
+        until the cache is within `evict_to` of its size limits"""
+        if not self._conn.in_transaction:
+            self._conn.execute("BEGIN IMMEDIATE")
+        self._flush_accesses()
+        if self.max_age is not None:
+            self._expire()
+
+        n_entries, n_bytes = self._totals()
+        n_excess = 0
+        if self.max_entries is not None and n_entries > self.max_entries:
+            n_excess = n_entries - int(self.max_entries * self.evict_to)
+        bytes_excess = 0
+        if self.max_bytes is not None and n_bytes > self.max_bytes:
+            bytes_excess = n_bytes - int(self.max_bytes * self.evict_to)
+
+        if n_excess or bytes_excess:
+            # Walks the least recently used entries (through the index)
+            # until enough of them are dropped
+            evicted, freed = [], 0
+            for key, size in self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access, key"
+            ):
+                if len(evicted) >= n_excess and freed >= bytes_excess:
+                    break
+                evicted.append((key,))
+                freed += size
+            self._conn.executemany(
+                "DELETE FROM responses WHERE key = ?", evicted)
+            self._add_to_totals(-len(evicted), -freed)
+            self.evictions += len(evicted)
+        self._conn.commit()
+
+    def clear(self):
+        self._accessed.clear()
+        self._conn.execute("DELETE FROM responses")
+        self._conn.execute("UPDATE totals SET entries = 0, bytes = 0")
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        """Hit/miss counters (of this instance) and current size of the
+        cache"""
+        n_entries, n_bytes = self._totals()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": n_entries,
+            "bytes": n_bytes,
+        }
+
+    def __len__(self) -> int:
+        return self._totals()[0]
+
+    def close(self):
+        self._flush_accesses()
+        self._conn.commit()
+        self._conn.close()
+
+
+def step_metric_key(
+    model_response, annotator_answer, delta: float, version: int = 1,
+) -> str:
+    """Content-addressed key of the metrics of one history step
+
+    Args:
+        model_response: extracted model answer
+        annotator_answer: ground truth answer
+        delta (float): tolerance for a close match
+        version (int): version of the metric definitions, bumped when
+            they change so that older entries are not reused.
+            Defaults to 1.
+
+    Returns:
+        str: sha256 hex digest
+    """
+    payload = json.dumps(
+        [version, model_response, annotator_answer, delta],
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class StepMetricCache:
+    """SQLite cache of per-step evaluation metrics
+
+    Metrics only depend on (model_response, annotator_answer, delta),
+    see `step_metric_key`, so they can be shared across experiments and
+    across runs. Lookups are served from memory once read.
+    `path=":memory:"` keeps the cache for the life of the process only.
+    """
+
+    def __init__(self, path: str = "results/.eval_cache.sqlite"):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._memory = {}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS step_metrics (
+                key TEXT PRIMARY KEY,
+                metrics TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: list[str]) -> dict[str, dict]:
+        """Looks up the metrics of several steps
+
+        Args:
+            keys (list[str]): outputs of `step_metric_key`
+
+        Returns:
+            dict[str, dict]: key -> metrics, for the keys found
+        """
+        found = {key: self._memory[key] for key in keys if key in self._memory}
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        # Stays below SQLite's limit on the number of query parameters
+        for start in range(0, len(missing), 500):
+            batch = missing[start:start + 500]
+            rows = self._conn.execute(
+                "SELECT key, metrics FROM step_metrics WHERE key IN "
+                f"({', '.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            for key, metrics in rows:
+                found[key] = self._memory[key] = json.loads(metrics)
+
+        self.hits += len(found)
+        self.misses += len(set(keys)) - len(found)
+        return found
+
+    def set_many(self, metrics: dict[str, dict]):
+        """Stores the metrics of several steps
+
+        Args:
+            metrics (dict[str, dict]): key -> metrics (JSON serialisable)
+        """
+        self._memory.update(metrics)
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO step_metrics VALUES (?, ?)",
+            [(key, json.dumps(value, default=float))
+             for key, value in metrics.items()],
+        )
+        self._conn.commit()
+
+    def clear(self):
+        self._memory.clear()
+        self._conn.execute("DELETE FROM step_metrics")
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        """Hit/miss counters (distinct keys) and size of the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+        }
+
+    def __len__(self) -> int:
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM step_metrics").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
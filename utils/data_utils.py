@@ -1,6 +1,20 @@
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
 import pandas as pd
 import re
 
+# pyarrow is optional; without it the processed data is cached as pickle
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
 
 def table_to_sentences(context_table: list[list[str]]) -> str:
     """ Converts a table into sentences for better parsing into prompts
@@ -31,6 +45,24 @@ def table_to_sentences(context_table: list[list[str]]) -> str:
     return "\n".join(sentences)
 
 
+def estimate_tokens(text: str | list[dict]) -> int:
+    """Rough LLM token count (~4 characters per token)
+
+    Used for the retrieved context budgets, and for rate limiting
+    before the provider reports the true usage
+
+    Args:
+        text (str | list[dict]): text, or chat messages whose contents
+            are counted
+
+    Returns:
+        int: estimated number of tokens
+    """
+    if not isinstance(text, str):
+        text = "".join(str(m.get("content") or "") for m in text)
+    return len(text) // 4 + 1
+
+
 def text_cleaner(text_list: list[str]) -> str:
     """Used to clean the pre- and post- context
     Removes incorrect whitespace
@@ -65,6 +97,19 @@ def text_cleaner(text_list: list[str]) -> str:
     return " ".join(text_list)
 
 
+def _format_full_context(
+    clean_pre_text: str, table_sentences: str, clean_post_text: str,
+) -> str:
+    return (
+        f"Context:\n\n{clean_pre_text}\n\n"
+        f"{table_sentences}\n\n{clean_post_text}\n\n"
+    )
+
+
+def _format_short_context(table_sentences: str) -> str:
+    return f'Context:\n\n{table_sentences}\n\n'
+
+
 def get_context(entry: pd.Series, return_short=True) -> str:
     """Extracts context from a data entry
     Can either add the pre- and post- text onto the table
@@ -88,27 +133,21 @@ def get_context(entry: pd.Series, return_short=True) -> str:
     table = entry.table
     table_sentences = table_to_sentences(table)
 
-    full_context = (
-        f"Context:\n\n{clean_pre_text}\n\n"
-        f"{table_sentences}\n\n{clean_post_text}\n\n"
-    )
+    full_context = _format_full_context(
+        clean_pre_text, table_sentences, clean_post_text)
 
     if return_short:
-        short_context = f'Context:\n\n{table_sentences}\n\n'
+        short_context = _format_short_context(table_sentences)
         return short_context, full_context
     else:
         return full_context
 
 
-def process_data_entry(entry: pd.Series) -> dict:
-    """Wrapper to process training/test data into an easily digestible format
-    Creates a dictionary for each entry with specific useful information
-
-    Args:
-        entry (pd.Series): Single entry from the data provided
+def _questions_and_gold_inds(entry: pd.Series) -> tuple:
+    """Question type, question(s), answer(s) and gold indices of an entry
 
     Returns:
-        dict: Output dictionary with information needed for modelling
+        tuple: (question_type, question, answer, list of gold indices)
     """
     if isinstance(entry["qa"], dict):
         question_type = "simple"
@@ -121,10 +160,43 @@ def process_data_entry(entry: pd.Series) -> dict:
         answer = [entry.qa_0.get("answer"), entry.qa_1.get("answer")]
 
         # Ensure there is no duplication in our gold context
-        gold_inds = list(
-            set(entry.qa_0.get('gold_inds').values())
-            |
-            set(entry.qa_1.get('gold_inds').values())
+        # (dict keeps first-seen order, so the output is the same
+        # in every process, unlike a set of strings)
+        gold_inds = list(dict.fromkeys(
+            [*entry.qa_0.get('gold_inds').values(),
+             *entry.qa_1.get('gold_inds').values()]
+        ))
+
+    return question_type, question, answer, gold_inds
+
+
+def process_data_entry(entry: pd.Series, lazy: bool = False) -> dict:
+    """Wrapper to process training/test data into an easily digestible format
+    Creates a dictionary for each entry with specific useful information
+
+    Args:
+        entry (pd.Series): Single entry from the data provided
+        lazy (bool, optional): Returns a `ProcessedEntry` that builds the
+            contexts on first access instead of a dict. Defaults to False.
+
+    Returns:
+        dict: Output dictionary with information needed for modelling
+    """
+    question_type, question, answer, gold_inds = _questions_and_gold_inds(
+        entry)
+
+    if lazy:
+        return ProcessedEntry(
+            question_type=question_type,
+            question=question,
+            answer=answer,
+            step_by_step_questions=entry.annotation.get("dialogue_break"),
+            step_by_step_answers=entry.annotation.get("exe_ans_list"),
+            step_by_step_split=entry.annotation.get("qa_split"),
+            pre_text=entry.pre_text,
+            post_text=entry.post_text,
+            table=entry.table,
+            gold_inds_list=gold_inds,
         )
 
     # Convert into a single string for compatibility
@@ -145,13 +217,340 @@ def process_data_entry(entry: pd.Series) -> dict:
     }
 
 
-def process_data_table(table: pd.DataFrame) -> pd.Series:
+class ProcessedEntry:
+    """Compact, lazy version of the `process_data_entry` dictionary
+
+    Keeps references to the raw pre_text/table/post_text and builds
+    `short_context`, `full_context` and `gold_inds` only on first access,
+    caching the result. Supports the dict-style `.get(...)`/`[...]`
+    access used by the modelling code.
+    """
+
+    FIELDS = (
+        "question_type", "question", "answer",
+        "short_context", "full_context", "gold_inds",
+        "step_by_step_questions", "step_by_step_answers",
+        "step_by_step_split",
+    )
+
+    __slots__ = (
+        "question_type", "question", "answer",
+        "step_by_step_questions", "step_by_step_answers",
+        "step_by_step_split",
+        "_pre_text", "_post_text", "_table", "_gold_inds_list",
+        "_table_sentences", "_short_context", "_full_context", "_gold_inds",
+    )
+
+    def __init__(
+        self, question_type, question, answer,
+        step_by_step_questions, step_by_step_answers, step_by_step_split,
+        pre_text: list[str], post_text: list[str], table: list[list[str]],
+        gold_inds_list: list[str],
+    ):
+        self.question_type = question_type
+        self.question = question
+        self.answer = answer
+        self.step_by_step_questions = step_by_step_questions
+        self.step_by_step_answers = step_by_step_answers
+        self.step_by_step_split = step_by_step_split
+        self._pre_text = pre_text
+        self._post_text = post_text
+        self._table = table
+        self._gold_inds_list = gold_inds_list
+        self._table_sentences = None
+        self._short_context = None
+        self._full_context = None
+        self._gold_inds = None
+
+    @property
+    def table_sentences(self) -> str:
+        if self._table_sentences is None:
+            self._table_sentences = table_to_sentences(self._table)
+        return self._table_sentences
+
+    @property
+    def short_context(self) -> str:
+        if self._short_context is None:
+            self._short_context = _format_short_context(self.table_sentences)
+        return self._short_context
+
+    @property
+    def full_context(self) -> str:
+        if self._full_context is None:
+            self._full_context = _format_full_context(
+                text_cleaner(self._pre_text),
+                self.table_sentences,
+                text_cleaner(self._post_text),
+            )
+        return self._full_context
+
+    @property
+    def gold_inds(self) -> str:
+        if self._gold_inds is None:
+            self._gold_inds = '; '.join(self._gold_inds_list)
+        return self._gold_inds
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def __getitem__(self, key: str):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS
+
+    def keys(self) -> tuple:
+        return self.FIELDS
+
+    def to_dict(self) -> dict:
+        """Materialises every field, as `process_data_entry` would"""
+        return {key: self[key] for key in self.FIELDS}
+
+    def __repr__(self) -> str:
+        return (f"ProcessedEntry(question_type={self.question_type!r}, "
+                f"question={self.question!r})")
+
+
+def _process_chunk(chunk: pd.DataFrame, lazy: bool = False) -> list[dict]:
+    """Worker of the parallel path; processes a contiguous block of rows"""
+    return [process_data_entry(entry, lazy=lazy)
+            for _, entry in chunk.iterrows()]
+
+
+def iter_processed_data(
+    table: pd.DataFrame, n_workers: int | None = None, chunk_size: int = 256,
+    lazy: bool = False,
+) -> Iterator[tuple[object, dict]]:
+    """Streams processed entries, computed on a pool of processes
+
+    The table is split into contiguous chunks of `chunk_size` rows which
+    are processed in parallel; results are yielded in the original row
+    order as soon as each chunk (and every chunk before it) is done
+
+    Args:
+        table (pd.DataFrame): Dataframe with all entries to be processed
+        n_workers (int | None): number of processes.
+            Defaults to the number of CPUs.
+        chunk_size (int): rows per task. Defaults to 256.
+        lazy (bool): yield `ProcessedEntry` records. Defaults to False.
+
+    Yields:
+        tuple[object, dict]: (index of the row, processed entry)
+    """
+    chunks = [
+        table.iloc[start:start + chunk_size]
+        for start in range(0, len(table), chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        # executor.map returns results in submission order
+        processed_chunks = executor.map(
+            _process_chunk, chunks, [lazy] * len(chunks))
+        for chunk, processed in zip(chunks, processed_chunks):
+            yield from zip(chunk.index, processed)
+
+
+def process_data_table(
+    table: pd.DataFrame, n_workers: int = 1, chunk_size: int = 256,
+    lazy: bool = False,
+) -> pd.Series:
     """Wrapper to process all entries
 
     Args:
         table (pd.DataFrame): Dataframe with all entries to be processed
+        n_workers (int): number of processes; 1 processes serially,
+            None uses all CPUs. Defaults to 1.
+        chunk_size (int): rows per task of the parallel path.
+            Defaults to 256.
+        lazy (bool): build `ProcessedEntry` records, whose contexts are
+            computed on first access. Defaults to False.
 
     Returns:
         pd.Series: Collection of dictionaries
     """
-    return table.apply(process_data_entry, axis=1)
+    if n_workers == 1 or len(table) <= chunk_size:
+        return pd.Series(
+            [process_data_entry(entry, lazy=lazy)
+             for _, entry in table.iterrows()],
+            index=table.index, dtype=object)
+
+    index, records = [], []
+    for ix, record in iter_processed_data(
+            table, n_workers, chunk_size, lazy=lazy):
+        index.append(ix)
+        records.append(record)
+    return pd.Series(records, index=index, dtype=object)
+
+
+def _hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def processed_data_key(source_path: str) -> str:
+    """Cache key of the processed version of a data file
+
+    Hash of the source file and of this module's code, so that the
+    artifact is rebuilt whenever either changes
+
+    Args:
+        source_path (str): path to the raw data (e.g. data/train.json)
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(_hash_file(source_path).encode())
+    digest.update(_hash_file(__file__).encode())
+    return digest.hexdigest()
+
+
+def _write_arrow(processed: pd.Series, path: str):
+    """Writes processed records as an Arrow IPC file
+
+    Columns holding anything other than strings (lists, numbers, None)
+    are stored JSON-encoded and listed in the schema metadata
+    """
+    records = processed.tolist()
+    columns = {"index": [json.dumps(ix) for ix in processed.index.tolist()]}
+    json_columns = ["index"]
+    for key in (records[0].keys() if records else []):
+        values = [record.get(key) for record in records]
+        if all(isinstance(value, str) for value in values):
+            columns[key] = values
+        else:
+            columns[key] = [json.dumps(value) for value in values]
+            json_columns.append(key)
+
+    table = pa.table(columns).replace_schema_metadata(
+        {"json_columns": json.dumps(json_columns)})
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+class ArrowEntry:
+    """Processed record backed by the columns of a memory-mapped Arrow
+    table (see `_read_arrow`)
+
+    Fields are read from the mapped buffers, and JSON-decoded for the
+    non-string ones, on first access only, then cached. Supports the
+    dict-style access of `ProcessedEntry`.
+    """
+
+    __slots__ = ("_columns", "_json_columns", "_row", "_values")
+
+    def __init__(self, columns: dict, json_columns: set, row: int):
+        self._columns = columns  # name -> pa.Array, shared by the rows
+        self._json_columns = json_columns
+        self._row = row
+        self._values = {}
+
+    def __getitem__(self, key: str):
+        if key not in self._values:
+            if key not in self._columns:
+                raise KeyError(key)
+            value = self._columns[key][self._row].as_py()
+            if key in self._json_columns:
+                value = json.loads(value)
+            self._values[key] = value
+        return self._values[key]
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self._columns else default
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._columns
+
+    def keys(self) -> tuple:
+        return tuple(self._columns)
+
+    def to_dict(self) -> dict:
+        """Decodes every field, as `process_data_entry` would return"""
+        return {key: self[key] for key in self._columns}
+
+    def __repr__(self) -> str:
+        return (f"ArrowEntry(question_type={self.get('question_type')!r}, "
+                f"question={self.get('question')!r})")
+
+
+def _read_arrow(path: str) -> pd.Series:
+    """Memory-maps an Arrow IPC file written by `_write_arrow`
+
+    Only the index is decoded up front; the records are `ArrowEntry`
+    views that decode a field from the mapped buffers when it is used
+    """
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    json_columns = set(json.loads(table.schema.metadata[b"json_columns"]))
+
+    # Single-chunk columns are used as they are (zero-copy)
+    columns = {
+        name: (
+            column.chunk(0) if column.num_chunks == 1
+            else column.combine_chunks()
+        )
+        for name, column in zip(table.column_names, table.columns)
+    }
+    index = [json.loads(ix) for ix in columns.pop("index").to_pylist()]
+    json_columns.discard("index")
+    return pd.Series(
+        [ArrowEntry(columns, json_columns, row) for row in range(len(index))],
+        index=index, dtype=object)
+
+
+def load_processed_data(
+    source_path: str, cache_dir: str | None = None, n_workers: int = 1,
+) -> pd.Series:
+    """Reads and processes a data file, caching the result on disk
+
+    The first call runs `process_data_table` and writes the processed
+    records to `cache_dir` (Arrow IPC if pyarrow is installed, pickle
+    otherwise), keyed by `processed_data_key`. Later calls memory-map
+    the artifact instead of re-reading and re-processing the JSON;
+    with Arrow, the records are `ArrowEntry` views decoded on access.
+
+    Args:
+        source_path (str): path to the raw data (e.g. data/train.json)
+        cache_dir (str | None): where to store the artifacts.
+            Defaults to a .processed folder next to the source file.
+        n_workers (int): processes used on a cache miss, see
+            `process_data_table`. Defaults to 1.
+
+    Returns:
+        pd.Series: Collection of dictionaries (or dict-like entries),
+            as `process_data_table`
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(source_path), ".processed")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    extension = "arrow" if pa is not None else "pkl"
+    artifact = os.path.join(
+        cache_dir, f"{stem}-{processed_data_key(source_path)[:16]}.{extension}")
+
+    if os.path.exists(artifact):
+        if pa is not None:
+            return _read_arrow(artifact)
+        with open(artifact, "rb") as f:
+            return pickle.load(f)
+
+    processed = process_data_table(
+        pd.read_json(source_path), n_workers=n_workers)
+
+    # Written under a temporary name first so that an interrupted
+    # write never leaves a corrupt artifact behind
+    tmp_artifact = artifact + ".tmp"
+    if pa is not None:
+        _write_arrow(processed, tmp_artifact)
+    else:
+        with open(tmp_artifact, "wb") as f:
+            pickle.dump(processed, f)
+    os.replace(tmp_artifact, artifact)
+
+    return processed
@@ -1,7 +1,52 @@
+import asyncio
 import numpy as np
 import pandas as pd
+import re
+from collections import deque
+from time import monotonic
 
-from re import finditer
+from utils.cache_utils import StepMetricCache, step_metric_key
+from utils.expression_utils import evaluate_expression, evaluate_expressions
+from utils.results_utils import (
+    ResultsReader,
+    failed_steps, load_results, results_to_frame, step_failed)
+
+
+# Literal "\x08oxed{" is kept for backwards compatibility with the
+# previous regex; the backspace character is what a JSON decoder makes
+# of an unescaped "\boxed" (e.g. in structured outputs)
+BOXED_MARKERS = ("\\boxed{", "\\x08oxed{", "\x08oxed{")
+_BRACES = re.compile(r"[{}]")
+
+
+def _last_boxed_marker(text: str, end: int | None = None) -> tuple[int, int]:
+    """Finds the last boxed marker starting in text[:end]
+
+    Returns:
+        tuple[int, int]: start of the marker and start of its content;
+            (-1, -1) if there is no marker
+    """
+    best_start, best_content = -1, -1
+    for marker in BOXED_MARKERS:
+        start = (
+            text.rfind(marker) if end is None else text.rfind(marker, 0, end))
+        if start > best_start:
+            best_start, best_content = start, start + len(marker)
+    return best_start, best_content
+
+
+def _matching_brace(text: str, content_start: int) -> int:
+    """Index of the "}" closing the "{" just before content_start,
+    -1 if the braces never balance"""
+    depth = 1
+    for match in _BRACES.finditer(text, content_start):
+        if match.group() == "{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return match.start()
+    return -1
 
 
 def find_answer(input_string: str) -> str:
@@ -10,6 +55,11 @@ def find_answer(input_string: str) -> str:
         -\boxed
         -\x08 (fix; not necessary but implemented for more robustness)
 
+    Single pass from the end: takes the last boxed marker and its
+    matching closing brace, so nested braces are handled by design.
+    If the braces never balance (e.g. truncated output), falls back to
+    the content up to the last "}" of the text.
+
     Args:
         text (str): LLM output
 
@@ -17,9 +67,6 @@ def find_answer(input_string: str) -> str:
         str: Answer string
     """
 
-    # Finds the last occurrence of \boxed{} or \08oxed{}
-    pattern = r".*(?:\\boxed\{|\\x08oxed\{)(.*)\}"
-
     input_string = (
         input_string
         .replace(' ', '')
@@ -27,16 +74,21 @@ def find_answer(input_string: str) -> str:
 
     )
 
-    matches = list(finditer(pattern, input_string))
-    if not matches:
+    _, content_start = _last_boxed_marker(input_string)
+    if content_start == -1:
         return ""
-    last_match = matches[-1]
-    # Extract content from the matched group (either \boxed{} or backticks)
-    ans = (
-        last_match.group(1)
-        if last_match.group(1) is not None
-        else last_match.group(2)
-    )
+
+    content_end = _matching_brace(input_string, content_start)
+    if content_end == -1:
+        # Unbalanced: the last marker that is followed by a "}"
+        content_end = input_string.rfind('}')
+        if content_end == -1:
+            return ""
+        _, content_start = _last_boxed_marker(input_string, content_end)
+        if content_start == -1:
+            return ""
+
+    ans = input_string[content_start:content_end]
 
     # Clean up in case of LateX remnants
     ans = (
@@ -79,8 +131,10 @@ def cleanup_answer(input_string: str) -> str:
 
 def evaluate_maths(input_string: str) -> float | int:
     """Math operation evaluator
-    Uses internal python eval method to check if
-    answer is executable, based on the 5 predefined functions
+    Parses the answer with a restricted AST evaluator
+    (see `utils.expression_utils`) that only accepts numbers, arithmetic
+    and the 5 predefined functions, with guards on exponent size and
+    nesting depth. Parsed expressions are LRU-cached.
 
     Args:
         input_string (str): Answer string
@@ -91,33 +145,20 @@ def evaluate_maths(input_string: str) -> float | int:
 
     input_string = cleanup_answer(input_string)
 
-    # Matches the context given
-    # will only accept these functions
-    def add(a, b):
-        return a + b
-
-    def subtract(a, b):
-        return a - b
+    return evaluate_expression(input_string)
 
-    def multiply(a, b):
-        return a * b
 
-    def divide(a, b):
-        return a / b
+def evaluate_maths_batch(input_strings: list[str]) -> list:
+    """Batch version of `evaluate_maths`
 
-    def power(a, b):
-        return a ** b
-
-    # Restrict the eval to use only the allowed functions
-    maths_functions = {
-        "add": add,
-        "subtract": subtract,
-        "multiply": multiply,
-        "divide": divide,
-        "power": power
-    }
+    Args:
+        input_strings (list[str]): Answer strings
 
-    return eval(input_string, {"__builtins__": {}}, maths_functions)
+    Returns:
+        list: evaluated answers, None where not evaluable
+    """
+    return evaluate_expressions(
+        [cleanup_answer(input_string) for input_string in input_strings])
 
 
 def compare_answers(
@@ -157,15 +198,83 @@ def compare_answers(
     return difference, diff_percentage_fix
 
 
+def vote_answers(texts: list[str], delta=0.05) -> dict:
+    """Majority vote over several sampled responses to one question
+
+    Each response goes through `find_answer`/`evaluate_maths`; two
+    answers agree when they are within `delta` of each other
+    (the `compare_answers` difference). Answers that cannot be
+    evaluated only win when no answer could be.
+
+    Args:
+        texts (list[str]): sampled responses
+        delta (float, optional): tolerance for two answers to agree.
+            Defaults to 0.05.
+
+    Returns:
+        dict: `winner` (position of the chosen response), `votes`
+            (one {"answer", "value", "count"} per distinct answer, most
+            voted first; value is None for unparsable answers) and
+            `margin` (votes of the winner minus those of the largest
+            other group, unparsable answers included)
+    """
+    groups = []  # [representative value, answer, positions]
+    unparsable = []
+    for ix, text in enumerate(texts):
+        answer = find_answer(text)
+        try:
+            value = float(evaluate_maths(answer))
+        except Exception:
+            unparsable.append((ix, answer))
+            continue
+        for group in groups:
+            if compare_answers(value, str(group[0]))[0] <= delta:
+                group[2].append(ix)
+                break
+        else:
+            groups.append([value, answer, [ix]])
+
+    # Stable sort: ties go to the answer seen first
+    groups.sort(key=lambda group: -len(group[2]))
+    votes = [
+        {"answer": answer, "value": value, "count": len(positions)}
+        for value, answer, positions in groups
+    ]
+    if unparsable:
+        votes.append({
+            "answer": unparsable[0][1], "value": None,
+            "count": len(unparsable)})
+
+    counts = [vote["count"] for vote in votes]
+    return {
+        "winner": groups[0][2][0] if groups else (
+            unparsable[0][0] if unparsable else None),
+        "votes": votes,
+        "margin": (
+            counts[0] - max(counts[1:], default=0) if counts else 0),
+    }
+
+
 def evaluate_experiment(experiment_results, delta=0.05):
+    """Evaluates every step of an experiment
+
+    Args:
+        experiment_results: results, or path to a results file in either
+            the results/exp*.json format or the streaming .jsonl format
+        delta (float, optional): tolerance for a close match.
+            Defaults to 0.05.
+
+    Returns:
+        list[list[dict]]: per-entry, per-step metrics
+    """
     metrics = []
     correct_counter = 0
     correct_counter_fix = 0
     total_preds = 0
+    total_errors = 0
 
     if isinstance(experiment_results, str):
-        experiment_results = pd.read_json(
-            experiment_results, typ='series').to_dict()
+        experiment_results = load_results(experiment_results)
 
     if not isinstance(experiment_results, dict):
         experiment_results = pd.Series(experiment_results).to_dict()
@@ -178,9 +287,10 @@ def evaluate_experiment(experiment_results, delta=0.05):
             model_pred = interim_step.get("model_response")
             annot_answer = interim_step.get("annotator_answer")
 
-            # This has now been resolved with the usage of tenacity
-            # Retries are done at execution
-            if 'Error encountered' in complete_response:
+            # Calls that failed after all retries are not scored,
+            # they are counted and reported separately
+            if step_failed(interim_step):
+                total_errors += 1
                 continue
 
             # Is answer parsable?
@@ -228,11 +338,699 @@ def evaluate_experiment(experiment_results, delta=0.05):
             % correct (percentage fix): {
             np.round(correct_counter_fix/total_preds, 3)
         }
+            failed steps (not scored): {total_errors}
         """
     )
     return metrics
 
 
+def _evaluate_prediction(model_pred) -> tuple:
+    """evaluate_maths + float conversion of one prediction
+
+    Returns:
+        tuple: (evaluated answer or None, float value, success flag)
+    """
+    try:
+        evaluated_pred = evaluate_maths(model_pred)
+        return evaluated_pred, float(evaluated_pred), True
+    except:
+        return None, np.nan, False
+
+
+def _parse_ground_truth(annot_answer) -> tuple:
+    """cleanup_answer + float conversion of one ground truth
+
+    Returns:
+        tuple: (float value, success flag)
+    """
+    try:
+        return float(cleanup_answer(annot_answer)), True
+    except:
+        return np.nan, False
+
+
+def _map_unique(values: pd.Series, func) -> list:
+    """Applies func once per distinct value and broadcasts the results"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    mapped = [func(value) for value in uniques]
+    return [mapped[code] for code in codes]
+
+
+_STEP_COLUMNS = ["entry_id", "step", "question", "complete_response",
+                 "model_response", "annotator_answer"]
+
+
+def _scorable_steps(steps: pd.DataFrame) -> tuple[pd.DataFrame, int]:
+    """Adds missing columns and drops the failed steps
+
+    Returns:
+        tuple[pd.DataFrame, int]: steps to score, number of failed steps
+    """
+    for column in _STEP_COLUMNS:
+        if column not in steps:
+            steps[column] = pd.Series(dtype=object)
+    errors = failed_steps(steps)
+    return steps[~errors].reset_index(drop=True), int(errors.sum())
+
+
+def _step_metrics(
+    model_responses: pd.Series, annotator_answers: pd.Series, delta: float,
+) -> pd.DataFrame:
+    """Vectorised metrics of (prediction, ground truth) pairs
+
+    Evaluates each distinct prediction/ground truth once and computes
+    the `compare_answers` deltas with NumPy array operations
+
+    Returns:
+        pd.DataFrame: eval_ans, parsable, close_match, delta,
+            close_match_perc_fix and delta_perc_fix, one row per pair
+    """
+    evaluated = _map_unique(model_responses, _evaluate_prediction)
+    parsed_gt = _map_unique(annotator_answers, _parse_ground_truth)
+
+    pred = np.array([value for _, value, _ in evaluated], dtype=float)
+    pred_ok = np.array([ok for _, _, ok in evaluated], dtype=bool)
+    gt = np.array([value for value, _ in parsed_gt], dtype=float)
+    gt_ok = np.array([ok for _, ok in parsed_gt], dtype=bool)
+    parsable = pred_ok & gt_ok
+
+    with np.errstate(invalid="ignore", over="ignore"):
+        difference = np.abs(pred - gt)
+        diff_percentage_fix = difference.copy()
+        # Case 1: prediction is given as decimal and ground truth as percentage
+        case_1 = (0.0 <= pred) & (pred <= 1.0) & (gt >= 1)
+        diff_percentage_fix = np.where(
+            case_1,
+            np.minimum(np.abs(pred * 100 - gt), diff_percentage_fix),
+            diff_percentage_fix)
+        # Case 2: prediction is given as percentage and ground truth as decimal
+        case_2 = (0.0 <= gt) & (gt <= 1.0) & (pred >= 1)
+        diff_percentage_fix = np.where(
+            case_2,
+            np.minimum(np.abs(gt * 100 - pred), diff_percentage_fix),
+            diff_percentage_fix)
+
+    difference = np.where(parsable, difference, np.inf)
+    diff_percentage_fix = np.where(parsable, diff_percentage_fix, np.inf)
+
+    return pd.DataFrame({
+        "eval_ans": pd.Series([
+            value if ok else None
+            for (value, _, _), ok in zip(evaluated, parsable)], dtype=object),
+        "parsable": parsable,
+        "close_match": (difference <= 0.05).astype(int),
+        "delta": difference,
+        "close_match_perc_fix": (diff_percentage_fix <= delta).astype(int),
+        "delta_perc_fix": diff_percentage_fix,
+    })
+
+
+def _metrics_frame(steps: pd.DataFrame, metrics: pd.DataFrame) -> pd.DataFrame:
+    """Step identifiers and texts next to their metrics"""
+    return pd.DataFrame({
+        "entry_id": steps["entry_id"],
+        "step": steps["step"],
+        "question": steps["question"],
+        "complete_response": steps["complete_response"],
+        "model_pred": steps["model_response"],
+        "eval_ans": metrics["eval_ans"],
+        "annot_ans": steps["annotator_answer"],
+        "parsable": metrics["parsable"].astype(bool),
+        "close_match": metrics["close_match"].astype(int),
+        "delta": metrics["delta"].astype(float),
+        "close_match_perc_fix": metrics["close_match_perc_fix"].astype(int),
+        "delta_perc_fix": metrics["delta_perc_fix"].astype(float),
+    })
+
+
+def _summary(metrics: pd.DataFrame, n_errors: int, delta: float) -> dict:
+    n_steps = len(metrics)
+    return {
+        "n_steps": n_steps,
+        "n_errors": n_errors,
+        "parsable": metrics["parsable"].mean() if n_steps else np.nan,
+        "correct": (metrics["delta"] <= delta).mean() if n_steps else np.nan,
+        "correct_perc_fix": (
+            (metrics["delta_perc_fix"] <= delta).mean()
+            if n_steps else np.nan),
+    }
+
+
+def evaluate_experiment_frame(
+    experiment_results, delta=0.05,
+) -> tuple[pd.DataFrame, dict]:
+    """Columnar version of `evaluate_experiment`
+
+    Flattens the results into one row per step in a single pass,
+    evaluates each distinct prediction/ground truth once and computes
+    the `compare_answers` deltas with NumPy array operations.
+    Metric definitions are identical to `evaluate_experiment`.
+    Parquet results are read without the response texts
+    (`complete_response` is left empty).
+
+    Args:
+        experiment_results: results, or path to a results file
+        delta (float, optional): tolerance for a close match.
+            Defaults to 0.05.
+
+    Returns:
+        tuple[pd.DataFrame, dict]: one row per (non-error) step with the
+            same metrics as `evaluate_experiment`, and summary metrics
+    """
+    steps, n_errors = _scorable_steps(
+        results_to_frame(experiment_results, with_responses=False))
+    metrics = _metrics_frame(
+        steps,
+        _step_metrics(
+            steps["model_response"], steps["annotator_answer"], delta))
+    return metrics, _summary(metrics, n_errors, delta)
+
+
+def compare_experiments(experiments: dict, delta=0.05) -> pd.DataFrame:
+    """Summary metrics of several experiments side by side
+
+    Args:
+        experiments (dict): experiment name -> results or results path
+        delta (float, optional): tolerance for a close match.
+            Defaults to 0.05.
+
+    Returns:
+        pd.DataFrame: one row per experiment
+    """
+    return pd.DataFrame.from_dict(
+        {
+            name: evaluate_experiment_frame(experiment_results, delta)[1]
+            for name, experiment_results in experiments.items()
+        },
+        orient="index",
+    )
+
+
+class IncrementalEvaluator:
+    """`evaluate_experiment_frame` that only scores what it has not seen
+
+    Step metrics are looked up in a `StepMetricCache` by
+    (model_response, annotator_answer, delta), so unchanged steps,
+    and steps shared between experiments, are scored once. Results
+    files are read with a `ResultsReader` (only appended records are
+    parsed) and, if a file did not change, its previous evaluation is
+    returned as is.
+
+    Args:
+        cache (StepMetricCache | None): metric cache, e.g.
+            StepMetricCache() to keep the metrics across runs.
+            Defaults to None (in-memory cache).
+        delta (float, optional): tolerance for a close match.
+            Defaults to 0.05.
+    """
+
+    # Bumped when the metric definitions change
+    METRICS_VERSION = 1
+
+    def __init__(self, cache: StepMetricCache | None = None, delta=0.05):
+        self.cache = cache if cache is not None else StepMetricCache(":memory:")
+        self.delta = delta
+        self.reader = ResultsReader()
+        self.scored_steps = 0
+        self.reused_steps = 0
+        self._evaluations = {}  # path -> (file signature, evaluation)
+
+    def _cached_metrics(self, steps: pd.DataFrame) -> pd.DataFrame:
+        keys = [
+            step_metric_key(
+                model_response, annotator_answer, self.delta,
+                version=self.METRICS_VERSION)
+            for model_response, annotator_answer in zip(
+                steps["model_response"], steps["annotator_answer"])
+        ]
+        found = self.cache.get_many(keys)
+
+        # One position per key to score
+        missing = list({
+            key: ix for ix, key in enumerate(keys) if key not in found
+        }.values())
+        if missing:
+            scored = _step_metrics(
+                steps["model_response"].iloc[missing].reset_index(drop=True),
+                steps["annotator_answer"].iloc[missing].reset_index(drop=True),
+                self.delta,
+            )
+            new_metrics = {
+                keys[ix]: {
+                    "eval_ans": row["eval_ans"],
+                    "parsable": bool(row["parsable"]),
+                    "close_match": int(row["close_match"]),
+                    "delta": float(row["delta"]),
+                    "close_match_perc_fix": int(row["close_match_perc_fix"]),
+                    "delta_perc_fix": float(row["delta_perc_fix"]),
+                }
+                for ix, row in zip(missing, scored.to_dict("records"))
+            }
+            self.cache.set_many(new_metrics)
+            found.update(new_metrics)
+
+        self.scored_steps += len(missing)
+        self.reused_steps += len(keys) - len(missing)
+        metrics = pd.DataFrame(
+            [found[key] for key in keys],
+            columns=["parsable", "close_match", "delta",
+                     "close_match_perc_fix", "delta_perc_fix"],
+        )
+        # Built apart so that ints and None are kept as they are
+        metrics["eval_ans"] = pd.Series(
+            [found[key]["eval_ans"] for key in keys], dtype=object)
+        return metrics
+
+    def evaluate(self, experiment_results) -> tuple[pd.DataFrame, dict]:
+        """Same output as `evaluate_experiment_frame`
+
+        Args:
+            experiment_results: results, or path to a results file
+
+        Returns:
+            tuple[pd.DataFrame, dict]: one row per (non-error) step,
+                and summary metrics
+        """
+        path = None
+        if isinstance(experiment_results, str):
+            path = experiment_results
+            signature = self.reader.signature(path)
+            if path in self._evaluations and (
+                    self._evaluations[path][0] == signature):
+                return self._evaluations[path][1]
+            if not path.endswith(".parquet"):
+                experiment_results = self.reader.load(path)
+
+        steps, n_errors = _scorable_steps(
+            results_to_frame(experiment_results, with_responses=False))
+        metrics = _metrics_frame(steps, self._cached_metrics(steps))
+        evaluation = metrics, _summary(metrics, n_errors, self.delta)
+        if path is not None:
+            self._evaluations[path] = (signature, evaluation)
+        return evaluation
+
+    def summaries(self, experiments: dict) -> pd.DataFrame:
+        """Incremental version of `compare_experiments`
+
+        Args:
+            experiments (dict): experiment name -> results or results path
+
+        Returns:
+            pd.DataFrame: summary metrics, one row per experiment
+        """
+        return pd.DataFrame.from_dict(
+            {
+                name: self.evaluate(experiment_results)[1]
+                for name, experiment_results in experiments.items()
+            },
+            orient="index",
+        )
+
+    def compare(
+        self, experiments: dict, metric: str = "close_match_perc_fix",
+        by: str = "entry",
+    ) -> pd.DataFrame:
+        """One metric of several experiments side by side
+
+        Args:
+            experiments (dict): experiment name -> results or results path
+            metric (str, optional): column of the evaluation frame.
+                Defaults to "close_match_perc_fix".
+            by (str, optional): "entry" (mean over the steps of each
+                entry) or "step". Defaults to "entry".
+
+        Returns:
+            pd.DataFrame: one row per entry (or (entry, step)), in the
+                order of the results files, one column per experiment;
+                NaN where an experiment has no scored step
+        """
+        index = {"entry": ["entry_id"], "step": ["entry_id", "step"]}[by]
+        columns = {}
+        for name, experiment_results in experiments.items():
+            frame = self.evaluate(experiment_results)[0]
+            columns[name] = (
+                frame.astype({metric: float})
+                .groupby(index, sort=False)[metric].mean())
+
+        # Rows in the order of the results files: the ids are strings,
+        # which would sort "10" before "2"
+        keys = list(dict.fromkeys(
+            key for column in columns.values() for key in column.index))
+        order = (
+            pd.MultiIndex.from_tuples(keys, names=index) if by == "step"
+            else pd.Index(keys, name="entry_id"))
+        return pd.DataFrame(columns).reindex(order)
+
+    def stats(self) -> dict:
+        """Steps scored and steps served from the metric cache"""
+        return {
+            "scored_steps": self.scored_steps,
+            "reused_steps": self.reused_steps,
+            **{f"cache_{name}": value
+               for name, value in self.cache.stats().items()},
+        }
+
+
+def performance_report(experiments: dict) -> pd.DataFrame:
+    """Latency, token usage, retry and error report per experiment and model
+
+    Works on any results file; fields missing from older files
+    (e.g. latency in results/exp*.json) come out as NaN.
+    Cached responses are left out of the latency/throughput figures.
+
+    Args:
+        experiments (dict): experiment name -> results or results path
+
+    Returns:
+        pd.DataFrame: one row per (experiment, model_name) with
+            n_calls, error_rate, p50/p95/p99 latency (s),
+            tokens_per_sec (completion tokens over latency),
+            mean/total retries and cache hit counts
+    """
+    frames = []
+    for name, experiment_results in experiments.items():
+        frame = results_to_frame(experiment_results, with_responses=False)
+        frame["experiment"] = name
+        frames.append(frame)
+    steps = pd.concat(frames, ignore_index=True)
+
+    for column in ["model_name", "latency", "retries", "cached",
+                   "completion_tokens", "prompt_tokens",
+                   "prompt_cache_hit_tokens", "prompt_cache_miss_tokens"]:
+        if column not in steps:
+            steps[column] = np.nan
+    steps["model_name"] = steps["model_name"].fillna("unknown")
+    steps["error"] = failed_steps(steps)
+    steps["cached"] = steps["cached"].astype("boolean").fillna(False)
+
+    def _calls_summary(group: pd.DataFrame) -> pd.Series:
+        live = group[~group["cached"] & ~group["error"]]
+        latency = live["latency"].astype(float)
+        return pd.Series({
+            "n_calls": len(group),
+            "n_cached": int(group["cached"].sum()),
+            "error_rate": group["error"].mean(),
+            "p50_latency": latency.quantile(0.50),
+            "p95_latency": latency.quantile(0.95),
+            "p99_latency": latency.quantile(0.99),
+            "tokens_per_sec": (
+                live["completion_tokens"].astype(float).sum()
+                / latency.sum() if latency.sum() > 0 else np.nan),
+            "mean_retries": group["retries"].astype(float).mean(),
+            "total_retries": group["retries"].astype(float).sum(min_count=1),
+            "prompt_tokens": group["prompt_tokens"].astype(float).sum(min_count=1),
+            "prompt_cache_hit_tokens": (
+                group["prompt_cache_hit_tokens"].astype(float).sum(min_count=1)),
+        })
+
+    return (
+        steps.groupby(["experiment", "model_name"], sort=False)
+        .apply(_calls_summary, include_groups=False)
+    )
+
+
+def _call_cost(calls: pd.DataFrame, prices: dict) -> pd.Series:
+    """Cost of API calls given per-million-token prices per model"""
+    def _price(kind):
+        return calls["model_name"].map(
+            lambda model: prices.get(model, {}).get(kind, np.nan))
+
+    prompt_tokens = calls["prompt_tokens"].astype(float)
+    hit_tokens = calls["prompt_cache_hit_tokens"].astype(float).fillna(0)
+    hit_price = _price("prompt_cache_hit").fillna(_price("prompt"))
+    return (
+        (prompt_tokens - hit_tokens) * _price("prompt")
+        + hit_tokens * hit_price
+        + calls["completion_tokens"].astype(float) * _price("completion")
+    ) / 1e6
+
+
+def cascade_report(
+    experiments: dict, baseline: str | None = None,
+    prices: dict | None = None,
+) -> pd.DataFrame:
+    """Which models answered the steps of each experiment, and at what
+    latency and cost
+
+    Meant to compare a model cascade (see `utils.model_utils.ModelCascade`)
+    with single-model runs: the rejected attempts of escalated steps
+    (`escalations`) are counted in the tokens and cost of their step,
+    as they are in its latency. Failed steps are left out.
+
+    Args:
+        experiments (dict): experiment name -> results or results path
+        baseline (str | None): experiment the others are compared with,
+            e.g. an all-reasoner run. Defaults to None.
+        prices (dict | None): model name -> {"prompt", "completion",
+            optionally "prompt_cache_hit"} prices per million tokens.
+            Defaults to None (no cost columns).
+
+    Returns:
+        pd.DataFrame: one row per experiment with n_steps,
+            escalation_rate, the share of steps answered by each model,
+            mean latency and tokens per step, correct_perc_fix and,
+            with prices, cost_per_step; with a baseline, the latency
+            (and cost) saving relative to it
+    """
+    token_columns = ["prompt_tokens", "completion_tokens",
+                     "prompt_cache_hit_tokens", "prompt_cache_miss_tokens"]
+    rows = {}
+    for name, experiment_results in experiments.items():
+        steps = results_to_frame(experiment_results, with_responses=False)
+        for column in ["model_name", "latency", "escalations", *token_columns]:
+            if column not in steps:
+                steps[column] = np.nan
+        steps = steps[~failed_steps(steps)].reset_index(drop=True)
+        n_steps = len(steps)
+
+        # Every API call of a step: the accepted one and the rejected ones
+        escalations = steps["escalations"].map(
+            lambda attempts: attempts if isinstance(attempts, list) else [])
+        calls = pd.concat(
+            [
+                steps[["model_name", *token_columns]],
+                pd.DataFrame(
+                    [attempt for attempts in escalations for attempt in attempts],
+                    columns=["model_name", *token_columns]),
+            ],
+            ignore_index=True,
+        )
+
+        row = {
+            "n_steps": n_steps,
+            "escalation_rate": (escalations.map(len) > 0).mean(),
+            **{
+                f"answered_by_{model}": share
+                for model, share in steps["model_name"].fillna("unknown")
+                .value_counts(normalize=True).items()
+            },
+            "mean_latency": steps["latency"].astype(float).mean(),
+            "prompt_tokens_per_step": (
+                calls["prompt_tokens"].astype(float).sum(min_count=1) / n_steps
+                if n_steps else np.nan),
+            "completion_tokens_per_step": (
+                calls["completion_tokens"].astype(float).sum(min_count=1) / n_steps
+                if n_steps else np.nan),
+            "correct_perc_fix": evaluate_experiment_frame(
+                experiment_results)[1]["correct_perc_fix"],
+        }
+        if prices is not None:
+            row["cost_per_step"] = (
+                _call_cost(calls, prices).sum(min_count=1) / n_steps
+                if n_steps else np.nan)
+        rows[name] = row
+
+    report = pd.DataFrame.from_dict(rows, orient="index")
+    answered_by = sorted(
+        column for column in report if column.startswith("answered_by_"))
+    report[answered_by] = report[answered_by].fillna(0.0)
+    if baseline is not None:
+        report["latency_saving"] = (
+            1 - report["mean_latency"] / report.loc[baseline, "mean_latency"])
+        if prices is not None:
+            report["cost_saving"] = (
+                1 - report["cost_per_step"]
+                / report.loc[baseline, "cost_per_step"])
+    return report
+
+
+def _score_batch(steps: list[dict], delta: float) -> pd.DataFrame:
+    """Metrics of a batch of (non-failed) history steps, see `_step_metrics`"""
+    return _step_metrics(
+        pd.Series([step.get("model_response") for step in steps],
+                  dtype=object),
+        pd.Series([step.get("annotator_answer") for step in steps],
+                  dtype=object),
+        delta,
+    )
+
+
+class OnlineEvaluator:
+    """Scores conversation steps while the run is still generating them
+
+    Steps are pushed with `submit` (e.g. from `on_step_complete`) into a
+    queue; `n_workers` worker tasks take them in batches and score them
+    with the metrics of `evaluate_experiment_frame` in an executor, so
+    that the event loop keeps sending requests. Live parsability,
+    accuracy and scoring throughput are available from `summary`.
+
+    With `abort_below_parsable`, the run is stopped (through `on_abort`)
+    as soon as the share of parsable answers among the last
+    `abort_window` scored steps falls below the threshold.
+
+    Args:
+        delta (float, optional): tolerance for a close match.
+            Defaults to 0.05.
+        n_workers (int): scoring workers. Defaults to 2.
+        batch_size (int): most steps scored at once. Defaults to 64.
+        abort_below_parsable (float | None): parsability under which
+            the run is aborted. Defaults to None.
+        abort_window (int): scored steps the parsability is measured
+            over before aborting. Defaults to 50.
+        executor (concurrent.futures.Executor | None): where batches are
+            scored. Defaults to None (the loop's default thread pool).
+    """
+
+    def __init__(
+        self, delta=0.05, n_workers: int = 2, batch_size: int = 64,
+        abort_below_parsable: float | None = None, abort_window: int = 50,
+        executor=None,
+    ):
+        self.delta = delta
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.abort_below_parsable = abort_below_parsable
+        self.executor = executor
+
+        self.n_submitted = 0
+        self.n_scored = 0
+        self.n_failed = 0
+        self.n_parsable = 0
+        self.n_correct = 0
+        self.n_correct_perc_fix = 0
+        self.records = []
+        self.abort_reason = None
+        self.on_abort = None  # called with the reason when aborting
+
+        self._recent = deque(maxlen=abort_window)
+        self._queue = None
+        self._workers = []
+        self._start_time = None
+
+    def start(self):
+        """Starts the workers on the running event loop (once)"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._start_time = monotonic()
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(self.n_workers)]
+
+    def submit(self, step: dict, entry_id=None):
+        """Queues a finished history step for scoring"""
+        self.n_submitted += 1
+        self._queue.put_nowait((entry_id, step))
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                scorable = [
+                    (entry_id, step) for entry_id, step in batch
+                    if not step_failed(step)]
+                self.n_failed += len(batch) - len(scorable)
+                if scorable:
+                    metrics = await loop.run_in_executor(
+                        self.executor, _score_batch,
+                        [step for _, step in scorable], self.delta)
+                    self._record(scorable, metrics)
+            except Exception as e:
+                # A worker that died would leave `drain` waiting forever
+                print(f"Could not score {len(batch)} steps: {e!r}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _record(self, scorable: list[tuple], metrics: pd.DataFrame):
+        for (entry_id, step), row in zip(
+                scorable, metrics.to_dict("records")):
+            self.records.append({
+                "entry_id": entry_id,
+                "question": step.get("question"),
+                "model_pred": step.get("model_response"),
+                "annot_ans": step.get("annotator_answer"),
+                **row,
+            })
+            self._recent.append(bool(row["parsable"]))
+        self.n_scored += len(metrics)
+        self.n_parsable += int(metrics["parsable"].sum())
+        self.n_correct += int((metrics["delta"] <= self.delta).sum())
+        self.n_correct_perc_fix += int(metrics["close_match_perc_fix"].sum())
+
+        if (self.abort_below_parsable is not None
+                and self.abort_reason is None
+                and len(self._recent) == self._recent.maxlen):
+            parsable = sum(self._recent) / len(self._recent)
+            if parsable < self.abort_below_parsable:
+                self.abort_reason = (
+                    f"{parsable:.0%} of the last {len(self._recent)} answers "
+                    f"parsable, below {self.abort_below_parsable:.0%}")
+                if self.on_abort is not None:
+                    self.on_abort(self.abort_reason)
+
+    async def drain(self):
+        """Waits until every submitted step has been scored"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        """Scores the queued steps, then stops the workers"""
+        await self.drain()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def summary(self) -> dict:
+        """Live metrics of the steps scored so far"""
+        elapsed = (
+            max(monotonic() - self._start_time, 1e-9)
+            if self._start_time is not None else np.nan)
+        return {
+            "n_steps": self.n_scored,
+            "n_errors": self.n_failed,
+            "parsable": (
+                self.n_parsable / self.n_scored if self.n_scored else np.nan),
+            "correct": (
+                self.n_correct / self.n_scored if self.n_scored else np.nan),
+            "correct_perc_fix": (
+                self.n_correct_perc_fix / self.n_scored
+                if self.n_scored else np.nan),
+            "steps_per_sec": self.n_scored / elapsed,
+            "backlog": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    def report(self) -> str:
+        """One-line summary for the progress lines"""
+        summary = self.summary()
+        if not summary["n_steps"]:
+            return "nothing scored yet"
+        return (
+            f"{summary['parsable']:.1%} parsable, "
+            f"{summary['correct_perc_fix']:.1%} correct over "
+            f"{summary['n_steps']} scored steps "
+            f"({summary['steps_per_sec']:.1f} steps/s, "
+            f"backlog {summary['backlog']})"
+        )
+
+    def frame(self) -> pd.DataFrame:
+        """Scored steps, with the metrics of `evaluate_experiment_frame`"""
+        return pd.DataFrame(self.records)
+
+
 if __name__ == "__main__":
 
     # mock_answer = ['0.01', '10', '10%']
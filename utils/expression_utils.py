@@ -0,0 +1,161 @@
+import ast
+import operator
+from functools import lru_cache
+from typing import Callable
+
+
+# The 5 operators of SYSTEM_PROMPT_V3
+ALLOWED_FUNCTIONS = {
+    "add": operator.add,
+    "subtract": operator.sub,
+    "multiply": operator.mul,
+    "divide": operator.truediv,
+    "power": operator.pow,
+}
+
+# Plain arithmetic is also accepted, as the models sometimes answer
+# with e.g. \boxed{2.5 - 5} and python's eval used to accept it
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+_UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+# Guards against pathological model outputs
+MAX_EXPRESSION_LENGTH = 10_000
+MAX_DEPTH = 64
+MAX_EXPONENT = 1_000
+MAX_RESULT_BITS = 100_000
+
+
+class ExpressionError(ValueError):
+    """Raised when an expression is outside the supported grammar
+    or trips one of the guards"""
+
+
+def _guarded_power(base, exponent):
+    """`base ** exponent` with limits on the exponent and the size
+    of integer results"""
+    if abs(exponent) > MAX_EXPONENT:
+        raise ExpressionError(f"Exponent too large: {exponent}")
+    if (isinstance(base, int) and isinstance(exponent, int)
+            and base.bit_length() * abs(exponent) > MAX_RESULT_BITS):
+        raise ExpressionError("Result too large")
+    return operator.pow(base, exponent)
+
+
+def _compile_node(node: ast.AST, depth: int) -> Callable:
+    """Turns an AST node into a closure that computes its value"""
+    if depth > MAX_DEPTH:
+        raise ExpressionError("Expression nested too deeply")
+
+    if isinstance(node, ast.Expression):
+        return _compile_node(node.body, depth)
+
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if not isinstance(value, (int, float, complex)):
+            raise ExpressionError(f"Unsupported constant: {value!r}")
+        return lambda: value
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+        op = _UNARY_OPERATORS[type(node.op)]
+        operand = _compile_node(node.operand, depth + 1)
+        return lambda: op(operand())
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        op = (
+            _guarded_power if isinstance(node.op, ast.Pow)
+            else _BINARY_OPERATORS[type(node.op)]
+        )
+        left = _compile_node(node.left, depth + 1)
+        right = _compile_node(node.right, depth + 1)
+        return lambda: op(left(), right())
+
+    if isinstance(node, ast.Call):
+        if (not isinstance(node.func, ast.Name)
+                or node.func.id not in ALLOWED_FUNCTIONS):
+            raise ExpressionError("Only add/subtract/multiply/divide/power "
+                                  "can be called")
+        if node.keywords or len(node.args) != 2:
+            raise ExpressionError(
+                f"{node.func.id} takes exactly two positional arguments")
+        op = (
+            _guarded_power if node.func.id == "power"
+            else ALLOWED_FUNCTIONS[node.func.id]
+        )
+        left = _compile_node(node.args[0], depth + 1)
+        right = _compile_node(node.args[1], depth + 1)
+        return lambda: op(left(), right())
+
+    if isinstance(node, (ast.Tuple, ast.List)):
+        # e.g. "1,000" is parsed as (1, 0); kept so that the evaluated
+        # value matches python's eval (it is then rejected by float())
+        container = tuple if isinstance(node, ast.Tuple) else list
+        items = [_compile_node(item, depth + 1) for item in node.elts]
+        return lambda: container(item() for item in items)
+
+    raise ExpressionError(f"Unsupported syntax: {type(node).__name__}")
+
+
+@lru_cache(maxsize=65_536)
+def compile_expression(expression: str) -> Callable:
+    """Parses and compiles an expression into a callable
+
+    Results are LRU-cached, so repeated expressions are parsed once
+
+    Args:
+        expression (str): cleaned answer string
+
+    Returns:
+        Callable: zero-argument function returning the value
+    """
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionError("Expression too long")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except (SyntaxError, RecursionError, MemoryError) as e:
+        raise ExpressionError(f"Invalid expression: {e}") from e
+    return _compile_node(tree, depth=0)
+
+
+def evaluate_expression(expression: str) -> float | int:
+    """Evaluates an add/subtract/multiply/divide/power expression
+
+    Args:
+        expression (str): cleaned answer string
+
+    Returns:
+        float|int: evaluated answer
+    """
+    return compile_expression(expression)()
+
+
+def evaluate_expressions(expressions: list[str]) -> list:
+    """Batch evaluation; each distinct expression is evaluated once
+
+    Args:
+        expressions (list[str]): cleaned answer strings
+
+    Returns:
+        list: evaluated answers, None where the expression
+            could not be evaluated
+    """
+    evaluated = {}
+    for expression in expressions:
+        if expression in evaluated:
+            continue
+        try:
+            evaluated[expression] = evaluate_expression(expression)
+        except Exception:
+            evaluated[expression] = None
+    return [evaluated[expression] for expression in expressions]
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+
+DEFAULT_RESPONSES = (
+    "The change is the difference of the two values: "
+    "\\boxed{subtract(206588, 181001)}",
+    "As a percentage of the previous year: "
+    "\\boxed{divide(subtract(206588, 181001), 181001)}",
+    "Reading it from the table, the answer is \\boxed{25587}",
+)
+
+
+@dataclass
+class MockBackendConfig:
+    """Behaviour of the mock chat completions backend
+
+    Latency is drawn from a log-normal distribution with the given
+    median (seconds) and sigma; sigma=0 gives a constant latency.
+    Streamed responses spread the latency over the chunks, after a
+    first-token delay of `time_to_first_token` x the latency.
+
+    Args:
+        latency_median (float): median latency in seconds.
+            Defaults to 0.5.
+        latency_sigma (float): log-normal sigma. Defaults to 0.5.
+        time_to_first_token (float): share of the latency before the
+            first streamed chunk. Defaults to 0.3.
+        error_rate (float): share of 500 responses. Defaults to 0.0.
+        rate_limit_rate (float): share of 429 responses.
+            Defaults to 0.0.
+        retry_after (float): Retry-After of the 429s, in seconds.
+            Defaults to 1.0.
+        responses (tuple[str, ...]): canned answers, picked at random
+        chunk_size (int): characters per streamed chunk. Defaults to 8.
+        supports_n (bool): answer requests for `n` choices with n
+            choices; otherwise with one, like backends that ignore `n`.
+            Defaults to True.
+        seed (int | None): random seed. Defaults to None.
+    """
+    latency_median: float = 0.5
+    latency_sigma: float = 0.5
+    time_to_first_token: float = 0.3
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    responses: tuple[str, ...] = DEFAULT_RESPONSES
+    chunk_size: int = 8
+    supports_n: bool = True
+    seed: int | None = None
+    _random: random.Random = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+
+    def draw_latency(self) -> float:
+        if self.latency_sigma <= 0:
+            return self.latency_median
+        return self.latency_median * self._random.lognormvariate(
+            0, self.latency_sigma)
+
+    def draw_outcome(self) -> int:
+        """HTTP status code of the next request"""
+        draw = self._random.random()
+        if draw < self.rate_limit_rate:
+            return 429
+        if draw < self.rate_limit_rate + self.error_rate:
+            return 500
+        return 200
+
+    def draw_response(self) -> str:
+        return self._random.choice(self.responses)
+
+
+def _usage(request: dict, text: str) -> dict:
+    prompt_tokens = sum(
+        len(str(message.get("content") or ""))
+        for message in request.get("messages", [])) // 4 + 1
+    completion_tokens = len(text) // 4 + 1
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_cache_hit_tokens": 0,
+        "prompt_cache_miss_tokens": prompt_tokens,
+    }
+
+
+def _completion(request: dict, texts: list[str]) -> dict:
+    usage = _usage(request, "".join(texts))
+    usage["completion_tokens"] = sum(len(text) // 4 + 1 for text in texts)
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    return {
+        "id": "mock-completion",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [
+            {
+                "index": ix,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": text},
+            }
+            for ix, text in enumerate(texts)
+        ],
+        "usage": usage,
+    }
+
+
+def _draw_texts(request: dict, config: MockBackendConfig) -> list[str]:
+    n = request.get("n") or 1
+    return [
+        config.draw_response()
+        for _ in range(n if config.supports_n else 1)]
+
+
+def _chunk(request: dict, delta: dict, finish_reason=None) -> bytes:
+    chunk = {
+        "id": "mock-completion",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [{
+            "index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n".encode()
+
+
+def _error_response(status_code: int, config: MockBackendConfig):
+    if status_code == 429:
+        return httpx.Response(
+            429,
+            headers={"retry-after-ms": str(int(config.retry_after * 1000))},
+            json={"error": {"message": "Rate limit reached (mock)",
+                            "type": "rate_limit_error"}},
+        )
+    return httpx.Response(
+        status_code,
+        json={"error": {"message": "Internal server error (mock)",
+                        "type": "server_error"}},
+    )
+
+
+class _AsyncEventStream(httpx.AsyncByteStream):
+    """Server-sent events of a streamed completion, with delays"""
+
+    def __init__(self, request: dict, text: str, latency: float,
+                 config: MockBackendConfig):
+        self.request, self.text = request, text
+        self.latency, self.config = latency, config
+
+    async def __aiter__(self):
+        pieces = [
+            self.text[ix:ix + self.config.chunk_size]
+            for ix in range(0, len(self.text), self.config.chunk_size)
+        ]
+        first_token = self.latency * self.config.time_to_first_token
+        per_chunk = (self.latency - first_token) / max(len(pieces), 1)
+        await asyncio.sleep(first_token)
+        yield _chunk(self.request, {"role": "assistant", "content": ""})
+        for piece in pieces:
+            await asyncio.sleep(per_chunk)
+            yield _chunk(self.request, {"content": piece})
+        yield _chunk(self.request, {}, finish_reason="stop")
+        if (self.request.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = {
+                "id": "mock-completion", "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": self.request.get("model", "mock"), "choices": [],
+                "usage": _usage(self.request, self.text),
+            }
+            yield f"data: {json.dumps(usage_chunk)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+
+class MockAsyncTransport(httpx.AsyncBaseTransport):
+    """httpx transport answering /chat/completions like the provider,
+    without any network I/O
+
+    Args:
+        config (MockBackendConfig | None): backend behaviour.
+            Defaults to None (MockBackendConfig defaults).
+    """
+
+    def __init__(self, config: MockBackendConfig | None = None):
+        self.config = config or MockBackendConfig()
+        self.requests = 0
+
+    async def handle_async_request(self, request: httpx.Request):
+        self.requests += 1
+        body = json.loads(request.content or b"{}")
+        latency = self.config.draw_latency()
+        status_code = self.config.draw_outcome()
+        if status_code != 200:
+            # Errors come back faster than answers
+            await asyncio.sleep(latency * self.config.time_to_first_token)
+            return _error_response(status_code, self.config)
+
+        if body.get("stream"):
+            text = self.config.draw_response()
+            return httpx.Response(
+                200, headers={"content-type": "text/event-stream"},
+                stream=_AsyncEventStream(body, text, latency, self.config))
+
+        texts = _draw_texts(body, self.config)
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json=_completion(body, texts))
+
+
+class MockTransport(httpx.BaseTransport):
+    """Blocking version of `MockAsyncTransport` (non-streamed only)"""
+
+    def __init__(self, config: MockBackendConfig | None = None):
+        self.config = config or MockBackendConfig()
+        self.requests = 0
+
+    def handle_request(self, request: httpx.Request):
+        self.requests += 1
+        body = json.loads(request.content or b"{}")
+        latency = self.config.draw_latency()
+        status_code = self.config.draw_outcome()
+        if status_code != 200:
+            time.sleep(latency * self.config.time_to_first_token)
+            return _error_response(status_code, self.config)
+
+        time.sleep(latency)
+        texts = _draw_texts(body, self.config)
+        return httpx.Response(200, json=_completion(body, texts))
+
+
+def mock_async_client(
+    config: MockBackendConfig | None = None,
+) -> AsyncOpenAI:
+    """AsyncOpenAI client talking to a `MockAsyncTransport`
+
+    The SDK's own retries are disabled so that only the retry policy
+    of the runner is exercised
+
+    Args:
+        config (MockBackendConfig | None): backend behaviour.
+            Defaults to None.
+
+    Returns:
+        AsyncOpenAI: client; its transport is `client.mock_transport`
+    """
+    transport = MockAsyncTransport(config)
+    client = AsyncOpenAI(
+        api_key="mock", base_url="http://mock.local/v1", max_retries=0,
+        http_client=httpx.AsyncClient(transport=transport),
+    )
+    client.mock_transport = transport
+    return client
+
+
+def mock_client(config: MockBackendConfig | None = None) -> OpenAI:
+    """Blocking version of `mock_async_client`"""
+    transport = MockTransport(config)
+    client = OpenAI(
+        api_key="mock", base_url="http://mock.local/v1", max_retries=0,
+        http_client=httpx.Client(transport=transport),
+    )
+    client.mock_transport = transport
+    return client
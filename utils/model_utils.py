@@ -1,8 +1,29 @@
 import asyncio
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import threading
+import weakref
+import httpx
 import pandas as pd
+from collections import deque
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable
+from time import monotonic, time
 from openai import AsyncOpenAI, OpenAI
-from tenacity import retry, stop_after_attempt, wait_random_exponential
-from utils.eval_utils import find_answer
+from openai.types.chat import ChatCompletion
+from utils.cache_utils import ResponseCache, completion_cache_key
+from utils.data_utils import estimate_tokens
+from utils.eval_utils import (
+    OnlineEvaluator, evaluate_maths, find_answer, vote_answers)
+from utils.prompts import SINGLE_REQUEST_TEMPLATE
+from utils.results_utils import (
+    append_result, load_results, open_results_file, step_failed)
+from utils.retry_utils import (
+    HEDGE_HEADER, HedgePolicy, RetryPolicy, error_record)
 
 
 def add_past_responses(history: list[str]) -> list[dict]:
@@ -28,38 +49,1171 @@ def add_past_responses(history: list[str]) -> list[dict]:
     return output
 
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
+class AsyncRateLimiter:
+    """Sliding-window limiter on requests and tokens per minute
+
+    Shared by all in-flight conversations of a run so that the provider
+    sees a bounded request/token rate regardless of the concurrency.
+    Either limit can be None to disable it.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
+        window: float = 60.0,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._requests = deque()  # timestamps
+        self._tokens = deque()  # (timestamp, tokens)
+        self._tokens_in_window = 0
+        self._lock = asyncio.Lock()
+
+    def _prune(self, now: float):
+        while self._requests and now - self._requests[0] >= self.window:
+            self._requests.popleft()
+        while self._tokens and now - self._tokens[0][0] >= self.window:
+            self._tokens_in_window -= self._tokens.popleft()[1]
+
+    def _wait_time(self, now: float, tokens: int) -> float:
+        """Seconds until the request fits in the window; 0 if it fits now"""
+        wait = 0.0
+        if (self.requests_per_minute is not None
+                and len(self._requests) >= self.requests_per_minute):
+            wait = self.window - (now - self._requests[0])
+        # An empty window always admits, so that a single request larger
+        # than the token limit cannot block the run forever
+        if (self.tokens_per_minute is not None and self._tokens
+                and self._tokens_in_window + tokens > self.tokens_per_minute):
+            wait = max(wait, self.window - (now - self._tokens[0][0]))
+        return wait
+
+    async def acquire(self, tokens: int = 0):
+        """Waits until one request of `tokens` tokens fits in the window
+
+        Args:
+            tokens (int): estimated tokens of the request. Defaults to 0.
+        """
+        async with self._lock:
+            while True:
+                now = monotonic()
+                self._prune(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    self._requests.append(now)
+                    self._add_tokens(now, tokens)
+                    return
+                await asyncio.sleep(max(wait, 0.01))
+
+    def _add_tokens(self, now: float, tokens: int):
+        if tokens:
+            self._tokens.append((now, tokens))
+            self._tokens_in_window += tokens
+
+    def record(self, extra_tokens: int):
+        """Corrects the token count of the window once the true usage
+        of a request is known
+
+        Args:
+            extra_tokens (int): true usage minus the estimate
+                passed to `acquire`
+        """
+        self._add_tokens(monotonic(), extra_tokens)
+
+
+class PoolMetrics:
+    """Connection pool utilisation and queue wait of an HTTP client
+
+    Fed by the `trace` extension of httpcore: a request is queued until
+    the pool gives it a connection, i.e. until it starts connecting
+    (new connection) or sending its headers (reused one); it then holds
+    the connection until its response is closed.
+
+    Args:
+        max_connections (int | None): pool size, for the utilisation
+    """
+
+    _ASSIGNED_EVENTS = (
+        "connection.connect_tcp.started",
+        "http11.send_request_headers.started",
+        "http2.send_request_headers.started",
+    )
+    _CLOSED_EVENTS = (
+        "http11.response_closed.complete", "http11.response_closed.failed",
+        "http2.response_closed.complete", "http2.response_closed.failed",
+    )
+
+    def __init__(self, max_connections: int | None = None):
+        self.max_connections = max_connections
+        self.requests = 0
+        self.active = 0
+        self.queued = 0
+        self.peak_active = 0
+        self.peak_queued = 0
+        self.new_connections = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def request_started(self) -> dict:
+        """Counts a new request; returns its state for `on_event`"""
+        with self._lock:
+            self.requests += 1
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+        return {"start": monotonic(), "assigned": False, "finished": False}
+
+    def request_finished(self, state: dict):
+        with self._lock:
+            if state["finished"]:
+                return
+            state["finished"] = True
+            if state["assigned"]:
+                self.active -= 1
+            else:
+                self.queued -= 1
+
+    def on_event(self, state: dict, event_name: str):
+        if event_name in self._ASSIGNED_EVENTS and not state["assigned"]:
+            wait = monotonic() - state["start"]
+            with self._lock:
+                state["assigned"] = True
+                self.queued -= 1
+                self.active += 1
+                self.peak_active = max(self.peak_active, self.active)
+                self.queue_wait_total += wait
+                self.queue_wait_max = max(self.queue_wait_max, wait)
+        elif event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.new_connections += 1
+        elif event_name in self._CLOSED_EVENTS:
+            self.request_finished(state)
+
+    def stats(self) -> dict:
+        """Requests, active/queued counts, pool utilisation, queue wait
+        and connections opened"""
+        def utilisation(n_active):
+            if not self.max_connections:
+                return None
+            return n_active / self.max_connections
+
+        return {
+            "requests": self.requests,
+            "active": self.active,
+            "queued": self.queued,
+            "peak_active": self.peak_active,
+            "peak_queued": self.peak_queued,
+            "utilisation": utilisation(self.active),
+            "peak_utilisation": utilisation(self.peak_active),
+            "mean_queue_wait": (
+                self.queue_wait_total / self.requests if self.requests
+                else 0.0),
+            "max_queue_wait": self.queue_wait_max,
+            "new_connections": self.new_connections,
+        }
+
+
+class InstrumentedAsyncTransport(httpx.AsyncHTTPTransport):
+    """httpx transport recording `PoolMetrics`"""
+
+    def __init__(self, metrics: PoolMetrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    async def handle_async_request(self, request: httpx.Request):
+        state = self.metrics.request_started()
+        previous_trace = request.extensions.get("trace")
+
+        async def _trace(event_name, info):
+            self.metrics.on_event(state, event_name)
+            if previous_trace is not None:
+                await previous_trace(event_name, info)
+
+        request.extensions["trace"] = _trace
+        try:
+            return await super().handle_async_request(request)
+        except BaseException:
+            self.metrics.request_finished(state)
+            raise
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    """Blocking version of `InstrumentedAsyncTransport`"""
+
+    def __init__(self, metrics: PoolMetrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    def handle_request(self, request: httpx.Request):
+        state = self.metrics.request_started()
+        previous_trace = request.extensions.get("trace")
+
+        def _trace(event_name, info):
+            self.metrics.on_event(state, event_name)
+            if previous_trace is not None:
+                previous_trace(event_name, info)
+
+        request.extensions["trace"] = _trace
+        try:
+            return super().handle_request(request)
+        except BaseException:
+            self.metrics.request_finished(state)
+            raise
+
+
+@dataclass(frozen=True)
+class HttpSettings:
+    """Connection pool, protocol and timeout settings of an API client
+
+    Timeouts are in seconds; `read_timeout` bounds the wait for each
+    chunk of a response, so it must cover the slowest non-streamed
+    answer (deepseek-reasoner can think for minutes).
+    `max_retries` is the SDK's own retry loop, disabled by default as
+    `RetryPolicy` is the single retry layer.
+    """
+    api_key: str | None = None
+    base_url: str = "https://api.deepseek.com"
+    max_connections: int = 100
+    max_keepalive_connections: int = 50
+    keepalive_expiry: float = 60.0
+    http2: bool = False
+    connect_timeout: float = 10.0
+    read_timeout: float = 600.0
+    write_timeout: float = 30.0
+    pool_timeout: float | None = None
+    max_retries: int = 0
+
+    def transport_kwargs(self) -> dict:
+        http2 = self.http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            print("HTTP/2 needs the h2 package (pip install httpx[http2]), "
+                  "falling back to HTTP/1.1")
+            http2 = False
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "http2": http2,
+        }
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout, read=self.read_timeout,
+            write=self.write_timeout, pool=self.pool_timeout)
+
+    def client_kwargs(self) -> dict:
+        return {
+            "api_key": (
+                self.api_key if self.api_key is not None
+                else os.environ.get('DEEPSEEK_API')),
+            "base_url": self.base_url,
+            "max_retries": self.max_retries,
+            "timeout": self.timeout(),
+        }
+
+
+def make_async_client(settings: HttpSettings | None = None) -> AsyncOpenAI:
+    """AsyncOpenAI client with explicit pool limits and timeouts
+
+    The pool metrics are available as `client.pool_metrics`
+
+    Args:
+        settings (HttpSettings | None): client settings.
+            Defaults to None (HttpSettings defaults).
+
+    Returns:
+        AsyncOpenAI: OpenAI client
+    """
+    settings = settings or HttpSettings()
+    metrics = PoolMetrics(settings.max_connections)
+    client = AsyncOpenAI(
+        **settings.client_kwargs(),
+        http_client=httpx.AsyncClient(
+            transport=InstrumentedAsyncTransport(
+                metrics, **settings.transport_kwargs()),
+            timeout=settings.timeout(),
+        ),
+    )
+    client.pool_metrics = metrics
+    return client
+
+
+def make_client(settings: HttpSettings | None = None) -> OpenAI:
+    """Blocking version of `make_async_client`"""
+    settings = settings or HttpSettings()
+    metrics = PoolMetrics(settings.max_connections)
+    client = OpenAI(
+        **settings.client_kwargs(),
+        http_client=httpx.Client(
+            transport=InstrumentedTransport(
+                metrics, **settings.transport_kwargs()),
+            timeout=settings.timeout(),
+        ),
+    )
+    client.pool_metrics = metrics
+    return client
+
+
+# An async connection pool belongs to the event loop it was first used
+# in, so shared async clients are kept per loop
+_shared_async_clients = weakref.WeakKeyDictionary()
+_shared_clients = {}
+
+
+def shared_async_client(settings: HttpSettings | None = None) -> AsyncOpenAI:
+    """Client shared by every caller of the running event loop
+    with the same settings (see `make_async_client`)"""
+    settings = settings or HttpSettings()
+    clients = _shared_async_clients.setdefault(
+        asyncio.get_running_loop(), {})
+    if settings not in clients:
+        clients[settings] = make_async_client(settings)
+    return clients[settings]
+
+
+def shared_client(settings: HttpSettings | None = None) -> OpenAI:
+    """Blocking client shared by every caller with the same settings"""
+    settings = settings or HttpSettings()
+    if settings not in _shared_clients:
+        _shared_clients[settings] = make_client(settings)
+    return _shared_clients[settings]
+
+
+def report_pool_stats(client):
+    """Prints the connection pool metrics of a client, if it has any"""
+    metrics = getattr(client, "pool_metrics", None)
+    if metrics is None:
+        return
+    pool_stats = metrics.stats()
+    peak = (
+        f" ({pool_stats['peak_utilisation']:.0%} of the pool)"
+        if pool_stats["peak_utilisation"] is not None else ""
+    )
+    print(
+        f"HTTP pool: {pool_stats['requests']} requests, "
+        f"peak {pool_stats['peak_active']} active{peak}, "
+        f"peak {pool_stats['peak_queued']} queued, "
+        f"queue wait mean {1000 * pool_stats['mean_queue_wait']:.1f}ms / "
+        f"max {1000 * pool_stats['max_queue_wait']:.1f}ms, "
+        f"{pool_stats['new_connections']} connections opened"
+    )
+
+
+CONTEXT_ACKNOWLEDGEMENT = 'Context acknowledged, awaiting for question.'
+
+
+def select_context(
+    processed_data_entry: pd.Series,
+    use_short_context: bool = False,
+    use_gold_inds: bool = False,
+    example_shots: str = "",
+    use_retrieved_context: bool = False,
+) -> str:
+    """Chooses which context to use and adds the example shots
+    at the start of it
+
+    Args:
+        processed_data_entry (pd.Series): processed data entry
+        use_short_context (bool): table only. Defaults to False.
+        use_gold_inds (bool): oracle gold indices. Defaults to False.
+        example_shots (str): few-shot examples. Defaults to "".
+        use_retrieved_context (bool): BM25-selected sentences and rows,
+            see `utils.retrieval_utils.add_retrieved_context`.
+            Defaults to False.
+
+    Returns:
+        str: context to send to the model
+    """
+    if use_short_context + use_gold_inds + use_retrieved_context > 1:
+        raise ValueError(
+            'Only one of use_short_context, use_gold_inds and '
+            'use_retrieved_context can be True')
+
+    _context = (
+        processed_data_entry.get('gold_inds') if use_gold_inds
+        else processed_data_entry.get("short_context") if use_short_context
+        else processed_data_entry.get("retrieved_context")
+        if use_retrieved_context
+        else processed_data_entry.get('full_context')
+    )
+
+    return example_shots + _context
+
+
+def build_messages(
+    sys_prompt: str, context: str, history: list[dict], question: str,
+) -> list[dict]:
+    """Builds the prompt of one conversation step
+
+    The layout is kept byte-identical across steps and entries:
+    [system, context, acknowledgement] form a stable prefix shared by
+    every step of a conversation (and by every entry with the same
+    filing), followed by the growing history and the new question.
+    This lets the provider's prompt cache serve the prefix.
+
+    Args:
+        sys_prompt (str): system prompt
+        context (str): output of `select_context`
+        history (list[dict]): previous steps of the conversation
+        question (str): current question
+
+    Returns:
+        list[dict]: input prompt
+    """
+    return [
+        {"role": "system", "content": sys_prompt},
+        {"role": "user", "content": context},
+        {"role": "assistant", "content": CONTEXT_ACKNOWLEDGEMENT},
+        *add_past_responses(history),
+        {"role": "user", "content": question},
+    ]
+
+
+def response_fields(response, call_stats: dict, latency: float) -> dict:
+    """Instrumentation recorded on every history step
+
+    Token usage (including DeepSeek's `prompt_cache_hit_tokens`/
+    `prompt_cache_miss_tokens`), finish_reason, wall-clock latency
+    of the step (retries and rate-limit waits included),
+    number of retries, whether the response came from the cache and
+    whether a hedged duplicate was sent.
+    Streamed calls also report time to first token/answer and
+    whether the stream was stopped early.
+    Fields are None when not available, e.g. when the call failed
+
+    Args:
+        response: API response, or None if the call failed
+        call_stats (dict): counters filled in by the completion wrapper
+        latency (float): wall-clock seconds spent on the step
+
+    Returns:
+        dict: instrumentation fields
+    """
+    usage = getattr(response, "usage", None)
+    choices = getattr(response, "choices", None)
+    return {
+        "model_name": call_stats.get("model_name"),
+        "latency": latency,
+        "time_to_first_token": call_stats.get("time_to_first_token"),
+        "time_to_answer": call_stats.get("time_to_answer"),
+        "early_stopped": call_stats.get("early_stopped"),
+        "retries": max(call_stats.get("attempts", 1) - 1, 0),
+        "cached": call_stats.get("cached", False),
+        "hedged": call_stats.get("hedged", False),
+        "finish_reason": choices[0].finish_reason if choices else None,
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "total_tokens": getattr(usage, "total_tokens", None),
+        "prompt_cache_hit_tokens": getattr(
+            usage, "prompt_cache_hit_tokens", None),
+        "prompt_cache_miss_tokens": getattr(
+            usage, "prompt_cache_miss_tokens", None),
+    }
+
+
+CONVERSATION_MODES = ("sequential", "single_request")
+
+
+def build_single_request_question(questions: list[str]) -> str:
+    """Builds the user turn that asks all questions at once
+
+    Args:
+        questions (list[str]): questions of the conversation, in order
+
+    Returns:
+        str: single user message
+    """
+    numbered = "\n".join(
+        f"{ix + 1}. {question}" for ix, question in enumerate(questions))
+    return SINGLE_REQUEST_TEMPLATE.format(
+        questions=numbered, n_questions=len(questions))
+
+
+def parse_single_request_answers(text: str, n_questions: int) -> list[str]:
+    """Splits a single_request response into one answer text per question
+
+    Reads the {"answers": [...]} JSON array; if the response is not valid
+    JSON (or has the wrong length) falls back to splitting the raw text
+    at every boxed expression, in order of appearance
+
+    Args:
+        text (str): LLM output
+        n_questions (int): number of questions asked
+
+    Returns:
+        list[str]: n_questions answer texts ("" when missing)
+    """
+    answers = None
+    try:
+        # Strips markdown code fences around the JSON, if any
+        parsed = json.loads(
+            re.sub(r"^```(?:json)?|```$", "", text.strip()).strip())
+        answers = parsed.get("answers") if isinstance(parsed, dict) else parsed
+    except (json.JSONDecodeError, TypeError):
+        pass
+
+    if not isinstance(answers, list) or len(answers) != n_questions:
+        starts = [match.start() for match in
+                  re.finditer(r"\\boxed\{|\x08oxed\{", text)]
+        answers = [
+            text[start:end]
+            for start, end in zip(starts, starts[1:] + [len(text)])
+        ]
+
+    answers = [str(answer) for answer in answers[:n_questions]]
+    return answers + [""] * (n_questions - len(answers))
+
+
+def single_request_history(
+    questions: list[str], answers: list, text: str, fields: dict,
+) -> list[dict]:
+    """Builds per-step history records from one single_request response
+
+    Records match the sequential mode so that `evaluate_experiment` works
+    unchanged. The instrumentation of the one call (latency, tokens, ...)
+    is kept on the first step only, the later steps carry None, so that
+    per-call reports are not double counted. The raw response is kept
+    on the first step as `batched_response`.
+
+    Args:
+        questions (list[str]): questions asked
+        answers (list): annotator answers
+        text (str): LLM output (or error message)
+        fields (dict): output of `response_fields` for the call
+
+    Returns:
+        list[dict]: history, one record per question
+    """
+    if text.startswith("Error encountered"):
+        step_texts = [text] * len(questions)
+    else:
+        step_texts = parse_single_request_answers(text, len(questions))
+
+    history = []
+    for ix, (question, answer, step_text) in enumerate(
+            zip(questions, answers, step_texts)):
+        step = {
+            "question": question,
+            "complete_response": step_text,
+            "model_response": find_answer(step_text),
+            "annotator_answer": answer,
+            "conversation_mode": "single_request",
+        }
+        if ix == 0:
+            step.update(fields, batched_response=text)
+        else:
+            step.update(
+                {key: None for key in fields},
+                model_name=fields.get("model_name"), retries=0, cached=False)
+        history.append(step)
+    return history
+
+
+def _default_retry_policy() -> RetryPolicy:
+    """Per-call policy used when no shared one is given: 3 attempts,
+    no run-wide budget nor circuit breaker"""
+    return RetryPolicy(
+        max_attempts=3, budget_ratio=None, breaker_threshold=None)
+
+
 async def tenacious_model_completions(
-    client: AsyncOpenAI, model_name: str, messages: list,
+    client: AsyncOpenAI | None, model_name: str, messages: list,
     temperature: float = 0.0, max_token: int = 1024,
     use_structured_outputs=False,
+    rate_limiter: AsyncRateLimiter | None = None,
+    cache: ResponseCache | None = None,
+    call_stats: dict | None = None,
+    retry_policy: RetryPolicy | None = None,
+    n: int = 1,
+    sample_id: int | None = None,
+    hedge_policy: HedgePolicy | None = None,
 ) -> str:
     """Wrapper function that incorporates retries attempts
 
-    As sometimes there are connection errors due to my VPN/ provider
+    As sometimes there are connection errors due to my VPN/ provider.
+    Retries are decided by `retry_policy`, the only retry layer:
+    permanent errors (e.g. 400/401) are raised straight away
 
     Args:
-        client (AsyncOpenAI): OpenAI client
+        client (AsyncOpenAI | None): OpenAI client; None uses the
+            `shared_async_client` of the running event loop
         model_name (str): model name
         messages (list): input prompt
         temperature (float): defaults to 0.0
         max_token (int): defaults to 1024
+        rate_limiter (AsyncRateLimiter | None): shared limiter;
+            every attempt (including retries) waits for capacity.
+            Defaults to None.
+        cache (ResponseCache | None): on-disk response cache;
+            cached requests never reach the API. Defaults to None.
+        call_stats (dict | None): filled in with the number of attempts,
+            the error categories met and whether the response was cached.
+            Defaults to None.
+        retry_policy (RetryPolicy | None): shared retry policy; None
+            retries up to 3 times. Defaults to None.
+        n (int): number of choices to ask for; only sent when above 1.
+            Defaults to 1.
+        sample_id (int | None): index of a sampled request, part of the
+            cache key so that repeated samples of the same prompt are
+            cached separately. Defaults to None.
+        hedge_policy (HedgePolicy | None): hedging of every attempt.
+            Defaults to None.
 
     Returns:
         str: LLM output
     """
 
-    return await client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_token,
-        response_format=(
-            {'type': 'json_object'} if use_structured_outputs else None)
-    )
+    response_format = (
+        {'type': 'json_object'} if use_structured_outputs else None)
+    client = client or shared_async_client()
+    # Only sent when used, so that plain requests stay unchanged
+    sampling = {"n": n} if n > 1 else {}
+
+    call_stats = call_stats if call_stats is not None else {}
+    call_stats["model_name"] = model_name
+
+    if cache is not None:
+        cache_key = completion_cache_key(
+            model_name, messages, temperature, max_token, response_format,
+            extra=(
+                {**sampling, "sample_id": sample_id}
+                if sampling or sample_id is not None else None))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            call_stats["attempts"] = 1
+            call_stats["cached"] = True
+            return cached
+
+    async def _attempt(hedge=None):
+        if rate_limiter is not None:
+            estimated_tokens = estimate_tokens(messages)
+            await rate_limiter.acquire(estimated_tokens)
+
+        # A hedged duplicate (see `HedgePolicy`) is marked as such
+        marker = {}
+        if hedge is not None:
+            marker = {"extra_headers": {HEDGE_HEADER: "1"}}
+            hedge.set()
+        response = await client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_token,
+            response_format=response_format,
+            **sampling,
+            **marker,
+        )
+
+        if rate_limiter is not None and getattr(response, 'usage', None):
+            rate_limiter.record(response.usage.total_tokens - estimated_tokens)
+        return response
+
+    response = await (retry_policy or _default_retry_policy()).run(
+        _attempt if hedge_policy is None
+        else lambda: hedge_policy.run(_attempt, call_stats),
+        call_stats)
+
+    if cache is not None:
+        cache.set(cache_key, response)
+
+    return response
+
+
+class BoxedAnswerDetector:
+    """Incrementally detects when the first boxed answer of a streamed
+    text has been closed
+
+    Text is fed chunk by chunk; every character is looked at once
+    (plus a small overlap to catch markers split across chunks)
+    """
+
+    _MARKERS = ("\\boxed{", "\x08oxed{")
+
+    def __init__(self):
+        self.text = ""
+        self._scanned = 0
+        self._depth = None  # brace depth once inside a boxed answer
+        self.closed = False
+
+    def feed(self, chunk: str) -> bool:
+        """Adds a chunk of text
+
+        Args:
+            chunk (str): new text
+
+        Returns:
+            bool: True once a boxed answer has been closed
+        """
+        self.text += chunk
+        if self.closed:
+            return True
+        if self._depth is None:
+            overlap = max(len(marker) for marker in self._MARKERS) - 1
+            search_from = max(self._scanned - overlap, 0)
+            starts = [
+                (start, start + len(marker))
+                for marker in self._MARKERS
+                for start in [self.text.find(marker, search_from)]
+                if start != -1
+            ]
+            if not starts:
+                self._scanned = len(self.text)
+                return False
+            self._depth = 1
+            self._scanned = min(starts)[1]
+
+        for ix in range(self._scanned, len(self.text)):
+            char = self.text[ix]
+            if char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._scanned = ix + 1
+                    self.closed = True
+                    return True
+        self._scanned = len(self.text)
+        return False
+
+
+async def streaming_model_completions(
+    client: AsyncOpenAI | None, model_name: str, messages: list,
+    temperature: float = 0.0, max_token: int = 1024,
+    use_structured_outputs=False,
+    rate_limiter: AsyncRateLimiter | None = None,
+    cache: ResponseCache | None = None,
+    call_stats: dict | None = None,
+    stop_at_answer: bool = True,
+    retry_policy: RetryPolicy | None = None,
+) -> ChatCompletion:
+    """Streaming version of `tenacious_model_completions`
+
+    Consumes the token deltas and, with `stop_at_answer`, closes the
+    stream as soon as a boxed answer is complete, saving the output
+    tokens (and time) the model would spend after the answer.
+    Time to first token (reasoning tokens included) and time to answer
+    are written to `call_stats`. Streams are not hedged.
+
+    Args:
+        client (AsyncOpenAI | None): OpenAI client; None uses the
+            `shared_async_client` of the running event loop
+        model_name (str): model name
+        messages (list): input prompt
+        temperature (float): defaults to 0.0
+        max_token (int): defaults to 1024
+        rate_limiter (AsyncRateLimiter | None): shared limiter.
+            Defaults to None.
+        cache (ResponseCache | None): on-disk response cache.
+            Defaults to None.
+        call_stats (dict | None): filled in with attempts, cache flag,
+            time_to_first_token, time_to_answer and early_stopped.
+            Defaults to None.
+        stop_at_answer (bool): cancel the stream once the boxed answer
+            closes. Defaults to True.
+        retry_policy (RetryPolicy | None): shared retry policy; None
+            retries up to 3 times. Defaults to None.
+
+    Returns:
+        ChatCompletion: response assembled from the stream; usage is
+            None when the stream was stopped early
+    """
+    client = client or shared_async_client()
+    call_stats = call_stats if call_stats is not None else {}
+    call_stats["model_name"] = model_name
+
+    response_format = (
+        {'type': 'json_object'} if use_structured_outputs else None)
+
+    if cache is not None:
+        cache_key = completion_cache_key(
+            model_name, messages, temperature, max_token, response_format,
+            extra={"stream_stop_at_answer": stop_at_answer})
+        cached = cache.get(cache_key)
+        if cached is not None:
+            call_stats["attempts"] = 1
+            call_stats["cached"] = True
+            return cached
+
+    async def _attempt():
+        call_stats.pop("time_to_first_token", None)
+        call_stats.pop("time_to_answer", None)
+
+        if rate_limiter is not None:
+            estimated_tokens = estimate_tokens(messages)
+            await rate_limiter.acquire(estimated_tokens)
+
+        start_time = monotonic()
+        stream = await client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_token,
+            response_format=response_format,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+        detector = BoxedAnswerDetector()
+        finish_reason, usage, response_id = None, None, ""
+        call_stats["early_stopped"] = False
+        try:
+            async for chunk in stream:
+                response_id = chunk.id or response_id
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                content = choice.delta.content or ""
+                reasoning = getattr(choice.delta, "reasoning_content", None)
+
+                if ((content or reasoning)
+                        and "time_to_first_token" not in call_stats):
+                    call_stats["time_to_first_token"] = monotonic() - start_time
+
+                if content and detector.feed(content):
+                    call_stats["time_to_answer"] = monotonic() - start_time
+                    if stop_at_answer:
+                        call_stats["early_stopped"] = True
+                        finish_reason = "stop"
+                        break
+        finally:
+            # Releases the connection on early stops, errors and
+            # cancellations alike
+            await stream.close()
+
+        if rate_limiter is not None and usage is not None:
+            rate_limiter.record(usage.total_tokens - estimated_tokens)
+
+        return ChatCompletion.model_validate({
+            "id": response_id,
+            "object": "chat.completion",
+            "created": int(time()),
+            "model": model_name,
+            "choices": [{
+                "index": 0,
+                "finish_reason": finish_reason or "stop",
+                "message": {"role": "assistant", "content": detector.text},
+            }],
+            "usage": usage.model_dump() if usage is not None else None,
+        })
+
+    response = await (retry_policy or _default_retry_policy()).run(
+        _attempt, call_stats)
+
+    if cache is not None:
+        cache.set(cache_key, response)
+
+    return response
+
+
+@dataclass
+class SelfConsistency:
+    """Self-consistency sampling settings: majority vote over several
+    sampled answers to each question
+
+    Args:
+        samples (int): most samples drawn per question. Defaults to 5.
+        quorum (int | None): agreeing answers needed to stop drawing.
+            Defaults to None (a majority of `samples`).
+        temperature (float): sampling temperature. Defaults to 0.7.
+        delta (float): tolerance for two answers to agree, see
+            `vote_answers`. Defaults to 0.05.
+        use_n (bool): ask for several choices in one request.
+            Defaults to True.
+    """
+    samples: int = 5
+    quorum: int | None = None
+    temperature: float = 0.7
+    delta: float = 0.05
+    use_n: bool = True
+
+    def required(self) -> int:
+        """Agreeing answers that settle the vote"""
+        return min(self.quorum or self.samples // 2 + 1, self.samples)
+
+
+# Backends that ignore `n`: client -> {(base_url, model_name)}, kept
+# per client as a base_url may be served differently to two clients
+_n_unsupported = weakref.WeakKeyDictionary()
+
+
+def _merge_usage(responses: list) -> dict | None:
+    """Token usage of several responses, summed field by field"""
+    usages = [
+        response.usage.model_dump() for response in responses
+        if getattr(response, "usage", None) is not None]
+    if not usages:
+        return None
+    return {
+        key: sum(usage.get(key) or 0 for usage in usages)
+        for key, value in usages[0].items()
+        if isinstance(value, int)
+    }
+
+
+async def self_consistent_completions(
+    client: AsyncOpenAI | None, model_name: str, messages: list,
+    self_consistency: SelfConsistency, max_token: int = 1024,
+    use_structured_outputs=False,
+    rate_limiter: AsyncRateLimiter | None = None,
+    cache: ResponseCache | None = None,
+    call_stats: dict | None = None,
+    retry_policy: RetryPolicy | None = None,
+    hedge_policy: HedgePolicy | None = None,
+) -> ChatCompletion:
+    """Samples answers until a quorum agrees, see `SelfConsistency`
+
+    Samples are drawn in rounds of as many as the quorum still needs:
+    the first round asks for `quorum` answers and, if they all agree,
+    no other sample is drawn. A round is a single request with `n`
+    choices where the backend supports it (backends that return fewer
+    choices are remembered and get concurrent single requests instead).
+    Samples whose call failed are left out of the vote; the call only
+    fails when no sample came back.
+
+    Args:
+        client (AsyncOpenAI | None): OpenAI client; None uses the
+            `shared_async_client` of the running event loop
+        model_name (str): model name
+        messages (list): input prompt
+        self_consistency (SelfConsistency): sampling settings
+        max_token (int): defaults to 1024
+        rate_limiter (AsyncRateLimiter | None): shared limiter.
+            Defaults to None.
+        cache (ResponseCache | None): on-disk response cache; samples
+            are cached by position. Defaults to None.
+        call_stats (dict | None): filled in with attempts (of all the
+            requests), cache flag and `vote` (n_samples, votes,
+            vote_margin, quorum_reached). Defaults to None.
+        retry_policy (RetryPolicy | None): shared retry policy.
+            Defaults to None.
+        hedge_policy (HedgePolicy | None): hedging of every request.
+            Defaults to None.
+
+    Returns:
+        ChatCompletion: the winning choice, with the usage of all the
+            requests
+    """
+    if self_consistency.samples < 1:
+        raise ValueError('self_consistency.samples must be at least 1')
+
+    client = client or shared_async_client()
+    call_stats = call_stats if call_stats is not None else {}
+    call_stats["model_name"] = model_name
+    n_unsupported = _n_unsupported.setdefault(client, set())
+    backend = (str(getattr(client, "base_url", "")), model_name)
+    required = self_consistency.required()
+
+    choices, responses, request_stats = [], [], []
+    # Sample ids given out so far, including those of failed requests
+    # and of the choices a backend did not return
+    issued = 0
+
+    async def _request(n: int, sample_id: int):
+        stats = {}
+        request_stats.append(stats)
+        return await tenacious_model_completions(
+            client=client, model_name=model_name, messages=messages,
+            temperature=self_consistency.temperature, max_token=max_token,
+            use_structured_outputs=use_structured_outputs,
+            rate_limiter=rate_limiter, cache=cache, call_stats=stats,
+            retry_policy=retry_policy, n=n, sample_id=sample_id,
+            hedge_policy=hedge_policy)
+
+    async def _draw(needed: int) -> list[Exception]:
+        nonlocal issued
+        errors = []
+        if (self_consistency.use_n and needed > 1
+                and backend not in n_unsupported):
+            first_id = issued
+            issued += needed
+            try:
+                response = await _request(needed, first_id)
+                responses.append(response)
+                choices.extend(response.choices[:needed])
+            except Exception as e:
+                errors.append(e)
+            else:
+                if len(response.choices) < needed:
+                    n_unsupported.add(backend)
+                needed -= len(response.choices[:needed])
+            if errors or not needed:
+                return errors
+
+        first_id = issued
+        issued += needed
+        outcomes = await asyncio.gather(
+            *[_request(1, first_id + offset) for offset in range(needed)],
+            return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                errors.append(outcome)
+            else:
+                responses.append(outcome)
+                choices.extend(outcome.choices[:1])
+        return errors
+
+    vote = vote_answers([], self_consistency.delta)
+    while True:
+        agreeing = next(
+            (group["count"] for group in vote["votes"]
+             if group["value"] is not None), 0)
+        if agreeing >= required or len(choices) >= self_consistency.samples:
+            break
+        drawn = len(choices)
+        errors = await _draw(
+            min(required - agreeing, self_consistency.samples - drawn))
+        if len(choices) == drawn:
+            # Nothing came back from this round: give up drawing
+            break
+        vote = vote_answers(
+            [choice.message.content for choice in choices],
+            self_consistency.delta)
+
+    call_stats["attempts"] = 1 + sum(
+        stats.get("attempts", 1) - 1 for stats in request_stats)
+    if not choices:
+        raise errors[0]
+    call_stats["cached"] = all(
+        stats.get("cached", False) for stats in request_stats)
+    call_stats["hedged"] = any(
+        stats.get("hedged", False) for stats in request_stats)
+    call_stats["vote"] = {
+        "n_samples": len(choices),
+        "votes": [
+            {"answer": group["answer"], "count": group["count"]}
+            for group in vote["votes"]],
+        "vote_margin": vote["margin"],
+        "quorum_reached": agreeing >= required,
+    }
+
+    winner = choices[vote["winner"]]
+    return ChatCompletion.model_validate({
+        "id": responses[0].id,
+        "object": "chat.completion",
+        "created": int(time()),
+        "model": model_name,
+        "choices": [{**winner.model_dump(), "index": 0}],
+        "usage": _merge_usage(responses),
+    })
+
+
+@dataclass
+class ModelCascade:
+    """Cheap-first model cascade: a step is answered by the first model
+    and escalated to the next ones only when its answer is rejected
+
+    An answer is rejected when its call failed, when its boxed answer
+    does not go through `find_answer`/`evaluate_maths`, when it was cut
+    by the token limit, when its self-consistency vote margin is below
+    `min_vote_margin`, or when `check` returns False
+
+    Args:
+        escalate_to (tuple[str, ...]): models tried in turn after the
+            first one. Defaults to ("deepseek-reasoner",).
+        escalate_on_unparsable (bool): reject unparsable answers.
+            Defaults to True.
+        escalate_on_truncation (bool): reject answers cut by the token
+            limit. Defaults to True.
+        min_vote_margin (int | None): reject votes won by fewer votes.
+            Defaults to None.
+        check (Callable[[dict], bool] | None): extra acceptance test of
+            a history step. Defaults to None.
+    """
+    escalate_to: tuple[str, ...] = ("deepseek-reasoner",)
+    escalate_on_unparsable: bool = True
+    escalate_on_truncation: bool = True
+    min_vote_margin: int | None = None
+    check: Callable[[dict], bool] | None = None
+
+    def escalation_reason(self, step: dict) -> str | None:
+        """Why a step must be escalated, None if its answer is accepted"""
+        if step.get("error") is not None:
+            return "error"
+        if self.escalate_on_unparsable:
+            try:
+                float(evaluate_maths(step["model_response"]))
+            except Exception:
+                return "unparsable"
+        if self.escalate_on_truncation and step.get("finish_reason") == "length":
+            return "truncated"
+        if (self.min_vote_margin is not None
+                and step.get("vote_margin") is not None
+                and step["vote_margin"] < self.min_vote_margin):
+            return "low_agreement"
+        if self.check is not None and not self.check(step):
+            return "check"
+        return None
+
+    @staticmethod
+    def attempt_record(step: dict, reason: str) -> dict:
+        """What is kept of a rejected attempt: its answer and its cost"""
+        return {
+            "model_name": step.get("model_name"),
+            "model_response": step.get("model_response"),
+            "reason": reason,
+            **{
+                key: step.get(key)
+                for key in ["latency", "prompt_tokens", "completion_tokens",
+                            "prompt_cache_hit_tokens",
+                            "prompt_cache_miss_tokens"]
+            },
+        }
+
+
+SKIPPED_STEP_RESPONSE = "Error encountered: skipped after a failed step"
+
+
+def skipped_steps(
+    questions: list[str], answers: list, model_name: str,
+) -> list[dict]:
+    """History records of the steps left unanswered after a failed step
+
+    The rest of a conversation is not sent once a step has failed,
+    as the later questions build on its answer; these records are
+    replaced when the conversation is resumed
+
+    Args:
+        questions (list[str]): remaining questions
+        answers (list): their annotator answers
+        model_name (str): model name
+
+    Returns:
+        list[dict]: one failed record per question
+    """
+    return [
+        {
+            "question": question,
+            "complete_response": SKIPPED_STEP_RESPONSE,
+            "model_response": find_answer(SKIPPED_STEP_RESPONSE),
+            "annotator_answer": answer,
+            "model_name": model_name,
+            "error": {
+                "type": "Skipped", "category": "skipped",
+                "message": "an earlier step failed",
+                "status_code": None, "attempts": 0,
+            },
+        }
+        for question, answer in zip(questions, answers)
+    ]
+
+
+def completed_steps(history: list[dict] | None) -> list[dict]:
+    """Steps of a previous history up to (excluding) the first failed one"""
+    completed = []
+    for step in history or []:
+        if step_failed(step):
+            break
+        completed.append(step)
+    return completed
 
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
 async def async_converse_llm(
     processed_data_entry: pd.Series,
     client: AsyncOpenAI,
@@ -71,21 +1225,90 @@ async def async_converse_llm(
     example_shots: str = "",
     sys_prompt: str = "",
     use_structured_outputs: bool = False,
+    rate_limiter: AsyncRateLimiter | None = None,
+    cache: ResponseCache | None = None,
+    on_step_complete: Callable[[dict], None] | None = None,
+    conversation_mode: str = "sequential",
+    use_retrieved_context: bool = False,
+    stream: bool = False,
+    retry_policy: RetryPolicy | None = None,
+    resume_history: list[dict] | None = None,
+    self_consistency: SelfConsistency | None = None,
+    cascade: ModelCascade | None = None,
+    hedge_policy: HedgePolicy | None = None,
 ):
+    """Runs one conversation with the LLM over the questions of an entry
 
-    if use_short_context and use_gold_inds:
-        raise ValueError(
-            'use_short_context and use_gold_inds cannot be both True')
+    In the default "sequential" mode every question is its own round
+    trip, with the previous answers in the history. In "single_request"
+    mode all questions are asked in one call and answered as a JSON
+    array of boxed answers; the history has the same per-step records.
 
-    # Chooses which context to use
-    _context = (
-        processed_data_entry.get('gold_inds') if use_gold_inds
-        else processed_data_entry.get("short_context") if use_short_context
-        else processed_data_entry.get('full_context')
-    )
+    Retries happen per call (see `retry_policy`), never for the whole
+    conversation. A call that still fails is recorded with a structured
+    `error` field (type, category, message, status_code, attempts) and
+    the remaining steps are recorded as skipped; passing that history
+    back as `resume_history` continues from the failed step.
+
+    Args:
+        processed_data_entry (pd.Series): processed data entry
+        client (AsyncOpenAI): OpenAI client
+        model_name (str): model name
+        use_short_context (bool): table only context. Defaults to False.
+        use_gold_inds (bool): oracle context. Defaults to False.
+        question_to_use (str): key of the question(s)
+        answers_to_use (str): key of the answer(s)
+        example_shots (str): few-shot examples. Defaults to "".
+        sys_prompt (str): system prompt. Defaults to "".
+        use_structured_outputs (bool): json output. Defaults to False.
+        rate_limiter (AsyncRateLimiter | None): shared limiter.
+            Defaults to None.
+        cache (ResponseCache | None): on-disk response cache.
+            Defaults to None.
+        on_step_complete (Callable[[dict], None] | None): called with
+            every history record as soon as it is created.
+            Defaults to None.
+        conversation_mode (str): one of CONVERSATION_MODES.
+            Defaults to "sequential".
+        use_retrieved_context (bool): BM25-selected context.
+            Defaults to False.
+        stream (bool): stream the completions, recording time to first
+            token/answer; in sequential mode the stream is cancelled as
+            soon as the boxed answer closes. Defaults to False.
+        retry_policy (RetryPolicy | None): retry policy shared by the
+            calls of a run; None retries each call up to 3 times.
+            Defaults to None.
+        resume_history (list[dict] | None): history of a previous
+            attempt at this conversation; its steps before the first
+            failed one are kept. Single_request conversations are
+            re-asked in full. Defaults to None.
+        self_consistency (SelfConsistency | None): in sequential mode,
+            answer each question by majority vote over sampled answers
+            (not streamed); the steps record n_samples, votes,
+            vote_margin and quorum_reached. Defaults to None.
+        cascade (ModelCascade | None): in sequential mode, ask each
+            question to `model_name` first and to the models of
+            `cascade.escalate_to` only when the answer is rejected;
+            the step is the accepted answer (its `model_name` says which
+            model gave it) plus the rejected attempts in `escalations`.
+            Defaults to None.
+        hedge_policy (HedgePolicy | None): hedging of the calls,
+            shared by the calls of a run; not with `stream`.
+            Defaults to None.
+
+    Returns:
+        list[dict]: history, one record per question
+    """
+    if conversation_mode not in CONVERSATION_MODES:
+        raise ValueError(
+            f'conversation_mode must be one of {CONVERSATION_MODES}')
+    if stream and hedge_policy is not None:
+        raise ValueError('Streamed completions are not hedged')
 
-    # Adds the example shots at the start of the context
-    _context = example_shots + _context
+    _context = select_context(
+        processed_data_entry, use_short_context=use_short_context,
+        use_gold_inds=use_gold_inds, example_shots=example_shots,
+        use_retrieved_context=use_retrieved_context)
 
     list_of_questions = processed_data_entry.get(question_to_use)
     list_of_answers = processed_data_entry.get(answers_to_use)
@@ -100,66 +1323,641 @@ async def async_converse_llm(
 
     assert len(list_of_answers) == len(list_of_questions)
 
-    history = []
-    for current_question, current_answer in zip(list_of_questions, list_of_answers):
-        inputs = [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": _context},
-            {"role": "assistant", "content": 'Context acknowledged, awaiting for question.'},
-            *add_past_responses(history),
-            {"role": "user", "content": current_question},
-        ]
+    history = completed_steps(resume_history)
+    if len(history) == len(list_of_questions):
+        return history
+
+    if conversation_mode == "single_request":
+        inputs = build_messages(
+            sys_prompt, _context, [],
+            build_single_request_question(list_of_questions))
+        call_stats = {}
+        start_time = monotonic()
+        error = None
+        try:
+            if stream:
+                # Several boxed answers are expected: no early stop
+                response = await streaming_model_completions(
+                    client=client, model_name=model_name, messages=inputs,
+                    temperature=0.0,
+                    max_token=min(1024 * len(list_of_questions), 8192),
+                    use_structured_outputs=use_structured_outputs,
+                    rate_limiter=rate_limiter, cache=cache,
+                    call_stats=call_stats, stop_at_answer=False,
+                    retry_policy=retry_policy)
+            else:
+                response = await tenacious_model_completions(
+                    client=client, model_name=model_name, messages=inputs,
+                    temperature=0.0,
+                    max_token=min(1024 * len(list_of_questions), 8192),
+                    use_structured_outputs=use_structured_outputs,
+                    rate_limiter=rate_limiter, cache=cache,
+                    call_stats=call_stats, retry_policy=retry_policy,
+                    hedge_policy=hedge_policy)
+            text = response.choices[0].message.content
+        except Exception as e:
+            response = None
+            text = f"Error encountered: {str(e)}"
+            error = error_record(e, call_stats.get("attempts", 1))
+
+        history = single_request_history(
+            list_of_questions, list_of_answers, text,
+            response_fields(response, call_stats, monotonic() - start_time))
+        for step in history:
+            step["error"] = error
+            if on_step_complete is not None:
+                on_step_complete(step)
+        return history
+
+    completion_function = (
+        streaming_model_completions if stream
+        else partial(tenacious_model_completions, hedge_policy=hedge_policy)
+    )
 
+    async def _ask(step_model: str, inputs: list, current_question: str,
+                   current_answer) -> dict:
         # Using temp=0.0
         # per DeepSeek's docs; low temp -> deterministic
         # since math questions, we want low variation
+        call_stats = {}
+        start_time = monotonic()
+        error = None
         try:
-            response = await tenacious_model_completions(
-                client=client, model_name=model_name, messages=inputs,
-                temperature=0.0, max_token=1024,
-                use_structured_outputs=use_structured_outputs)
-            response = response.choices[0].message.content
+            if self_consistency is not None:
+                response = await self_consistent_completions(
+                    client=client, model_name=step_model, messages=inputs,
+                    self_consistency=self_consistency, max_token=1024,
+                    use_structured_outputs=use_structured_outputs,
+                    rate_limiter=rate_limiter, cache=cache,
+                    call_stats=call_stats, retry_policy=retry_policy,
+                    hedge_policy=hedge_policy)
+            else:
+                response = await completion_function(
+                    client=client, model_name=step_model, messages=inputs,
+                    temperature=0.0, max_token=1024,
+                    use_structured_outputs=use_structured_outputs,
+                    rate_limiter=rate_limiter, cache=cache,
+                    call_stats=call_stats, retry_policy=retry_policy)
+            text = response.choices[0].message.content
         except Exception as e:
-            response = f"Error encountered: {str(e)}"
+            response = None
+            text = f"Error encountered: {str(e)}"
+            error = error_record(e, call_stats.get("attempts", 1))
 
-        history.append(
-            {
-                "question": current_question,
-                "complete_response": response,
-                "model_response": find_answer(response),
-                "annotator_answer": current_answer,
-            }
-        )
+        return {
+            "question": current_question,
+            "complete_response": text,
+            "model_response": find_answer(text),
+            "annotator_answer": current_answer,
+            **response_fields(
+                response, call_stats, monotonic() - start_time),
+            **call_stats.get("vote", {}),
+            "error": error,
+        }
+
+    for step_ix in range(len(history), len(list_of_questions)):
+        current_question = list_of_questions[step_ix]
+        current_answer = list_of_answers[step_ix]
+        inputs = build_messages(
+            sys_prompt, _context, history, current_question)
+        step = await _ask(model_name, inputs, current_question, current_answer)
+
+        if cascade is not None:
+            escalations = []
+            for next_model in cascade.escalate_to:
+                reason = cascade.escalation_reason(step)
+                if reason is None:
+                    break
+                escalations.append(cascade.attempt_record(step, reason))
+                step = await _ask(
+                    next_model, inputs, current_question, current_answer)
+            # The step took as long as all of its attempts
+            step["latency"] += sum(
+                attempt["latency"] for attempt in escalations)
+            step["escalations"] = escalations
+        error = step["error"]
+
+        history.append(step)
+        if on_step_complete is not None:
+            on_step_complete(step)
+
+        if error is not None:
+            # Later questions build on this answer: stop here and let
+            # a resumed run continue from this step
+            for skipped in skipped_steps(
+                    list_of_questions[step_ix + 1:],
+                    list_of_answers[step_ix + 1:], model_name):
+                history.append(skipped)
+                if on_step_complete is not None:
+                    on_step_complete(skipped)
+            break
 
     return history
 
 
+@dataclass
+class RunConfig:
+    """Settings of a single experiment run
+
+    The first block mirrors the arguments of `async_converse_llm`,
+    the second one controls how hard the provider is pushed,
+    the third one how failed calls are retried and how long a call
+    may take, retries included (see `RetryPolicy`),
+    the fourth one self-consistency sampling (see `SelfConsistency`;
+    off with a single sample), the fifth one the models a step is
+    escalated to (see `ModelCascade`; off without escalation models)
+    the sixth one hedged requests
+    (see `HedgePolicy`; off unless a delay is set)
+    and the last one the evaluation of the steps while the run goes on
+    (see `OnlineEvaluator`)
+    """
+    model_name: str = "deepseek-chat"
+    use_short_context: bool = False
+    use_gold_inds: bool = False
+    use_retrieved_context: bool = False
+    question_to_use: str = "step_by_step_questions"
+    answers_to_use: str = "step_by_step_answers"
+    example_shots: str = ""
+    sys_prompt: str = ""
+    use_structured_outputs: bool = False
+    conversation_mode: str = "sequential"
+    stream: bool = False
+
+    max_concurrency: int = 16
+    requests_per_minute: int | None = None
+    tokens_per_minute: int | None = None
+    progress_every: int = 10
+    group_by_prefix: bool = True
+
+    max_attempts: int = 3
+    retry_budget_ratio: float | None = 0.2
+    circuit_breaker_threshold: int | None = 20
+    circuit_breaker_cooldown: float = 30.0
+    call_deadline: float | None = None
+
+    self_consistency_samples: int = 1
+    self_consistency_quorum: int | None = None
+    self_consistency_temperature: float = 0.7
+
+    escalate_to: tuple[str, ...] = ()
+    escalation_min_vote_margin: int | None = None
+
+    hedge_after: float | None = None
+    hedge_quantile: float | None = None
+    max_hedge_ratio: float = 0.1
+
+    online_evaluation: bool = False
+    abort_below_parsable: float | None = None
+    abort_window: int = 50
+
+    def __post_init__(self):
+        if self.self_consistency_samples < 1:
+            raise ValueError('self_consistency_samples must be at least 1')
+        if self.stream and (
+                self.hedge_after is not None
+                or self.hedge_quantile is not None):
+            raise ValueError(
+                'Streamed completions are not hedged: unset hedge_after '
+                'and hedge_quantile or stream')
+
+    def conversation_kwargs(self) -> dict:
+        """Arguments forwarded to `async_converse_llm`"""
+        return {
+            "model_name": self.model_name,
+            "use_short_context": self.use_short_context,
+            "use_gold_inds": self.use_gold_inds,
+            "use_retrieved_context": self.use_retrieved_context,
+            "question_to_use": self.question_to_use,
+            "answers_to_use": self.answers_to_use,
+            "example_shots": self.example_shots,
+            "sys_prompt": self.sys_prompt,
+            "use_structured_outputs": self.use_structured_outputs,
+            "conversation_mode": self.conversation_mode,
+            "stream": self.stream,
+            "self_consistency": self.self_consistency(),
+            "cascade": self.cascade(),
+        }
+
+    def self_consistency(self) -> SelfConsistency | None:
+        """Sampling settings, None unless more than one sample is asked"""
+        if self.self_consistency_samples <= 1:
+            return None
+        return SelfConsistency(
+            samples=self.self_consistency_samples,
+            quorum=self.self_consistency_quorum,
+            temperature=self.self_consistency_temperature,
+        )
+
+    def hedge_policy(self) -> HedgePolicy | None:
+        """Hedging policy shared by every call of a run, None without
+        a hedge delay"""
+        if self.hedge_after is None and self.hedge_quantile is None:
+            return None
+        return HedgePolicy(
+            hedge_after=self.hedge_after,
+            hedge_quantile=self.hedge_quantile,
+            max_hedge_ratio=self.max_hedge_ratio,
+        )
+
+    def online_evaluator(self) -> OnlineEvaluator | None:
+        """Scorer of the steps as they complete, None unless online
+        evaluation or an abort threshold is set"""
+        if not self.online_evaluation and self.abort_below_parsable is None:
+            return None
+        return OnlineEvaluator(
+            abort_below_parsable=self.abort_below_parsable,
+            abort_window=self.abort_window,
+        )
+
+    def cascade(self) -> ModelCascade | None:
+        """Model cascade from `model_name` to the `escalate_to` models,
+        None without escalation models"""
+        if not self.escalate_to:
+            return None
+        return ModelCascade(
+            escalate_to=tuple(self.escalate_to),
+            min_vote_margin=self.escalation_min_vote_margin,
+        )
+
+    def retry_policy(self) -> RetryPolicy:
+        """Retry policy shared by every call of a run"""
+        return RetryPolicy(
+            max_attempts=self.max_attempts,
+            budget_ratio=self.retry_budget_ratio,
+            breaker_threshold=self.circuit_breaker_threshold,
+            breaker_cooldown=self.circuit_breaker_cooldown,
+            deadline=self.call_deadline,
+        )
+
+    def prefix_key(self, processed_data_entry) -> str:
+        """Hash of the (sys_prompt, example_shots, context) prompt prefix
+        of an entry under this config"""
+        _context = select_context(
+            processed_data_entry, use_short_context=self.use_short_context,
+            use_gold_inds=self.use_gold_inds,
+            example_shots=self.example_shots,
+            use_retrieved_context=self.use_retrieved_context)
+        return hashlib.sha256(
+            (self.sys_prompt + "\x00" + _context).encode("utf-8")
+        ).hexdigest()
+
+
+def order_by_prefix(keys: list[str]) -> list[list[int]]:
+    """Groups positions that share the same prompt prefix
+
+    Groups are returned in order of first appearance, positions within
+    a group keep their input order
+
+    Args:
+        keys (list[str]): prefix key of every entry
+
+    Returns:
+        list[list[int]]: positions grouped by prefix
+    """
+    groups = {}
+    for ix, key in enumerate(keys):
+        groups.setdefault(key, []).append(ix)
+    return list(groups.values())
+
+
+def _report_progress(
+    done: int, total: int, stats: dict, start_time: float,
+    label: str | None = None, live: str | None = None,
+):
+    elapsed = max(monotonic() - start_time, 1e-9)
+    prompt_tokens = stats["cache_hit_tokens"] + stats["cache_miss_tokens"]
+    cache_rate = (
+        f", prompt cache hit {stats['cache_hit_tokens'] / prompt_tokens:.1%}"
+        if prompt_tokens else ""
+    )
+    failed = (
+        f", {stats['failed_steps']} failed steps"
+        if stats["failed_steps"] else ""
+    )
+    prefix = f"{label} " if label else ""
+    print(
+        f"{prefix}[{done}/{total}] {done / elapsed:.2f} conversations/s, "
+        f"{60 * stats['steps'] / elapsed:.1f} requests/min, "
+        f"elapsed {elapsed:.0f}s{cache_rate}{failed}"
+        + (f"\n{prefix}  live: {live}" if live else "")
+    )
+
+
+def report_retry_stats(retry_policy: RetryPolicy):
+    """Prints the retries and failed calls of a run, if any"""
+    retry_stats = retry_policy.stats()
+    if retry_stats["retries"] or retry_stats["failures"]:
+        print(
+            f"Retries: {retry_stats['retries']}, "
+            f"failed calls: {retry_stats['failures']}, "
+            f"deadlines exceeded: {retry_stats['deadline_exceeded']}, "
+            f"errors: {retry_stats['errors_by_category']}"
+        )
+
+
+def report_hedge_stats(hedge_policy: HedgePolicy | None):
+    """Prints the hedges sent by a run, if any"""
+    if hedge_policy is None:
+        return
+    hedge_stats = hedge_policy.stats()
+    if hedge_stats["hedged"]:
+        print(
+            f"Hedged {hedge_stats['hedged']} of {hedge_stats['calls']} "
+            f"attempts ({hedge_stats['hedge_rate']:.1%}), "
+            f"{hedge_stats['hedge_wins']} won by the hedge, "
+            f"~{hedge_stats['latency_saved']:.1f}s saved"
+        )
+
+
+def _update_run_stats(stats: dict, history: list[dict]):
+    stats["steps"] += len(history)
+    for step in history:
+        stats["failed_steps"] += step_failed(step)
+        stats["cache_hit_tokens"] += step.get("prompt_cache_hit_tokens") or 0
+        stats["cache_miss_tokens"] += step.get("prompt_cache_miss_tokens") or 0
+
+
+class RunAborted(Exception):
+    """Raised by `run_experiment` when its online evaluation stops it"""
+
+
+async def run_experiment(
+    processed_entries,
+    run_config: RunConfig,
+    client: AsyncOpenAI,
+    cache: ResponseCache | None = None,
+    results_path: str | None = None,
+    rate_limiter: AsyncRateLimiter | None = None,
+    retry_policy: RetryPolicy | None = None,
+    experiment_name: str | None = None,
+    hedge_policy: HedgePolicy | None = None,
+    online_evaluator: OnlineEvaluator | None = None,
+) -> list[list[dict]]:
+    """Runs `async_converse_llm` over many entries with bounded concurrency
+
+    At most `run_config.max_concurrency` conversations are in flight
+    and all requests share one requests/tokens-per-minute limiter,
+    which keeps the provider busy without triggering 429s.
+    Progress and throughput are printed every `progress_every`
+    completed conversations.
+
+    With `run_config.group_by_prefix`, entries sharing the same
+    (sys_prompt, example_shots, context) prefix are dispatched together:
+    the first entry of each group goes out first and the rest of the
+    group waits for its first response, so that they hit a warm
+    provider prompt cache instead of all missing it at once.
+
+    When `results_path` is given, every finished conversation is appended
+    to it as a JSONL line straight away, and entries already present in
+    the file are skipped; a crashed run is resumed by calling this again.
+    Entries whose history holds a failed step are resumed from that step.
+
+    All calls share one `RetryPolicy` (`run_config.retry_policy()`
+    unless one is given):
+    its retry budget and circuit breaker keep a provider outage from
+    being multiplied by retries; calls refused by the breaker are
+    recorded as failed steps and picked up by the next resume.
+
+    With an `OnlineEvaluator` (`run_config.online_evaluator()` unless
+    one is given), every step is scored as soon as it completes and the
+    progress lines report the live parsability and accuracy. If its
+    abort threshold is hit, the conversations in flight are cancelled
+    and `RunAborted` is raised; the finished ones are in the results
+    file.
+
+    Args:
+        processed_entries: processed data entries
+            (output of `process_data_table` or a sample of it).
+            Entry IDs are the index of a Series/dict,
+            or the position for any other iterable
+        run_config (RunConfig): experiment and throughput settings
+        client (AsyncOpenAI): OpenAI client
+        cache (ResponseCache | None): on-disk response cache shared
+            by all conversations. Defaults to None.
+        results_path (str | None): streaming .jsonl results file.
+            Defaults to None.
+        rate_limiter (AsyncRateLimiter | None): limiter shared with
+            other runs (see `utils.sweep_utils.run_sweep`); None builds
+            one from run_config. Defaults to None.
+        retry_policy (RetryPolicy | None): retry policy shared with
+            other runs; None builds one from run_config.
+            Defaults to None.
+        experiment_name (str | None): prefix of the progress lines.
+            Defaults to None.
+        hedge_policy (HedgePolicy | None): hedging policy shared with
+            other runs; None builds one from run_config (if it hedges).
+            Defaults to None.
+        online_evaluator (OnlineEvaluator | None): live scorer of the
+            steps; None builds one from run_config (if it asks for it).
+            Defaults to None.
+
+    Returns:
+        list[list[dict]]: conversation histories, in input order
+    """
+    if hasattr(processed_entries, "items"):
+        items = list(processed_entries.items())
+        entry_ids = [entry_id for entry_id, _ in items]
+        entries = [entry for _, entry in items]
+    else:
+        entries = list(processed_entries)
+        entry_ids = range(len(entries))
+    entry_ids = [str(entry_id) for entry_id in entry_ids]
+    label = f"{experiment_name} " if experiment_name else ""
+
+    previous_results = (
+        load_results(results_path)
+        if results_path is not None and os.path.exists(results_path)
+        else {}
+    )
+    results = [previous_results.get(entry_id) for entry_id in entry_ids]
+    pending = [
+        ix for ix, history in enumerate(results)
+        if history is None or any(step_failed(step) for step in history)
+    ]
+    n_failed = sum(results[ix] is not None for ix in pending)
+    if len(pending) < len(entries) or n_failed:
+        print(
+            f"{label}Resuming: {len(entries) - len(pending)} entries "
+            f"already done, {n_failed} to resume from their failed step")
+
+    total = len(pending)
+    semaphore = asyncio.Semaphore(run_config.max_concurrency)
+    if rate_limiter is None:
+        rate_limiter = AsyncRateLimiter(
+            requests_per_minute=run_config.requests_per_minute,
+            tokens_per_minute=run_config.tokens_per_minute,
+        )
+    # A shared policy is reported by its owner
+    report_retries = retry_policy is None
+    if retry_policy is None:
+        retry_policy = run_config.retry_policy()
+    report_hedges = hedge_policy is None
+    if hedge_policy is None:
+        hedge_policy = run_config.hedge_policy()
+    owns_evaluator = online_evaluator is None
+    if online_evaluator is None:
+        online_evaluator = run_config.online_evaluator()
+    if online_evaluator is not None:
+        online_evaluator.start()
+    start_time = monotonic()
+    done = 0
+    stats = {"steps": 0, "cache_hit_tokens": 0, "cache_miss_tokens": 0,
+             "failed_steps": 0}
+
+    # Each pending position waits on the event of its group leader
+    # (None for leaders and when grouping is disabled)
+    if run_config.group_by_prefix:
+        groups = order_by_prefix(
+            [run_config.prefix_key(entries[ix]) for ix in pending])
+    else:
+        groups = [[ix] for ix in range(len(pending))]
+    dispatch_order, warm_events = [], {}
+    for group in groups:
+        leader_warm = asyncio.Event()
+        for position, member in enumerate(group):
+            dispatch_order.append(pending[member])
+            warm_events[pending[member]] = (leader_warm, position == 0)
+
+    async def _run_one(ix):
+        warm_event, is_leader = warm_events[ix]
+        if not is_leader:
+            await warm_event.wait()
+
+        def _on_step_complete(step):
+            if is_leader:
+                warm_event.set()
+            if online_evaluator is not None:
+                online_evaluator.submit(step, entry_ids[ix])
+
+        try:
+            async with semaphore:
+                return ix, await async_converse_llm(
+                    processed_data_entry=entries[ix],
+                    client=client,
+                    rate_limiter=rate_limiter,
+                    cache=cache,
+                    on_step_complete=(
+                        _on_step_complete
+                        if is_leader or online_evaluator is not None
+                        else None),
+                    retry_policy=retry_policy,
+                    hedge_policy=hedge_policy,
+                    resume_history=results[ix],
+                    **run_config.conversation_kwargs(),
+                )
+        finally:
+            warm_event.set()
+
+    results_file = (
+        open_results_file(results_path)
+        if results_path is not None else None
+    )
+    tasks = [asyncio.create_task(_run_one(ix)) for ix in dispatch_order]
+    if online_evaluator is not None:
+        online_evaluator.on_abort = lambda reason: [
+            task.cancel() for task in tasks]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            try:
+                ix, history = await finished
+            except asyncio.CancelledError:
+                if online_evaluator is None or (
+                        online_evaluator.abort_reason is None):
+                    raise
+                print(f"{label}Aborted after {done} conversations: "
+                      f"{online_evaluator.abort_reason}")
+                raise RunAborted(online_evaluator.abort_reason) from None
+            results[ix] = history
+            if results_file is not None:
+                append_result(results_file, entry_ids[ix], history)
+            done += 1
+            _update_run_stats(stats, history)
+            if done % run_config.progress_every == 0 or done == total:
+                _report_progress(
+                    done, total, stats, start_time, experiment_name,
+                    live=(
+                        online_evaluator.report()
+                        if online_evaluator is not None else None))
+    finally:
+        for task in tasks:
+            task.cancel()
+        if results_file is not None:
+            results_file.close()
+        if online_evaluator is not None and owns_evaluator:
+            await online_evaluator.close()
+
+    if online_evaluator is not None:
+        if not owns_evaluator:
+            await online_evaluator.drain()
+        print(f"{label}Online evaluation: {online_evaluator.report()}")
+
+    if report_retries:
+        report_retry_stats(retry_policy)
+    if report_hedges:
+        report_hedge_stats(hedge_policy)
+    report_pool_stats(client)
+
+    return results
+
+
 def model_completions(
-    client: OpenAI, model_name: str, messages: list,
+    client: OpenAI | None, model_name: str, messages: list,
     temperature: float = 0.0, max_token: int = 1024,
     use_structured_outputs: bool = False,
+    cache: ResponseCache | None = None,
+    call_stats: dict | None = None,
+    retry_policy: RetryPolicy | None = None,
 ) -> str:
     """Wrapper function for model completions
     Args:
-        client (AsyncOpenAI): OpenAI client
+        client (OpenAI | None): OpenAI client; None uses `shared_client`
         model_name (str): model name
         messages (list): input prompt
         temperature (float): defaults to 0.0
         max_token (int): defaults to 1024
+        cache (ResponseCache | None): on-disk response cache.
+            Defaults to None.
+        call_stats (dict | None): filled in with the number of attempts
+            and whether the response was cached. Defaults to None.
+        retry_policy (RetryPolicy | None): retry policy; None retries
+            up to 3 times. Defaults to None.
 
     Returns:
         str: LLM output
     """
 
-    return client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_token,
-        response_format=(
-            {'type': 'json_object'} if use_structured_outputs else None)
+    response_format = (
+        {'type': 'json_object'} if use_structured_outputs else None)
+    client = client or shared_client()
+
+    call_stats = call_stats if call_stats is not None else {}
+    call_stats["model_name"] = model_name
+
+    if cache is not None:
+        cache_key = completion_cache_key(
+            model_name, messages, temperature, max_token, response_format)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            call_stats["attempts"] = 1
+            call_stats["cached"] = True
+            return cached
+
+    response = (retry_policy or _default_retry_policy()).run_sync(
+        lambda: client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_token,
+            response_format=response_format,
+        ),
+        call_stats,
     )
 
+    if cache is not None:
+        cache.set(cache_key, response)
+
+    return response
+
 
 def converse_llm(
     processed_data_entry: pd.Series,
@@ -172,21 +1970,19 @@ def converse_llm(
     example_shots: str = "",
     sys_prompt: str = "",
     use_structured_outputs: bool = False,
+    cache: ResponseCache | None = None,
+    conversation_mode: str = "sequential",
+    use_retrieved_context: bool = False,
+    retry_policy: RetryPolicy | None = None,
 ):
-
-    if use_short_context and use_gold_inds:
+    if conversation_mode not in CONVERSATION_MODES:
         raise ValueError(
-            'use_short_context and use_gold_inds cannot be both True')
+            f'conversation_mode must be one of {CONVERSATION_MODES}')
 
-    # Chooses which context to use
-    _context = (
-        processed_data_entry.get('gold_inds') if use_gold_inds
-        else processed_data_entry.get("short_context") if use_short_context
-        else processed_data_entry.get('full_context')
-    )
-
-    # Adds the example shots at the start of the context
-    _context = example_shots + _context
+    _context = select_context(
+        processed_data_entry, use_short_context=use_short_context,
+        use_gold_inds=use_gold_inds, example_shots=example_shots,
+        use_retrieved_context=use_retrieved_context)
 
     list_of_questions = processed_data_entry.get(question_to_use)
     list_of_answers = processed_data_entry.get(answers_to_use)
@@ -201,37 +1997,74 @@ def converse_llm(
 
     assert len(list_of_answers) == len(list_of_questions)
 
+    if conversation_mode == "single_request":
+        inputs = build_messages(
+            sys_prompt, _context, [],
+            build_single_request_question(list_of_questions))
+        call_stats = {}
+        start_time = monotonic()
+        error = None
+        try:
+            response = model_completions(
+                client=client, model_name=model_name, messages=inputs,
+                temperature=0.0,
+                max_token=min(1024 * len(list_of_questions), 8192),
+                use_structured_outputs=use_structured_outputs,
+                cache=cache, call_stats=call_stats,
+                retry_policy=retry_policy)
+            text = response.choices[0].message.content
+        except Exception as e:
+            response = None
+            text = f"Error encountered: {str(e)}"
+            error = error_record(e, call_stats.get("attempts", 1))
+
+        history = single_request_history(
+            list_of_questions, list_of_answers, text,
+            response_fields(response, call_stats, monotonic() - start_time))
+        for step in history:
+            step["error"] = error
+        return history
+
     history = []
     for i, (current_question, current_answer) in enumerate(zip(list_of_questions, list_of_answers)):
 
-        inputs = [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": _context},
-            {"role": "assistant", "content": 'Context acknowledged, awaiting for question.'},
-            *add_past_responses(history),
-            {"role": "user", "content": current_question},
-        ]
-
+        inputs = build_messages(
+            sys_prompt, _context, history, current_question)
         # Using temp=0.0
         # per DeepSeek's docs; low temp -> deterministic
         # since math questions, we want low variation
+        call_stats = {}
+        start_time = monotonic()
+        error = None
         try:
             response = model_completions(
                 client=client, model_name=model_name, messages=inputs,
                 temperature=0.0, max_token=1024,
-                use_structured_outputs=use_structured_outputs)
-            response = response.choices[0].message.content
+                use_structured_outputs=use_structured_outputs,
+                cache=cache, call_stats=call_stats,
+                retry_policy=retry_policy)
+            text = response.choices[0].message.content
         except Exception as e:
-            response = f"Error encountered: {str(e)}"
+            response = None
+            text = f"Error encountered: {str(e)}"
+            error = error_record(e, call_stats.get("attempts", 1))
 
         history.append(
             {
                 "question": current_question,
-                "complete_response": response,
-                "model_response": find_answer(response),
+                "complete_response": text,
+                "model_response": find_answer(text),
                 "annotator_answer": current_answer,
+                **response_fields(
+                    response, call_stats, monotonic() - start_time),
+                "error": error,
             }
         )
+        if error is not None:
+            history += skipped_steps(
+                list_of_questions[i + 1:], list_of_answers[i + 1:],
+                model_name)
+            break
 
     return history
 
@@ -244,11 +2077,7 @@ if __name__ == '__main__':
     raw_data = pd.read_json('data/train.json')
     all_prompts = process_data_table(raw_data)
 
-    import os
-    client = OpenAI(
-        api_key=os.environ.get('DEEPSEEK_API'),
-        base_url="https://api.deepseek.com",
-    )
+    client = make_client()
 
     test = converse_llm(
         processed_data_entry=all_prompts[0],
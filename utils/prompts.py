@@ -110,3 +110,18 @@ SYSTEM_PROMPT_V4 = r"""
         "final_answer": "\boxed{subtract(divide(5000000, 2000000), 5)}"
     }
 """
+
+
+# SINGLE_REQUEST_TEMPLATE
+#       Used by the single_request conversation mode
+#       Asks all the step-by-step questions in one user turn
+#       Requires one boxed answer per question, as a JSON array
+SINGLE_REQUEST_TEMPLATE = r"""Answer each of the following questions in order.
+Later questions may refer to the answers of earlier ones.
+
+{questions}
+
+Respond with a JSON object of the form {{"answers": ["...", "..."]}}.
+"answers" must contain exactly {n_questions} strings, the i-th being the
+final answer to question i, in the format required above and enclosed in \boxed{{}}.
+"""
@@ -0,0 +1,450 @@
+import json
+import os
+
+import pandas as pd
+
+# pyarrow is optional; it is only needed for the Parquet results format
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+# Fields left out of the Parquet reads unless asked for
+LARGE_FIELDS = ("complete_response",)
+
+
+def open_results_file(path: str):
+    """Opens a JSONL results file for appending
+
+    If the last line was cut short by a crash, a newline is added first
+    so that new records are not glued onto the truncated one
+
+    Args:
+        path (str): path to the .jsonl results file
+
+    Returns:
+        file opened in append mode
+    """
+    needs_newline = False
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+
+    file = open(path, "a", encoding="utf-8")
+    if needs_newline:
+        file.write("\n")
+    return file
+
+
+def append_result(file, entry_id, history: list[dict]):
+    """Appends one finished conversation to a JSONL results file
+
+    Each line is {"entry_id": ..., "history": [...]} so that a run
+    can be resumed from whatever has been written so far
+
+    Args:
+        file: results file opened in append mode
+        entry_id: identifier of the processed entry
+        history (list[dict]): output of `async_converse_llm`
+    """
+    file.write(
+        json.dumps({"entry_id": str(entry_id), "history": history}) + "\n")
+    file.flush()
+
+
+def read_jsonl_results(path: str) -> dict:
+    """Reads a streaming JSONL results file
+
+    A truncated last line (e.g. from a crash mid-write) is ignored.
+    If an entry appears more than once, the last record wins.
+
+    Args:
+        path (str): path to the .jsonl results file
+
+    Returns:
+        dict: entry_id -> history
+    """
+    results = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            results[str(record["entry_id"])] = record["history"]
+    return results
+
+
+def load_results(path: str) -> dict:
+    """Reads experiment results in either format
+        - .jsonl: streaming format written by `run_experiment`
+        - .json: `pd.Series(results).to_json(...)` format of results/exp*.json
+        - .parquet: columnar format of `write_results_parquet`
+
+    Args:
+        path (str): path to the results file
+
+    Returns:
+        dict: entry_id -> history
+    """
+    if path.endswith(".jsonl"):
+        return read_jsonl_results(path)
+    if path.endswith(".parquet"):
+        return read_results_parquet(path)
+    return pd.read_json(path, typ="series").to_dict()
+
+
+class ResultsReader:
+    """Loads results files, re-reading only what changed since the
+    last load
+
+    For .jsonl files, records appended since the previous call are
+    parsed from the last complete line onwards; the file is read again
+    in full if it shrank (rewritten). Other formats are re-read when
+    their modification time or size changes.
+    """
+
+    def __init__(self):
+        # path -> (results, (mtime_ns, size), offset of the unread bytes)
+        self._files = {}
+
+    def signature(self, path: str) -> tuple[int, int]:
+        """(modification time, size) of a file, its change marker"""
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self, path: str) -> dict:
+        """Same as `load_results`, incrementally
+
+        Args:
+            path (str): path to the results file
+
+        Returns:
+            dict: entry_id -> history (shared with later calls, do not
+                modify it)
+        """
+        signature = self.signature(path)
+        results, previous, offset = self._files.get(path, (None, None, 0))
+        if previous == signature:
+            return results
+
+        if not path.endswith(".jsonl"):
+            results = load_results(path)
+            self._files[path] = (results, signature, 0)
+            return results
+
+        if results is None or signature[1] < offset:
+            results, offset = {}, 0
+        else:
+            # The new records are added to a new dict so that callers
+            # holding the previous one see a consistent snapshot
+            results = dict(results)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Last line still being written, read it next time
+                    break
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                results[str(record["entry_id"])] = record["history"]
+        self._files[path] = (results, signature, offset)
+        return results
+
+
+def step_failed(step: dict) -> bool:
+    """Whether a history step holds a failed (or skipped) call rather
+    than a model answer
+
+    Recognises both the structured `error` field and the
+    "Error encountered: ..." responses of older results files
+
+    Args:
+        step (dict): history record
+
+    Returns:
+        bool: True for a failed step
+    """
+    return bool(step.get("error")) or str(
+        step.get("complete_response", "")).startswith("Error encountered")
+
+
+def failed_steps(steps: pd.DataFrame) -> pd.Series:
+    """Vectorised `step_failed` over the output of `results_to_frame`
+
+    Args:
+        steps (pd.DataFrame): one row per step
+
+    Returns:
+        pd.Series: boolean mask of the failed steps
+    """
+    failed = (
+        steps["complete_response"].astype(str)
+        .str.startswith("Error encountered")
+        if "complete_response" in steps
+        else pd.Series(False, index=steps.index)
+    )
+    if "error" in steps:
+        failed |= steps["error"].notna().to_numpy()
+    if "_failed" in steps:
+        # Stored in Parquet results, which are read without the responses
+        failed |= steps["_failed"].fillna(False).astype(bool).to_numpy()
+    return failed
+
+
+def results_to_frame(
+    experiment_results, with_responses: bool = True,
+) -> pd.DataFrame:
+    """Flattens experiment results into one row per conversation step
+
+    Args:
+        experiment_results: results (dict/list/Series of histories),
+            or path to a results file in any format
+        with_responses (bool): read the `LARGE_FIELDS` of Parquet
+            results files; other formats always hold them.
+            Defaults to True.
+
+    Returns:
+        pd.DataFrame: one row per step with `entry_id` and `step`
+            columns plus every field of the history records
+    """
+    if isinstance(experiment_results, str):
+        if experiment_results.endswith(".parquet"):
+            return read_results_table(
+                experiment_results, with_responses=with_responses)
+        experiment_results = load_results(experiment_results)
+    if not isinstance(experiment_results, dict):
+        experiment_results = pd.Series(experiment_results).to_dict()
+
+    rows = [
+        {"entry_id": str(entry_id), "step": step_ix, **interim_step}
+        for entry_id, history in experiment_results.items()
+        for step_ix, interim_step in enumerate(history)
+    ]
+    return pd.DataFrame(rows)
+
+
+def _arrow_column(values: list) -> tuple["pa.Array", bool]:
+    """Arrow array of a history field, JSON-encoded unless every value
+    is None or of one scalar type (so that values round-trip exactly)
+
+    Returns:
+        tuple[pa.Array, bool]: the column, whether it is JSON-encoded
+    """
+    kinds = {type(value) for value in values if value is not None}
+    if len(kinds) <= 1 and kinds <= {str, bool, int, float}:
+        try:
+            return pa.array(values), False
+        except (pa.ArrowInvalid, OverflowError):
+            pass
+    return pa.array([json.dumps(value) for value in values]), True
+
+
+def _require_pyarrow():
+    """Raises the ImportError of the Parquet functions without pyarrow"""
+    if pa is None:
+        raise ImportError(
+            "pyarrow is required for Parquet results: pip install pyarrow")
+
+
+def write_results_parquet(
+    experiment_results, path: str, compression: str = "zstd",
+):
+    """Writes experiment results as a Parquet file, one row per step
+
+    Every history field is a column, so the short fields (question,
+    model_response, annotator_answer, error, usage, ...) are read and
+    decompressed without touching the large response texts
+    (`LARGE_FIELDS`, stored last). A derived `_failed` column
+    (`step_failed`) lets the evaluation skip failed steps without
+    the responses. Fields that are not plain scalars (e.g. the
+    structured errors) are stored JSON-encoded.
+
+    Args:
+        experiment_results: results, or path to a results file
+        path (str): output .parquet path
+        compression (str): Parquet codec. Defaults to "zstd".
+    """
+    _require_pyarrow()
+    if isinstance(experiment_results, str):
+        experiment_results = load_results(experiment_results)
+    if not isinstance(experiment_results, dict):
+        experiment_results = pd.Series(experiment_results).to_dict()
+
+    steps = [
+        (entry_id, step_ix, interim_step)
+        for entry_id, history in experiment_results.items()
+        for step_ix, interim_step in enumerate(history)
+    ]
+    fields = list(dict.fromkeys(
+        key for _, _, interim_step in steps for key in interim_step))
+    fields = (
+        [key for key in fields if key not in LARGE_FIELDS]
+        + [key for key in fields if key in LARGE_FIELDS])
+
+    columns = {
+        "entry_id": pa.array([str(entry_id) for entry_id, _, _ in steps]),
+        "step": pa.array([step_ix for _, step_ix, _ in steps], pa.int32()),
+        "_failed": pa.array([
+            step_failed(interim_step) for _, _, interim_step in steps]),
+    }
+    json_fields = []
+    for key in fields:
+        columns[key], encoded = _arrow_column(
+            [interim_step.get(key) for _, _, interim_step in steps])
+        if encoded:
+            json_fields.append(key)
+
+    # Fields absent from a step (rather than None) are listed per row
+    missing = [
+        [key for key in fields if key not in interim_step]
+        for _, _, interim_step in steps
+    ]
+    if any(missing):
+        columns["_missing"] = pa.array(
+            [json.dumps(keys) if keys else None for keys in missing],
+            pa.string())
+
+    metadata = {
+        "json_fields": json.dumps(json_fields),
+        "int_entry_ids": json.dumps(
+            bool(experiment_results) and all(
+                isinstance(entry_id, int) for entry_id in experiment_results)),
+    }
+    table = pa.table(columns).replace_schema_metadata(metadata)
+    pq.write_table(table, path, compression=compression)
+
+
+def _read_columns(
+    path: str, with_responses: bool, columns: list[str] | None,
+) -> dict[str, list]:
+    """Selected columns of a Parquet results file, JSON fields decoded"""
+    _require_pyarrow()
+    schema = pq.read_schema(path)
+    json_fields = set(json.loads(schema.metadata[b"json_fields"]))
+    if columns is None:
+        columns = [
+            name for name in schema.names
+            if with_responses or name not in LARGE_FIELDS]
+    else:
+        columns = ["entry_id", "step", *[
+            name for name in columns
+            if name in schema.names and name not in ("entry_id", "step")]]
+
+    table = pq.read_table(path, columns=columns)
+    return {
+        name: (
+            [json.loads(value) for value in table.column(name).to_pylist()]
+            if name in json_fields else table.column(name).to_pylist()
+        )
+        for name in table.column_names
+    }
+
+
+def read_results_table(
+    path: str, with_responses: bool = False, columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """Reads a Parquet results file as one row per step
+
+    Only the requested columns are read from disk, by default every
+    column but the large response texts
+
+    Args:
+        path (str): path to a file written by `write_results_parquet`
+        with_responses (bool): also read the `LARGE_FIELDS`.
+            Defaults to False.
+        columns (list[str] | None): fields to read, besides `entry_id`
+            and `step`. Defaults to None (see `with_responses`).
+
+    Returns:
+        pd.DataFrame: same layout as `results_to_frame`, plus the
+            `_failed` flag
+    """
+    return pd.DataFrame(_read_columns(path, with_responses, columns))
+
+
+def read_results_parquet(path: str) -> dict:
+    """Reads a Parquet results file back into the histories layout
+
+    Args:
+        path (str): path to a file written by `write_results_parquet`
+
+    Returns:
+        dict: entry_id -> history, as `load_results`
+    """
+    columns = _read_columns(path, with_responses=True, columns=None)
+    int_entry_ids = json.loads(
+        pq.read_schema(path).metadata[b"int_entry_ids"])
+    entry_ids = columns.pop("entry_id")
+    del columns["step"], columns["_failed"]
+    missing = columns.pop("_missing", [None] * len(entry_ids))
+    fields = list(columns)
+
+    results = {}
+    for entry_id, absent, *values in zip(
+            entry_ids, missing, *columns.values()):
+        interim_step = dict(zip(fields, values))
+        for key in json.loads(absent) if absent else []:
+            del interim_step[key]
+        results.setdefault(
+            int(entry_id) if int_entry_ids else entry_id, []).append(
+                interim_step)
+    return results
+
+
+def load_responses(
+    path: str, entry_ids: list | None = None,
+) -> pd.Series:
+    """Lazily reads the response texts of a Parquet results file
+
+    Args:
+        path (str): path to a file written by `write_results_parquet`
+        entry_ids (list | None): entries to read. Defaults to None (all).
+
+    Returns:
+        pd.Series: complete_response indexed by (entry_id, step)
+    """
+    _require_pyarrow()
+    filters = (
+        [("entry_id", "in", [str(entry_id) for entry_id in entry_ids])]
+        if entry_ids is not None else None)
+    steps = pq.read_table(
+        path, columns=["entry_id", "step", "complete_response"],
+        filters=filters,
+    ).to_pandas()
+    return steps.set_index(["entry_id", "step"])["complete_response"]
+
+
+def convert_results(source, destination: str):
+    """Converts experiment results between formats
+
+    The output format follows the extension of `destination`:
+        - .json: `pd.Series(results).to_json(...)`, as results/exp*.json
+        - .jsonl: streaming format of `run_experiment`
+        - .parquet: columnar format of `write_results_parquet`
+
+    Args:
+        source: results, or path to a results file in any format
+        destination (str): output path
+    """
+    results = load_results(source) if isinstance(source, str) else source
+    if not isinstance(results, dict):
+        results = pd.Series(results).to_dict()
+
+    if destination.endswith(".parquet"):
+        write_results_parquet(results, destination)
+    elif destination.endswith(".jsonl"):
+        with open(destination, "w", encoding="utf-8") as file:
+            for entry_id, history in results.items():
+                append_result(file, entry_id, history)
+    else:
+        pd.Series(results).to_json(destination)
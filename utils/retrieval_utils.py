@@ -0,0 +1,307 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from utils.data_utils import estimate_tokens, table_to_sentences, text_cleaner
+
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased word/number tokens used by the lexical index"""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def build_context_units(entry: pd.Series) -> pd.DataFrame:
+    """Splits the context of a raw entry into retrievable units
+
+    Units follow the layout of `full_context` (pre-text sentences,
+    table rows, post-text sentences) and are identified with the
+    ConvFinQA gold index names: text_i indexes pre_text + post_text,
+    table_i indexes the table rows (row 0 being the header).
+    Sentences are cleaned with `text_cleaner` (and dropped where it
+    would drop them), rows are formatted with `table_to_sentences`.
+
+    Args:
+        entry (pd.Series): Single entry from the data provided
+
+    Returns:
+        pd.DataFrame: unit_id, kind ("pre"/"table"/"post") and text
+    """
+    def _sentence_units(kind, texts, offset):
+        units = []
+        for ix, text in enumerate(texts):
+            clean_text = text_cleaner([text])
+            if clean_text:
+                units.append((f"text_{offset + ix}", kind, clean_text))
+        return units
+
+    rows = table_to_sentences(entry.table).split("\n")
+    table_units = [
+        (f"table_{ix + 1}", "table", row) for ix, row in enumerate(rows) if row
+    ]
+
+    return pd.DataFrame(
+        _sentence_units("pre", entry.pre_text, 0)
+        + table_units
+        + _sentence_units("post", entry.post_text, len(entry.pre_text)),
+        columns=["unit_id", "kind", "text"],
+    )
+
+
+class BM25Index:
+    """Okapi BM25 over a small collection of documents, built with NumPy
+
+    Args:
+        documents (list[str]): texts to index
+        k1 (float): term frequency saturation. Defaults to 1.5.
+        b (float): length normalisation. Defaults to 0.75.
+    """
+
+    def __init__(self, documents: list[str], k1: float = 1.5, b: float = 0.75):
+        tokenized = [tokenize(document) for document in documents]
+        self.vocabulary = {
+            token: ix for ix, token in enumerate(
+                dict.fromkeys(token for tokens in tokenized for token in tokens))
+        }
+
+        term_frequencies = np.zeros(
+            (len(documents), len(self.vocabulary)), dtype=float)
+        for doc_ix, tokens in enumerate(tokenized):
+            for token in tokens:
+                term_frequencies[doc_ix, self.vocabulary[token]] += 1
+
+        lengths = term_frequencies.sum(axis=1)
+        average_length = lengths.mean() if len(documents) else 0.0
+        document_frequency = (term_frequencies > 0).sum(axis=0)
+        self.idf = np.log(
+            1 + (len(documents) - document_frequency + 0.5)
+            / (document_frequency + 0.5)
+        )
+        normaliser = k1 * (
+            1 - b + b * lengths / average_length if average_length else 1.0)
+        # Precomputed per (document, term) BM25 weight
+        self.weights = (
+            term_frequencies * (k1 + 1)
+            / (term_frequencies + np.atleast_1d(normaliser)[:, None])
+        ) * self.idf
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for a query
+
+        Args:
+            query (str): query text
+
+        Returns:
+            np.ndarray: one score per document
+        """
+        term_ids = [
+            self.vocabulary[token] for token in set(tokenize(query))
+            if token in self.vocabulary
+        ]
+        if not term_ids:
+            return np.zeros(self.weights.shape[0])
+        return self.weights[:, term_ids].sum(axis=1)
+
+
+def select_units(
+    units: pd.DataFrame, query: str,
+    top_k: int = 10, token_budget: int | None = None,
+) -> pd.DataFrame:
+    """Picks the most relevant units for a query
+
+    Units are taken by decreasing BM25 score, skipping those that do
+    not fit in what is left of `token_budget`, until `top_k` units are
+    taken or the units run out, then put back in document order
+
+    Args:
+        units (pd.DataFrame): output of `build_context_units`
+        query (str): question(s) to answer
+        top_k (int): max number of units. Defaults to 10.
+        token_budget (int | None): max estimated tokens of the selected
+            units. Defaults to None.
+
+    Returns:
+        pd.DataFrame: selected units, in document order
+    """
+    if units.empty:
+        return units
+
+    scores = BM25Index(units["text"].tolist()).scores(query)
+    # Stable sort, so ties keep the document order
+    ranking = np.argsort(-scores, kind="stable")
+
+    # A unit over the remaining budget is skipped for the next ones
+    selected, used_tokens = [], 0
+    for ix in ranking:
+        if len(selected) == top_k:
+            break
+        unit_tokens = estimate_tokens(units["text"].iat[ix])
+        if token_budget is not None and used_tokens + unit_tokens > token_budget:
+            continue
+        selected.append(ix)
+        used_tokens += unit_tokens
+
+    return units.iloc[sorted(selected)]
+
+
+def format_retrieved_context(selected: pd.DataFrame) -> str:
+    """Formats selected units like `full_context`
+
+    Args:
+        selected (pd.DataFrame): output of `select_units`
+
+    Returns:
+        str: context string
+    """
+    blocks = [
+        (" " if kind != "table" else "\n").join(
+            selected.loc[selected["kind"] == kind, "text"])
+        for kind in ["pre", "table", "post"]
+    ]
+    return "Context:\n\n" + "".join(
+        f"{block}\n\n" for block in blocks if block)
+
+
+def _retrieval_query(processed_data_entry, question_to_use: str) -> str:
+    """All questions of a conversation; the context stays fixed across
+    the steps, which also keeps the prompt prefix cacheable"""
+    questions = processed_data_entry.get(question_to_use)
+    if isinstance(questions, str):
+        questions = [questions]
+    return " ".join(questions)
+
+
+class RetrievedEntry:
+    """Lazy processed entry (e.g. `ProcessedEntry`) plus its retrieved
+    context
+
+    Every other field is read from the wrapped entry, so its contexts
+    are still only built if they are used.
+    """
+
+    FIELDS = ("retrieved_context", "retrieved_unit_ids")
+
+    __slots__ = ("entry", "retrieved_context", "retrieved_unit_ids")
+
+    def __init__(self, entry, retrieved_context: str,
+                 retrieved_unit_ids: list[str]):
+        self.entry = entry
+        self.retrieved_context = retrieved_context
+        self.retrieved_unit_ids = retrieved_unit_ids
+
+    def get(self, key: str, default=None):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        return self.entry.get(key, default)
+
+    def __getitem__(self, key: str):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        return self.entry[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS or key in self.entry
+
+    def keys(self) -> tuple:
+        return tuple(self.entry.keys()) + self.FIELDS
+
+    def to_dict(self) -> dict:
+        """Materialises every field"""
+        return {key: self[key] for key in self.keys()}
+
+    def __repr__(self) -> str:
+        return f"RetrievedEntry({self.entry!r})"
+
+
+def add_retrieved_context(
+    raw_table: pd.DataFrame,
+    processed_entries: pd.Series,
+    question_to_use: str = "step_by_step_questions",
+    top_k: int = 10,
+    token_budget: int | None = None,
+) -> pd.Series:
+    """Adds a `retrieved_context` (and `retrieved_unit_ids`) to every
+    processed entry, used by `use_retrieved_context=True`
+
+    Args:
+        raw_table (pd.DataFrame): raw data the entries were processed from
+        processed_entries (pd.Series): output of `process_data_table`,
+            with the same index as raw_table
+        question_to_use (str): questions used as the retrieval query.
+            Defaults to "step_by_step_questions".
+        top_k (int): max number of units. Defaults to 10.
+        token_budget (int | None): max estimated tokens of the selected
+            units. Defaults to None.
+
+    Returns:
+        pd.Series: Collection of dictionaries (`RetrievedEntry` for
+            lazy entries)
+    """
+    output = {}
+    for ix, processed_data_entry in processed_entries.items():
+        selected = select_units(
+            build_context_units(raw_table.loc[ix]),
+            _retrieval_query(processed_data_entry, question_to_use),
+            top_k=top_k, token_budget=token_budget,
+        )
+        retrieved_context = format_retrieved_context(selected)
+        retrieved_unit_ids = selected["unit_id"].tolist()
+        if isinstance(processed_data_entry, dict):
+            output[ix] = {
+                **processed_data_entry,
+                "retrieved_context": retrieved_context,
+                "retrieved_unit_ids": retrieved_unit_ids,
+            }
+        else:
+            output[ix] = RetrievedEntry(
+                processed_data_entry, retrieved_context, retrieved_unit_ids)
+    return pd.Series(output, dtype=object)
+
+
+def gold_unit_ids(entry: pd.Series) -> set[str]:
+    """Gold index names (text_i/table_i) of a raw entry"""
+    qa_fields = (
+        [entry.qa] if isinstance(entry.get("qa"), dict)
+        else [entry.qa_0, entry.qa_1]
+    )
+    return {key for qa in qa_fields for key in qa.get("gold_inds")}
+
+
+def retrieval_report(
+    raw_table: pd.DataFrame, processed_entries: pd.Series,
+) -> dict:
+    """Token savings against full_context and recall against gold_inds
+
+    Args:
+        raw_table (pd.DataFrame): raw data the entries were processed from
+        processed_entries (pd.Series): output of `add_retrieved_context`
+
+    Returns:
+        dict: mean tokens of both contexts, relative token savings,
+            micro-averaged recall and share of entries with full recall
+    """
+    full_tokens, retrieved_tokens = 0, 0
+    n_gold, n_found, n_full_recall = 0, 0, 0
+    for ix, processed_data_entry in processed_entries.items():
+        full_tokens += estimate_tokens(processed_data_entry["full_context"])
+        retrieved_tokens += estimate_tokens(
+            processed_data_entry["retrieved_context"])
+
+        gold = gold_unit_ids(raw_table.loc[ix])
+        found = gold & set(processed_data_entry["retrieved_unit_ids"])
+        n_gold += len(gold)
+        n_found += len(found)
+        n_full_recall += len(found) == len(gold)
+
+    n_entries = len(processed_entries)
+    return {
+        "n_entries": n_entries,
+        "mean_full_context_tokens": full_tokens / n_entries,
+        "mean_retrieved_context_tokens": retrieved_tokens / n_entries,
+        "token_savings": 1 - retrieved_tokens / full_tokens,
+        "gold_recall": n_found / n_gold if n_gold else np.nan,
+        "full_recall_rate": n_full_recall / n_entries,
+    }
@@ -0,0 +1,486 @@
+import asyncio
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+
+import openai
+
+
+# Error categories and whether they are worth retrying
+RETRYABLE_CATEGORIES = {
+    "rate_limit": True,
+    "server": True,
+    "timeout": True,
+    "connection": True,
+    "permanent": False,
+    "circuit_open": False,
+    "unknown": True,
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit breaker is open"""
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when a call runs past the deadline of its `RetryPolicy`"""
+
+
+# Header marking the hedged duplicate of a request (see `HedgePolicy`),
+# so that request deduplication lets it through
+HEDGE_HEADER = "X-Hedged-Attempt"
+
+
+def classify_error(error: Exception) -> str:
+    """Sorts an API error into a retry category
+
+    Args:
+        error (Exception): raised exception
+
+    Returns:
+        str: one of RETRYABLE_CATEGORIES
+    """
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limit"
+    if isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError,
+                          TimeoutError)):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code == 429:
+            return "rate_limit"
+        if error.status_code >= 500:
+            return "server"
+        return "permanent"
+    return "unknown"
+
+
+def retry_after(error: Exception) -> float | None:
+    """Seconds to wait as requested by the provider (Retry-After header)
+
+    Args:
+        error (Exception): raised exception
+
+    Returns:
+        float | None: None when the header is absent or unreadable
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def error_record(error: Exception, attempts: int) -> dict:
+    """Structured description of a failed call, kept in the history"""
+    return {
+        "type": type(error).__name__,
+        "category": classify_error(error),
+        "message": str(error),
+        "status_code": getattr(error, "status_code", None),
+        "attempts": attempts,
+    }
+
+
+class RetryPolicy:
+    """Single retry layer for every API call of a run
+
+    - retries only retryable errors (see `classify_error`),
+      honouring Retry-After on 429s and using random exponential
+      backoff otherwise
+    - a global retry budget: retries may not exceed
+      `budget_ratio` x calls made so far (+ `min_retries`),
+      so that a provider outage does not multiply the load
+    - a circuit breaker: after `breaker_threshold` consecutive failed
+      calls, new calls fail fast for `breaker_cooldown` seconds,
+      then a single probe call is let through
+    - a hard deadline: a call (all its attempts and backoffs) still
+      running after `deadline` seconds is cancelled and raises
+      `DeadlineExceededError`; no retry is started that could not
+      finish in time
+
+    Args:
+        max_attempts (int): attempts per call. Defaults to 3.
+        backoff_min (float): min backoff in seconds. Defaults to 1.
+        backoff_max (float): max backoff in seconds. Defaults to 60.
+        budget_ratio (float | None): retries per call allowed over the
+            run; None disables the budget. Defaults to 0.2.
+        min_retries (int): retries always allowed. Defaults to 10.
+        breaker_threshold (int | None): consecutive failures that open
+            the circuit; None disables it. Defaults to 20.
+        breaker_cooldown (float): seconds the circuit stays open.
+            Defaults to 30.
+        deadline (float | None): seconds a call may take, retries
+            included; `run_sync` can only stop retrying past it.
+            Defaults to None.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        backoff_min: float = 1.0,
+        backoff_max: float = 60.0,
+        budget_ratio: float | None = 0.2,
+        min_retries: int = 10,
+        breaker_threshold: int | None = 20,
+        breaker_cooldown: float = 30.0,
+        deadline: float | None = None,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.budget_ratio = budget_ratio
+        self.min_retries = min_retries
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.deadline = deadline
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.deadline_exceeded = 0
+        self.errors_by_category = {}
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        requested = retry_after(error)
+        if requested is not None:
+            return min(requested, self.backoff_max)
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_min * 2 ** attempt))
+
+    def _budget_allows_retry(self) -> bool:
+        if self.budget_ratio is None:
+            return True
+        return self.retries < self.min_retries + self.budget_ratio * self.calls
+
+    def _check_circuit(self, attempt: int) -> bool:
+        """Raises CircuitOpenError if the call may not go through;
+        True if the call is the probe of the half-open circuit"""
+        if self._opened_at is None:
+            return False
+        if time.monotonic() - self._opened_at < self.breaker_cooldown:
+            raise CircuitOpenError("Circuit breaker open")
+        # Half-open: a single new call probes the provider
+        # (its own retries are let through)
+        if attempt > 1:
+            return False
+        if self._probe_in_flight:
+            raise CircuitOpenError("Circuit breaker half-open")
+        self._probe_in_flight = True
+        return True
+
+    def _record_success(self):
+        self._consecutive_failures = 0
+        self._opened_at = None
+
+    def _record_failure(self, category: str):
+        self.failures += 1
+        if category in ("permanent", "circuit_open"):
+            return
+        self._consecutive_failures += 1
+        if (self.breaker_threshold is not None
+                and self._consecutive_failures >= self.breaker_threshold):
+            self._opened_at = time.monotonic()
+
+    def _should_retry(
+        self, attempt: int, category: str, backoff: float,
+        deadline_at: float | None,
+    ) -> bool:
+        return (
+            RETRYABLE_CATEGORIES[category]
+            and attempt < self.max_attempts
+            and (deadline_at is None
+                 or time.monotonic() + backoff < deadline_at)
+            and self._budget_allows_retry()
+        )
+
+    def _deadline_at(self) -> float | None:
+        return (
+            time.monotonic() + self.deadline
+            if self.deadline is not None else None)
+
+    async def _within_deadline(
+        self, attempt_function: Callable[[], Awaitable],
+        deadline_at: float | None,
+    ):
+        if deadline_at is None:
+            return await attempt_function()
+        try:
+            return await asyncio.wait_for(
+                attempt_function(), deadline_at - time.monotonic())
+        except asyncio.TimeoutError:
+            self.deadline_exceeded += 1
+            raise DeadlineExceededError(
+                f"Call exceeded its {self.deadline}s deadline") from None
+
+    def _start_attempt(self, attempt: int, call_stats: dict | None) -> bool:
+        """Counts the attempt; True if it is the half-open probe"""
+        is_probe = self._check_circuit(attempt)
+        if attempt == 1:
+            self.calls += 1
+        else:
+            self.retries += 1
+        if call_stats is not None:
+            call_stats["attempts"] = attempt
+        return is_probe
+
+    def _failed_attempt(self, error: Exception, call_stats: dict | None) -> str:
+        category = classify_error(error)
+        self.errors_by_category[category] = (
+            self.errors_by_category.get(category, 0) + 1)
+        if call_stats is not None:
+            call_stats.setdefault("errors", []).append(category)
+        return category
+
+    async def run(
+        self, attempt_function: Callable[[], Awaitable],
+        call_stats: dict | None = None,
+    ):
+        """Calls `attempt_function` until it succeeds or the policy
+        gives up, in which case the last error is raised
+
+        Args:
+            attempt_function (Callable[[], Awaitable]): one API attempt
+            call_stats (dict | None): filled in with the number of
+                attempts and the categories of the errors met
+
+        Returns:
+            result of `attempt_function`
+        """
+        attempt = 1
+        is_probe = False
+        deadline_at = self._deadline_at()
+        try:
+            while True:
+                try:
+                    is_probe |= self._start_attempt(attempt, call_stats)
+                    result = await self._within_deadline(
+                        attempt_function, deadline_at)
+                except Exception as error:
+                    category = self._failed_attempt(error, call_stats)
+                    backoff = self._backoff(attempt, error)
+                    if not self._should_retry(
+                            attempt, category, backoff, deadline_at):
+                        self._record_failure(category)
+                        raise
+                    await asyncio.sleep(backoff)
+                    attempt += 1
+                    continue
+                self._record_success()
+                return result
+        finally:
+            # Also when the probe is cancelled, or the circuit would
+            # stay half-open with no call allowed through
+            if is_probe:
+                self._probe_in_flight = False
+
+    def run_sync(
+        self, attempt_function: Callable, call_stats: dict | None = None,
+    ):
+        """Blocking version of `run`"""
+        attempt = 1
+        is_probe = False
+        deadline_at = self._deadline_at()
+        try:
+            while True:
+                try:
+                    is_probe |= self._start_attempt(attempt, call_stats)
+                    result = attempt_function()
+                except Exception as error:
+                    category = self._failed_attempt(error, call_stats)
+                    backoff = self._backoff(attempt, error)
+                    if not self._should_retry(
+                            attempt, category, backoff, deadline_at):
+                        self._record_failure(category)
+                        raise
+                    time.sleep(backoff)
+                    attempt += 1
+                    continue
+                self._record_success()
+                return result
+        finally:
+            if is_probe:
+                self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        """Calls, retries, final failures, deadlines exceeded and errors
+        per category"""
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "deadline_exceeded": self.deadline_exceeded,
+            "errors_by_category": dict(self.errors_by_category),
+            "circuit_open": self._opened_at is not None,
+        }
+
+
+class HedgePolicy:
+    """Hedged requests for the attempts of API calls
+
+    An attempt still running after the hedge delay gets a duplicate;
+    the first one to succeed is used and the other one is cancelled.
+    The delay is `hedge_after` seconds or, with `hedge_quantile`, that
+    quantile of the recent attempt latencies (once `min_samples` have
+    been observed). Hedges are capped at `max_hedge_ratio` x the calls
+    made so far, so that a slow provider does not get twice the load.
+
+    The duplicate is started as `attempt_function(hedge=sent)`: the
+    attempt marks its request with `HEDGE_HEADER` (so that it is not
+    merged with the request it duplicates) and sets the `sent` event
+    once the request goes out. Only the duplicates actually sent are
+    counted as hedges.
+
+    Args:
+        hedge_after (float | None): fixed hedge delay in seconds.
+            Defaults to None.
+        hedge_quantile (float | None): latency quantile used as the
+            hedge delay, e.g. 0.95; used over `hedge_after` once enough
+            latencies are observed. Defaults to None.
+        max_hedge_ratio (float): hedges per call allowed.
+            Defaults to 0.1.
+        window (int): latencies kept for the quantile. Defaults to 200.
+        min_samples (int): latencies needed before the quantile is
+            used. Defaults to 20.
+    """
+
+    def __init__(
+        self,
+        hedge_after: float | None = None,
+        hedge_quantile: float | None = None,
+        max_hedge_ratio: float = 0.1,
+        window: int = 200,
+        min_samples: int = 20,
+    ):
+        self.hedge_after = hedge_after
+        self.hedge_quantile = hedge_quantile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_samples = min_samples
+
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.latency_saved = 0.0
+        self._hedges_started = 0
+        self._latencies = deque(maxlen=window)
+
+    def hedge_delay(self) -> float | None:
+        """Seconds after which an attempt is hedged, None if never"""
+        if (self.hedge_quantile is not None
+                and len(self._latencies) >= self.min_samples):
+            latencies = sorted(self._latencies)
+            return latencies[min(
+                int(self.hedge_quantile * len(latencies)),
+                len(latencies) - 1)]
+        return self.hedge_after
+
+    def _estimated_saving(self, elapsed: float) -> float:
+        """Expected extra wait of an attempt still running after
+        `elapsed` seconds, from the observed latencies"""
+        slower = [latency for latency in self._latencies if latency > elapsed]
+        return sum(slower) / len(slower) - elapsed if slower else 0.0
+
+    async def run(
+        self, attempt_function: Callable[..., Awaitable],
+        call_stats: dict | None = None,
+    ):
+        """Runs one attempt, hedged
+
+        Args:
+            attempt_function (Callable[..., Awaitable]): one API
+                attempt, taking the `hedge` event of a duplicate
+            call_stats (dict | None): `hedged` and `hedge_won` are set
+                when a duplicate was sent. Defaults to None.
+
+        Returns:
+            result of the first successful attempt
+        """
+        self.calls += 1
+        start_time = time.monotonic()
+        primary = asyncio.ensure_future(attempt_function())
+        tasks = {primary}
+        delay = self.hedge_delay()
+        hedge_sent = None  # set once the duplicate's request is sent
+        errors = []
+        try:
+            while True:
+                can_hedge = (
+                    delay is not None and hedge_sent is None
+                    and self._hedges_started < self.max_hedge_ratio * self.calls)
+                done, _ = await asyncio.wait(
+                    tasks,
+                    timeout=(
+                        max(start_time + delay - time.monotonic(), 0)
+                        if can_hedge else None),
+                    return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    now = time.monotonic()
+                    if task is not primary:
+                        self.hedge_wins += 1
+                        self.latency_saved += self._estimated_saving(
+                            now - start_time)
+                        if call_stats is not None:
+                            call_stats["hedge_won"] = True
+                    # From the first attempt's start: when the hedge
+                    # wins, this is how long the primary took at least,
+                    # whereas the hedge's own latency would drag the
+                    # quantile (and so the hedge delay) down
+                    self._latencies.append(now - start_time)
+                    return task.result()
+
+                if not tasks:
+                    raise errors[0]
+                if can_hedge and time.monotonic() - start_time >= delay:
+                    self._hedges_started += 1
+                    hedge_sent = asyncio.Event()
+                    tasks.add(asyncio.ensure_future(
+                        attempt_function(hedge=hedge_sent)))
+        finally:
+            for task in tasks:
+                task.cancel()
+            if hedge_sent is not None and hedge_sent.is_set():
+                self.hedged += 1
+                if call_stats is not None:
+                    call_stats["hedged"] = True
+
+    def stats(self) -> dict:
+        """Hedges sent, hedge wins and the estimated latency saved by
+        the hedges (seconds)"""
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "latency_saved": self.latency_saved,
+            "hedge_delay": self.hedge_delay(),
+        }
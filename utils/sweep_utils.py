@@ -0,0 +1,355 @@
+import asyncio
+import itertools
+import os
+from dataclasses import fields, replace
+from time import monotonic
+from types import SimpleNamespace
+
+from openai import AsyncOpenAI
+
+from utils.cache_utils import ResponseCache, completion_cache_key
+from utils.data_utils import estimate_tokens
+from utils.model_utils import (
+    AsyncRateLimiter, RunAborted, RunConfig, report_pool_stats,
+    report_retry_stats, run_experiment)
+from utils.retry_utils import HEDGE_HEADER, RetryPolicy
+
+
+# Grid keys that expand to several RunConfig fields
+CONTEXT_MODES = {
+    mode: {
+        "use_short_context": mode == "short",
+        "use_gold_inds": mode == "gold_inds",
+        "use_retrieved_context": mode == "retrieved",
+    }
+    for mode in ["full", "short", "gold_inds", "retrieved"]
+}
+
+# RunConfig fields of the retry policy a sweep shares between its runs
+SWEEP_RETRY_FIELDS = (
+    "max_attempts", "retry_budget_ratio", "circuit_breaker_threshold",
+    "circuit_breaker_cooldown", "call_deadline",
+)
+
+QUESTION_SETS = {
+    "question": {
+        "question_to_use": "question", "answers_to_use": "answer"},
+    "step_by_step": {
+        "question_to_use": "step_by_step_questions",
+        "answers_to_use": "step_by_step_answers"},
+}
+
+
+def make_run_config(
+    settings: dict, base: RunConfig | None = None,
+) -> RunConfig:
+    """Builds a RunConfig from sweep settings
+
+    Besides the RunConfig fields, accepts `context` (one of
+    CONTEXT_MODES) and `questions` (one of QUESTION_SETS)
+
+    Args:
+        settings (dict): setting name -> value
+        base (RunConfig | None): defaults for the settings not given.
+            Defaults to None.
+
+    Returns:
+        RunConfig: run configuration
+    """
+    settings = dict(settings)
+    expanded = {}
+    if "context" in settings:
+        expanded.update(CONTEXT_MODES[settings.pop("context")])
+    if "questions" in settings:
+        expanded.update(QUESTION_SETS[settings.pop("questions")])
+
+    unknown = set(settings) - {field.name for field in fields(RunConfig)}
+    if unknown:
+        raise ValueError(f"Unknown sweep settings: {sorted(unknown)}")
+
+    return replace(base or RunConfig(), **{**expanded, **settings})
+
+
+def _labelled(values) -> list[tuple[str, object]]:
+    """Grid values as (label, value) pairs; dicts are label -> value"""
+    if isinstance(values, dict):
+        return list(values.items())
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    return [(str(value), value) for value in values]
+
+
+def expand_grid(
+    grid: dict, base: RunConfig | None = None,
+) -> dict[str, RunConfig]:
+    """Cartesian product of a sweep grid
+
+    Grid values are lists, or dicts of label -> value for values
+    that make poor names (e.g. {"v3": SYSTEM_PROMPT_V3}).
+    Experiments are named after the labels of the settings that vary,
+    e.g. "deepseek-chat-v3-short"
+
+    Args:
+        grid (dict): setting name (see `make_run_config`) -> values
+        base (RunConfig | None): defaults for the settings not in the
+            grid. Defaults to None.
+
+    Returns:
+        dict[str, RunConfig]: experiment name -> run configuration
+    """
+    keys = list(grid)
+    options = [_labelled(grid[key]) for key in keys]
+    varying = [len(option) > 1 for option in options]
+
+    configs = {}
+    for combination in itertools.product(*options):
+        name = "-".join(
+            label for (label, _), varies in zip(combination, varying)
+            if varies
+        ) or "experiment"
+        configs[name] = make_run_config(
+            {key: value for key, (_, value) in zip(keys, combination)},
+            base=base)
+    return configs
+
+
+class _MeteredStream:
+    """Stream that reports its true usage to a rate limiter"""
+
+    def __init__(self, stream, rate_limiter: AsyncRateLimiter,
+                 estimated_tokens: int):
+        self._stream = stream
+        self._rate_limiter = rate_limiter
+        self._estimated_tokens = estimated_tokens
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            if getattr(chunk, "usage", None) is not None:
+                self._rate_limiter.record(
+                    chunk.usage.total_tokens - self._estimated_tokens)
+            yield chunk
+
+    async def close(self):
+        await self._stream.close()
+
+
+class DeduplicatingClient:
+    """Wraps an AsyncOpenAI client so that identical completion requests
+    are sent once
+
+    Concurrent identical requests wait for the one in flight, later
+    ones reuse its response (the `max_responses` most recently used
+    responses are kept in memory). Failed requests are not kept, so
+    each caller's retry policy still applies. Streamed, sampled (temperature above 0) and
+    hedged (`HEDGE_HEADER`) requests are passed through, as identical
+    samples must still get independent answers and a hedge must reach
+    the API to be of any use.
+
+    With a `rate_limiter`, the wrapper charges it for the requests it
+    actually sends, so that requests served by an identical one do not
+    use up the budget; its callers should then not be rate limited
+    themselves (see `run_sweep`).
+
+    Args:
+        client (AsyncOpenAI): OpenAI client
+        rate_limiter (AsyncRateLimiter | None): limiter of the requests
+            sent to the API. Defaults to None.
+        max_responses (int): responses kept for later identical
+            requests, least recently used first out. Defaults to 10000.
+    """
+
+    def __init__(
+        self, client: AsyncOpenAI,
+        rate_limiter: AsyncRateLimiter | None = None,
+        max_responses: int = 10000,
+    ):
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.max_responses = max_responses
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self._create))
+        # key -> completed (or in flight) task, least recently used first
+        self._responses = {}
+        self.requests = 0
+        self.deduplicated = 0
+
+    async def _create(self, **kwargs):
+        self.requests += 1
+        if (kwargs.get("stream") or (kwargs.get("temperature") or 0) > 0
+                or HEDGE_HEADER in (kwargs.get("extra_headers") or {})):
+            return await self._send(kwargs)
+
+        key = completion_cache_key(
+            kwargs.get("model"), kwargs.get("messages"),
+            kwargs.get("temperature"), kwargs.get("max_tokens"),
+            kwargs.get("response_format"),
+            extra={
+                name: value for name, value in kwargs.items()
+                if name not in ("model", "messages", "temperature",
+                                "max_tokens", "response_format")
+            },
+        )
+        task = self._responses.pop(key, None)
+        if task is not None:
+            self.deduplicated += 1
+        else:
+            # Sent from its own task, so that a caller being cancelled
+            # (e.g. an aborted run) does not cancel it for the others
+            task = asyncio.create_task(self._send_once(key, kwargs))
+            if len(self._responses) >= self.max_responses:
+                # The callers of an evicted request still await it
+                del self._responses[next(iter(self._responses))]
+        self._responses[key] = task
+        return await asyncio.shield(task)
+
+    async def _send_once(self, key: str, kwargs: dict):
+        try:
+            return await self._send(kwargs)
+        except BaseException:
+            if self._responses.get(key) is asyncio.current_task():
+                del self._responses[key]
+            raise
+
+    async def _send(self, kwargs: dict):
+        """Sends a request to the API, within the rate limits"""
+        if self.rate_limiter is None:
+            return await self.client.chat.completions.create(**kwargs)
+
+        estimated_tokens = estimate_tokens(kwargs.get("messages") or [])
+        await self.rate_limiter.acquire(estimated_tokens)
+        response = await self.client.chat.completions.create(**kwargs)
+        if kwargs.get("stream"):
+            return _MeteredStream(
+                response, self.rate_limiter, estimated_tokens)
+        if getattr(response, "usage", None):
+            self.rate_limiter.record(
+                response.usage.total_tokens - estimated_tokens)
+        return response
+
+    def stats(self) -> dict:
+        """Requests received and requests served without an API call"""
+        return {
+            "requests": self.requests,
+            "deduplicated": self.deduplicated,
+            "api_calls": self.requests - self.deduplicated,
+        }
+
+
+def sweep_retry_policy(configs: dict[str, RunConfig]) -> RetryPolicy:
+    """Retry policy shared by the runs of a sweep
+
+    Args:
+        configs (dict[str, RunConfig]): experiment name -> run
+            configuration
+
+    Raises:
+        ValueError: when the configs set different retry or deadline
+            settings (SWEEP_RETRY_FIELDS)
+
+    Returns:
+        RetryPolicy: the retry policy of the configs
+    """
+    differing = [
+        name for name in SWEEP_RETRY_FIELDS
+        if len({getattr(config, name) for config in configs.values()}) > 1
+    ]
+    if differing:
+        raise ValueError(
+            f"The runs of a sweep share one retry policy, but the configs "
+            f"set different {differing}")
+    return next(iter(configs.values()), RunConfig()).retry_policy()
+
+
+async def run_sweep(
+    processed_entries,
+    configs: dict[str, RunConfig],
+    client: AsyncOpenAI,
+    results_dir: str = "results",
+    cache: ResponseCache | None = None,
+    requests_per_minute: int | None = None,
+    tokens_per_minute: int | None = None,
+    retry_policy: RetryPolicy | None = None,
+    deduplicate: bool = True,
+) -> dict[str, list[list[dict]]]:
+    """Runs several experiments concurrently on one event loop
+
+    Every config is a `run_experiment` over the same entries, written to
+    its own `<results_dir>/<name>.jsonl` (and resumed from it).
+    All runs share one rate limiter and one retry policy, so the
+    provider sees the limits of the sweep as a whole, and, with
+    `deduplicate`, requests that are identical across configs (or
+    across repeated entries) reach the API once, and only those are
+    charged to the rate limiter. The sweep then takes
+    about as long as its largest config rather than the sum of them.
+
+    Args:
+        processed_entries: processed data entries, see `run_experiment`
+        configs (dict[str, RunConfig]): experiment name -> run
+            configuration, e.g. the output of `expand_grid`
+        client (AsyncOpenAI): OpenAI client
+        results_dir (str): folder of the results files.
+            Defaults to "results".
+        cache (ResponseCache | None): on-disk response cache.
+            Defaults to None.
+        requests_per_minute (int | None): limit of the whole sweep.
+            Defaults to None.
+        tokens_per_minute (int | None): limit of the whole sweep.
+            Defaults to None.
+        retry_policy (RetryPolicy | None): retry policy (and call
+            deadline) of the whole sweep, used over the retry settings
+            of the configs. Defaults to None (`sweep_retry_policy`).
+        deduplicate (bool): send identical requests once.
+            Defaults to True.
+
+    Raises:
+        ValueError: when the configs set different retry or deadline
+            settings, see `sweep_retry_policy`
+
+    Returns:
+        dict[str, list[list[dict]]]: experiment name -> histories
+            (None for the experiments aborted by their online
+            evaluation, see `RunConfig.abort_below_parsable`)
+    """
+    shared_retry_policy = sweep_retry_policy(configs)
+    retry_policy = retry_policy or shared_retry_policy
+    os.makedirs(results_dir, exist_ok=True)
+    rate_limiter = AsyncRateLimiter(
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+    )
+    if deduplicate:
+        # The limits apply to the requests that reach the API, so the
+        # client wrapper is limited rather than the runs
+        sweep_client = DeduplicatingClient(client, rate_limiter=rate_limiter)
+        run_rate_limiter = AsyncRateLimiter()
+    else:
+        sweep_client, run_rate_limiter = client, rate_limiter
+
+    async def _run(name):
+        try:
+            return await run_experiment(
+                processed_entries, configs[name], sweep_client,
+                cache=cache,
+                results_path=os.path.join(results_dir, f"{name}.jsonl"),
+                rate_limiter=run_rate_limiter,
+                retry_policy=retry_policy,
+                experiment_name=name,
+            )
+        except RunAborted:
+            # Already reported; the other experiments go on
+            return None
+
+    start_time = monotonic()
+    names = list(configs)
+    results = await asyncio.gather(*[_run(name) for name in names])
+
+    print(f"Sweep of {len(names)} experiments done in "
+          f"{monotonic() - start_time:.0f}s")
+    if deduplicate:
+        dedup_stats = sweep_client.stats()
+        print(f"{dedup_stats['deduplicated']} of {dedup_stats['requests']} "
+              f"requests served by an identical request")
+    report_retry_stats(retry_policy)
+    report_pool_stats(client)
+
+    return dict(zip(names, results))